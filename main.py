@@ -2,15 +2,26 @@
 import os
 import sys
 import json
+import atexit
 import shutil
-from datetime import datetime
+import time
+import uuid
+from datetime import datetime, timedelta
 from modules.questionnaire import DailyQuestionnaire
 from modules.scoring import ScoringSystem
 from modules.data_manager import DataManager
-from modules.report_generator import ReportGenerator
-from modules.excel_handler import ExcelHandler
+from modules.report_generator import (
+    ReportGenerator, REPORT_MODE_LLM, REPORT_MODE_TEMPLATE, REPORT_MODE_TEMPLATE_FIRST,
+    PDF_BACKEND_AUTO, PROMPT_BUDGET_TOKENS
+)
+from modules.excel_handler import ExcelHandler, QUESTIONNAIRE_FILE_PATTERN
 from modules.redemption_system import RedemptionSystem
 from modules.questionnaire_optimizer import QuestionnaireOptimizer
+from modules.bulk_importer import BulkImporter
+from modules.batch_exporter import BatchExporter
+from modules.llm_client import default_client
+from modules.report_jobs import ReportJobQueue, STATUS_DISPLAY, DONE, FAILED
+from modules.folder_watcher import QuestionnaireWatcher
 
 
 class StudyDiary:
@@ -18,10 +29,23 @@ class StudyDiary:
         self.questionnaire = DailyQuestionnaire()
         self.scoring = ScoringSystem()
         self.data_manager = DataManager()
-        self.report_generator = ReportGenerator(self.data_manager)
+        # 报告模式：llm（默认）、template（纯模板）、template_first（先出模板报告再后台润色）
+        self.report_generator = ReportGenerator(
+            self.data_manager,
+            mode=os.environ.get('REPORT_MODE', REPORT_MODE_LLM),
+            scoring=self.scoring,
+            # PDF后端：auto（有weasyprint时生成PDF）、weasyprint、pandoc、none
+            pdf_backend=os.environ.get('REPORT_PDF_BACKEND', PDF_BACKEND_AUTO),
+            prompt_budget=int(os.environ.get('REPORT_PROMPT_BUDGET', PROMPT_BUDGET_TOKENS))
+        )
         self.excel_handler = ExcelHandler()
         self.redemption_system = RedemptionSystem(self.data_manager)
         self.questionnaire_optimizer = QuestionnaireOptimizer()
+        self.bulk_importer = BulkImporter(
+            self.data_manager, self.scoring, self.questionnaire,
+            self.excel_handler, self.report_generator
+        )
+        self.report_jobs = ReportJobQueue(self.report_generator, self.data_manager, self.scoring)
     
     def run(self):
         print("=" * 60)
@@ -29,7 +53,13 @@ class StudyDiary:
         print("=" * 60)
         print()
         
+        # 继续上次退出时还没生成完的报告
+        resumed = self.report_jobs.resume()
+        if resumed:
+            print(f"⏳ 继续在后台生成上次未完成的{resumed}份报告")
+        
         while True:
+            self._show_report_notifications()
             self.show_menu()
             choice = input("\n请选择操作 (输入数字): ").strip()
             
@@ -55,7 +85,16 @@ class StudyDiary:
                 self.export_data()
             elif choice == '11':
                 self.rollback_day()
+            elif choice == '12':
+                self.bulk_import_questionnaires()
+            elif choice == '13':
+                self.view_report_jobs()
+            elif choice == '14':
+                self.search_history()
             elif choice == '0':
+                unfinished = self.report_jobs.count_unfinished()
+                if unfinished:
+                    print(f"\n⏳ 还有{unfinished}份报告未生成完，下次启动时会继续生成")
                 print("\n👋 再见！继续加油，考公必胜！")
                 break
             else:
@@ -73,10 +112,13 @@ class StudyDiary:
         print("5. 📄 查看今日报告")
         print("6. 📊 查看积分历史")
         print("7. 📈 查看学习统计")
-        print("8. 📅 生成周总结")
+        print("8. 📅 生成周/月总结")
         print("9. 📉 可视化进度")
         print("10. 💾 导出数据")
         print("11. 🔄 回档（删除某天记录）")
+        print("12. 📦 批量补录历史问卷")
+        print("13. 📋 报告生成任务")
+        print("14. 🔍 搜索历史记录")
         print("0. 退出系统")
     
     def export_questionnaire_excel(self):
@@ -85,7 +127,9 @@ class StudyDiary:
         print("=" * 50)
         
         questions = self.questionnaire.generate_questionnaire()
-        filepath = self.excel_handler.export_questionnaire(questions)
+        filepath = self.excel_handler.export_questionnaire(
+            questions, self.questionnaire.get_schema_version()
+        )
         
         print(f"\n✅ 问卷已导出: {filepath}")
         print("\n📝 请将此文件发送给ZZW进行填写")
@@ -96,10 +140,10 @@ class StudyDiary:
         print("📥 导入问卷答案")
         print("=" * 50)
         
-        # 显示可用的Excel文件
+        # 显示可用的问卷文件（Excel或JSON/CSV答案提交）
         questionnaire_dir = self.excel_handler.questionnaire_dir
         files = [f for f in os.listdir(questionnaire_dir) 
-                if f.endswith('.xlsx') and f.startswith('daily_questionnaire_')]
+                if QUESTIONNAIRE_FILE_PATTERN.match(f)]
         
         if not files:
             print("\n❌ 没有找到问卷文件")
@@ -121,15 +165,28 @@ class StudyDiary:
             print(f"\n❌ 文件不存在: {filepath}")
             return
         
+        # 解析一次，验证和导入共用
+        try:
+            parsed = self.excel_handler.open_questionnaire(filepath)
+        except Exception as e:
+            print(f"\n❌ 无法读取问卷文件: {e}")
+            return
+        
         # 验证文件
-        if not self.excel_handler.validate_excel_file(filepath):
+        if not self.excel_handler.validate_excel_file(parsed):
+            parsed.close()
             print("\n❌ 文件格式不正确或没有填写答案")
             return
         
         try:
             # 导入答案
             questions = self.questionnaire.generate_questionnaire()
-            responses = self.excel_handler.import_answers(filepath, questions)
+            try:
+                responses = self.excel_handler.import_answers(
+                    filepath, questions, parsed, self.questionnaire.get_schema_version()
+                )
+            finally:
+                parsed.close()
             
             # 处理响应
             processed_responses = self.questionnaire.process_responses(responses)
@@ -148,11 +205,8 @@ class StudyDiary:
             total_points = self.data_manager.get_total_points()
             level_info = self.scoring.get_level_info(total_points)
             
-            # 生成报告
-            print("\n⏳ 正在生成每日总结报告...")
-            report_path = self.report_generator.generate_report(
-                processed_responses, point_details, total_points, level_info
-            )
+            # 报告在后台生成，不阻塞导入
+            report_status = self._start_daily_report(processed_responses, point_details, total_points, level_info)
             
             # 显示结果
             print("\n" + "=" * 50)
@@ -167,7 +221,7 @@ class StudyDiary:
             encouragement = self.scoring.get_encouragement_message(total_points, points)
             print(f"\n{encouragement}")
             
-            print(f"\n📄 报告已生成: {report_path}")
+            self._print_daily_report_status(report_status)
             
             # 移动已处理的文件到已回答文件夹
             answered_dir = os.path.join(questionnaire_dir, "answered")
@@ -183,6 +237,103 @@ class StudyDiary:
         except Exception as e:
             print(f"\n❌ 导入失败: {e}")
     
+    def bulk_import_questionnaires(self):
+        print("\n" + "=" * 50)
+        print("📦 批量补录历史问卷")
+        print("=" * 50)
+        
+        # 上次补录留下的待生成报告
+        checkpoint = self.bulk_importer.load_checkpoint()
+        if checkpoint.get('pending_reports'):
+            print(f"\n📄 有 {len(checkpoint['pending_reports'])} 天的报告尚未生成")
+            if input("现在生成这些报告吗？(y/n): ").strip().lower() == 'y':
+                self.bulk_importer.generate_pending_reports()
+        
+        directory = input(f"\n请输入问卷所在目录 (默认 {self.excel_handler.questionnaire_dir}): ").strip()
+        directory = directory or self.excel_handler.questionnaire_dir
+        
+        filepaths = self.bulk_importer.find_workbooks(directory)
+        if not filepaths:
+            print(f"\n❌ 目录中没有找到问卷文件: {directory}")
+            return
+        
+        print(f"\n找到 {len(filepaths)} 份问卷:")
+        print(f"   {os.path.basename(filepaths[0])} ~ {os.path.basename(filepaths[-1])}")
+        
+        confirm = input("\n确认导入？(y/n): ").strip().lower()
+        if confirm != 'y':
+            print("\n已取消导入")
+            return
+        
+        generate_reports = input("导入后立即生成报告吗？(y=立即生成, n=稍后生成): ").strip().lower() == 'y'
+        
+        print("\n⏳ 正在批量导入...")
+        result = self.bulk_importer.run(filepaths, generate_reports=generate_reports)
+        
+        print("\n" + "=" * 50)
+        print(f"✅ 成功导入: {len(result['imported'])}份")
+        if result['skipped']:
+            print(f"⏭️ 已跳过: {result['skipped']}份（之前已导入）")
+        if result['failed']:
+            print(f"❌ 失败: {len(result['failed'])}份")
+            for item in result['failed']:
+                print(f"   - {os.path.basename(item['file'])}: {item['error']}")
+        if result['pending_reports']:
+            print(f"📄 待生成报告: {len(result['pending_reports'])}天（可再次进入本菜单生成）")
+        print(f"💰 当前总积分: {self.data_manager.get_total_points()}分")
+    
+    def batch_export_questionnaires(self, users_file: str, max_workers: int = None):
+        """为多个用户批量导出今日问卷（用户列表为JSON：ID列表或带id字段的对象列表）"""
+        with open(users_file, 'r', encoding='utf-8') as f:
+            users = json.load(f)
+        if isinstance(users, dict):
+            users = users.get('users', [])
+        
+        exporter = BatchExporter(self.excel_handler, max_workers=max_workers)
+        result = exporter.export(
+            users,
+            self.questionnaire.generate_questionnaire(),
+            self.questionnaire.get_schema_version()
+        )
+        
+        print("\n" + "=" * 50)
+        print(f"✅ 已导出: {len(result['files'])}份，输出目录: {exporter.output_root}")
+        if result['failed']:
+            print(f"❌ 失败: {len(result['failed'])}份")
+        print(f"⏱️ 总耗时: {result['total_seconds']:.2f}秒，吞吐量: {result['files_per_second']:.1f}份/秒")
+        return result
+    
+    def show_llm_status(self):
+        """显示Gemini调用层的熔断状态和限流排队情况"""
+        client = default_client()
+        health = client.health()
+        print("\n" + "=" * 50)
+        print("🤖 Gemini调用状态")
+        print("=" * 50)
+        if client.is_available():
+            print(f"✅ 可用（连续失败{health.get('consecutive_failures', 0)}次）")
+        else:
+            resume_at = datetime.fromtimestamp(health['open_until']).strftime("%H:%M:%S")
+            print(f"⛔ 暂停调用至 {resume_at}（连续失败{health['consecutive_failures']}次）")
+        if health.get('last_error'):
+            print(f"最近错误: {health['last_error']}")
+        
+        status = client.rate_limiter.status()
+        print(f"\n限流: 每分钟{client.rate_limiter.rate * 60:.0f}次，最多同时{client.rate_limiter.max_concurrent}个")
+        print(f"当前: 进行中{status['active']}个，排队{status['queued']}个，可用令牌{status['tokens']}")
+        print(f"排队时间: 平均{status['avg_wait']:.1f}秒，最长{status['max_wait']:.1f}秒，"
+              f"最近一次{status['last_wait']:.1f}秒（共{status['calls']}次调用）")
+    
+    def watch_questionnaire_folder(self, directory: str = None, generate_reports: bool = False):
+        """持续监听问卷目录，自动导入新提交的问卷"""
+        watcher = QuestionnaireWatcher(
+            self.bulk_importer,
+            directory or self.excel_handler.questionnaire_dir,
+            generate_reports=generate_reports
+        )
+        print("按 Ctrl+C 停止监听")
+        watcher.run_forever()
+    
     def view_redemption_shop(self):
         print("\n" + "=" * 50)
         print("🎁 积分兑换商城")
@@ -191,24 +342,11 @@ class StudyDiary:
         total_points = self.data_manager.get_total_points()
         print(f"\n💰 当前可用积分: {total_points}分")
         
-        # 显示可兑换的奖励
-        available_rewards = self.redemption_system.get_available_rewards(total_points)
-        
-        if not available_rewards:
+        affordable = self.redemption_system.search_rewards(max_points=total_points, page_size=1)
+        if not affordable['total']:
             print("\n😔 当前积分还不够兑换任何奖励，继续加油！")
         else:
-            print(f"\n✨ 你可以兑换以下{len(available_rewards)}项奖励:")
-            print("-" * 40)
-            
-            for i, reward in enumerate(available_rewards):
-                print(f"{i+1}. {reward['emoji']} {reward['name']} - {reward['points']}分")
-                print(f"   {reward['description']}")
-                print()
-        
-        # 显示全部奖励列表
-        print("\n📜 查看完整奖励列表:")
-        rewards_display = self.redemption_system.format_rewards_display()
-        print(rewards_display)
+            print(f"\n✨ 你可以兑换{affordable['total']}项奖励（输入 a 只看这些）")
         
         # 显示兑换统计
         stats = self.redemption_system.get_redemption_stats()
@@ -216,6 +354,59 @@ class StudyDiary:
             print("\n📊 兑换统计:")
             print(f"总兑换次数: {stats['total_redemptions']}次")
             print(f"累计消耗积分: {stats['total_points_spent']}分")
+        
+        self._browse_rewards(total_points)
+    
+    def _browse_rewards(self, total_points: int, selectable: bool = False,
+                        affordable_only: bool = False):
+        """
+        分页浏览奖励目录，每次只渲染一页
+        
+        selectable为True时可以输入本页编号选择奖励并返回，否则返回None。
+        """
+        query, category, page = '', None, 1
+        while True:
+            result = self.redemption_system.search_rewards(
+                query, category, total_points if affordable_only else None, page
+            )
+            filters = [f"关键词「{query}」" if query else '',
+                       f"类别：{dict(self.redemption_system.get_categories()).get(category, category)}" if category else '',
+                       "只看买得起的" if affordable_only else '']
+            filters = '，'.join(f for f in filters if f)
+            print(f"\n📜 奖励列表{'（' + filters + '）' if filters else ''}")
+            print(self.redemption_system.format_rewards_page(result, numbered=selectable))
+            
+            hint = "n下一页 p上一页 s搜索 c类别 a只看买得起/全部 x清除筛选"
+            hint += " 编号选择 0取消" if selectable else " 0返回"
+            command = input(f"\n{hint}: ").strip()
+            
+            if command in ('0', 'q'):
+                return None
+            elif command in ('', 'n'):
+                if result['page'] >= result['pages'] and command == '':
+                    return None
+                page = result['page'] + 1
+            elif command == 'p':
+                page = result['page'] - 1
+            elif command.startswith('s'):
+                query = command[1:].strip() or input("请输入关键词: ").strip()
+                page = 1
+            elif command == 'c':
+                categories = self.redemption_system.get_categories()
+                for i, (_, name) in enumerate(categories, 1):
+                    print(f"{i}. {name}")
+                choice = input("请选择类别编号 (0为全部): ").strip()
+                category = categories[int(choice) - 1][0] if choice.isdigit() and 0 < int(choice) <= len(categories) else None
+                page = 1
+            elif command == 'a':
+                affordable_only = not affordable_only
+                page = 1
+            elif command == 'x':
+                query, category, page = '', None, 1
+            elif selectable and command.isdigit() and 0 < int(command) <= len(result['items']):
+                return result['items'][int(command) - 1]
+            else:
+                print("❌ 无效的输入")
     
     def redeem_reward(self):
         print("\n" + "=" * 50)
@@ -225,27 +416,18 @@ class StudyDiary:
         total_points = self.data_manager.get_total_points()
         print(f"\n💰 当前可用积分: {total_points}分")
         
-        available_rewards = self.redemption_system.get_available_rewards(total_points)
-        
-        if not available_rewards:
+        if not self.redemption_system.search_rewards(max_points=total_points, page_size=1)['total']:
             print("\n😔 当前积分还不够兑换任何奖励")
             return
         
-        print("\n可兑换的奖励:")
-        for i, reward in enumerate(available_rewards):
-            print(f"{i+1}. {reward['emoji']} {reward['name']} - {reward['points']}分")
+        reward = self._browse_rewards(total_points, selectable=True, affordable_only=True)
         
-        choice = input("\n请选择要兑换的奖励编号 (0取消): ").strip()
-        
-        if choice == '0':
+        if reward is None:
             print("\n已取消兑换")
             return
         
-        if not choice.isdigit() or int(choice) < 1 or int(choice) > len(available_rewards):
-            print("\n❌ 无效的选择")
-            return
-        
-        reward = available_rewards[int(choice) - 1]
+        # 这次兑换的幂等键：重复提交同一次兑换不会重复扣分
+        request_id = uuid.uuid4().hex
         
         # 确认兑换
         confirm = input(f"\n确认要兑换 '{reward['name']}' 吗？将消耗 {reward['points']} 积分 (y/n): ").strip().lower()
@@ -255,7 +437,7 @@ class StudyDiary:
             return
         
         # 执行兑换
-        success, message = self.redemption_system.redeem_reward(reward['id'])
+        success, message = self.redemption_system.redeem_reward(reward['id'], request_id)
         
         if success:
             print(f"\n🎉 {message}")
@@ -317,11 +499,8 @@ class StudyDiary:
         total_points = self.data_manager.get_total_points()
         level_info = self.scoring.get_level_info(total_points)
         
-        # 生成报告
-        print("\n⏳ 正在生成每日总结报告...")
-        report_path = self.report_generator.generate_report(
-            processed_responses, point_details, total_points, level_info
-        )
+        # 报告在后台生成，不阻塞导入
+        report_status = self._start_daily_report(processed_responses, point_details, total_points, level_info)
         
         # 显示结果
         print("\n" + "=" * 50)
@@ -336,7 +515,131 @@ class StudyDiary:
         encouragement = self.scoring.get_encouragement_message(total_points, points)
         print(f"\n{encouragement}")
         
-        print(f"\n📄 报告已生成: {report_path}")
+        self._print_daily_report_status(report_status)
+    
+    def _start_daily_report(self, responses: dict, point_details: list,
+                            total_points: int, level_info: dict) -> dict:
+        """
+        按报告模式开始生成每日报告
+        
+        模板报告（template、template_first）当场生成，只需几毫秒；
+        需要Gemini的部分（llm、template_first的润色）提交到后台任务队列。
+        """
+        status = {'report_path': None, 'job': None}
+        mode = self.report_generator.mode
+        if mode == REPORT_MODE_LLM and os.environ.get('REPORT_STREAM') == '1':
+            status['report_path'] = self._stream_daily_report(responses, point_details, total_points, level_info)
+            return status
+        if mode in (REPORT_MODE_TEMPLATE, REPORT_MODE_TEMPLATE_FIRST):
+            status['report_path'] = self.report_generator.generate_report(
+                responses, point_details, total_points, level_info, mode=REPORT_MODE_TEMPLATE
+            )
+        if mode in (REPORT_MODE_LLM, REPORT_MODE_TEMPLATE_FIRST):
+            status['job'] = self.report_jobs.submit(responses["date"], mode=REPORT_MODE_LLM)
+        return status
+    
+    def _stream_daily_report(self, responses: dict, point_details: list,
+                             total_points: int, level_info: dict) -> str:
+        """在前台生成报告，Gemini的输出边生成边显示"""
+        print("\n⏳ 正在生成每日总结报告...")
+        print("-" * 50)
+        report_path = self.report_generator.generate_report(
+            responses, point_details, total_points, level_info,
+            echo=lambda chunk: print(chunk, end='', flush=True)
+        )
+        print("\n" + "-" * 50)
+        metrics = self.report_generator.report_metrics.get(responses["date"])
+        if metrics and metrics['ttft'] is not None:
+            print(f"⏱️ 首字用时 {metrics['ttft']:.1f}秒，总用时 {metrics['seconds']:.1f}秒")
+        return report_path
+    
+    def _print_daily_report_status(self, status: dict):
+        if status['report_path']:
+            print(f"\n📄 报告已生成: {status['report_path']}")
+        job = status['job']
+        if job:
+            if status['report_path']:
+                print(f"⏳ Gemini润色版报告正在后台生成（任务#{job['id']}），完成后会在主菜单提醒你")
+            else:
+                print(f"\n⏳ 每日总结报告正在后台生成（任务#{job['id']}），完成后会在主菜单提醒你")
+            print("📋 可通过菜单13查看生成进度")
+    
+    def _show_report_notifications(self):
+        """显示后台报告任务的完成提醒"""
+        for job in self.report_jobs.pop_notifications():
+            if job['status'] == DONE:
+                print(f"\n🔔 {job['date']} 的报告已生成: {job['report_path']}")
+            else:
+                print(f"\n⚠️ {job['date']} 的报告生成失败: {job['error']}（可在菜单13重试）")
+            for warning in job.get('warnings') or []:
+                print(f"   {warning}")
+    
+    def view_report_jobs(self):
+        print("\n" + "=" * 50)
+        print("📋 报告生成任务")
+        print("=" * 50)
+        
+        jobs = self.report_jobs.get_jobs(limit=20)
+        if not jobs:
+            print("\n暂无报告任务")
+            return
+        
+        for job in jobs:
+            line = f"#{job['id']:<4} {job['date']}  {STATUS_DISPLAY[job['status']]}"
+            if job['status'] == DONE:
+                line += f"  {job['report_path']}"
+                if job.get('ttft') is not None:
+                    line += f"  (首字{job['ttft']:.1f}秒/共{job['llm_seconds']:.1f}秒)"
+                if job.get('queue_wait'):
+                    line += f"  限流排队{job['queue_wait']:.1f}秒"
+            elif job['status'] == FAILED:
+                line += f"  {job['error']}"
+            print(line)
+            for warning in job.get('warnings') or []:
+                print(f"       {warning}")
+        
+        # 查看任务列表后，已结束的任务不再重复提醒
+        self.report_jobs.pop_notifications()
+        
+        latest = {}
+        for job in jobs:
+            latest.setdefault(job['date'], job)
+        if any(job['status'] == FAILED for job in latest.values()):
+            if input("\n重新生成失败的报告吗？(y/n): ").strip().lower() == 'y':
+                count = self.report_jobs.retry_failed()
+                print(f"\n⏳ 已重新提交{count}份报告")
+    
+        # 报告内容未变化时会直接使用已有报告，需要时可以强制重新生成
+        date = input("\n输入日期可强制重新生成该天的报告 (YYYY-MM-DD，直接回车跳过): ").strip()
+        if date:
+            if not self.data_manager.get_response_by_date(date):
+                print(f"\n❌ 找不到{date}的问卷记录")
+                return
+            mode = REPORT_MODE_TEMPLATE if self.report_generator.mode == REPORT_MODE_TEMPLATE else REPORT_MODE_LLM
+            job = self.report_jobs.submit(date, force=True, mode=mode)
+            print(f"\n⏳ 已提交重新生成任务#{job['id']}")
+    
+    def search_history(self, query: str = None):
+        """在历史报告和文字答案（特别成就、明天计划）中搜索关键词"""
+        query = query or input("\n请输入要搜索的关键词（如 申论、失眠）: ").strip()
+        if not query:
+            return
+        
+        start = time.perf_counter()
+        results = self.report_generator.search_index.search(query, limit=20)
+        elapsed = (time.perf_counter() - start) * 1000
+        
+        if not results:
+            print(f"\n🔍 没有找到包含「{query}」的记录（{elapsed:.1f}毫秒）")
+            return
+        
+        source_names = {'report': '报告', 'answers': '答案'}
+        print(f"\n🔍 找到{len(results)}天包含「{query}」的记录（{elapsed:.1f}毫秒）:")
+        for result in results:
+            sources = '、'.join(source_names[s] for s in result['sources'])
+            print(f"\n📅 {result['date']}  [{sources}]  相关度 {result['score']:.2f}")
+            if result['snippet']:
+                print(f"   {result['snippet']}")
     
     def view_today_report(self):
         today = datetime.now().strftime("%Y-%m-%d")
@@ -349,10 +652,17 @@ class StudyDiary:
         # 查找今天的报告
         report_path = f"reports/daily_report_{today}.md"
         pdf_path = f"reports/daily_report_{today}.pdf"
+        html_path = f"reports/daily_report_{today}.html"
         
         if os.path.exists(pdf_path):
             print(f"\n📄 今日报告: {pdf_path}")
             print("请打开文件查看详细内容")
+        elif os.path.exists(html_path):
+            print(f"\n📄 今日报告: {html_path}")
+            print("请用浏览器打开查看详细内容")
+        elif self.report_jobs.get_active_job(today):
+            # 后台任务还没完成时不显示Markdown预览（可能是正在生成的内容）
+            print("\n⏳ 今日报告正在后台生成中，请稍后再查看（菜单13可查看进度）")
         elif os.path.exists(report_path):
             print(f"\n📄 今日报告: {report_path}")
             print("\n报告内容预览:")
@@ -414,14 +724,33 @@ class StudyDiary:
             print(f"📝 平均每天做题: {stats['total_problems']//stats['study_days']}道")
     
     def generate_weekly_summary(self):
-        print("\n⏳ 正在生成周总结...")
-        
-        summary_path = self.report_generator.generate_weekly_summary()
+        print("\n选择总结范围:")
+        print("1. 本周")
+        print("2. 上周")
+        print("3. 本月")
+        print("4. 上月")
+        
+        choice = input("请选择 (默认为本周): ").strip()
+        today = datetime.now()
+        
+        if choice in ('3', '4'):
+            month = today.strftime("%Y-%m")
+            if choice == '4':
+                month = (today.replace(day=1) - timedelta(days=1)).strftime("%Y-%m")
+            print(f"\n⏳ 正在生成{month}月总结...")
+            summary_path = self.report_generator.generate_monthly_summary(month)
+            name = "月总结"
+        else:
+            day = today - timedelta(days=7) if choice == '2' else today
+            week = self.data_manager.week_key(day.strftime("%Y-%m-%d"))
+            print(f"\n⏳ 正在生成{week}周总结...")
+            summary_path = self.report_generator.generate_weekly_summary(week)
+            name = "周总结"
         
         if summary_path:
-            print(f"\n✅ 周总结已生成: {summary_path}")
+            print(f"\n✅ {name}已生成: {summary_path}")
         else:
-            print("\n❌ 数据不足，无法生成周总结")
+            print(f"\n❌ 数据不足，无法生成{name}")
     
     def visualize_progress(self):
         print("\n⏳ 正在生成进度图表...")
@@ -546,29 +875,25 @@ class StudyDiary:
             if os.path.exists(pdf_file):
                 os.remove(pdf_file)
                 print(f"   - 删除了PDF报告")
+            
+            html_file = f"reports/daily_report_{target_date}.html"
+            if os.path.exists(html_file):
+                os.remove(html_file)
+                print(f"   - 删除了HTML报告")
+            
+            hash_file = f"reports/daily_report_{target_date}.hash"
+            if os.path.exists(hash_file):
+                os.remove(hash_file)
         else:
             print(f"\n❌ {result['message']}")
     
     def _check_and_handle_user_feedback(self):
         """检查并处理用户反馈"""
-        feedback_file = os.path.join("questionnaires", "user_feedback.json")
-        
-        if not os.path.exists(feedback_file):
-            return
-        
-        # 读取反馈
-        with open(feedback_file, 'r', encoding='utf-8') as f:
-            feedback_list = json.load(f)
+        # 只读取上次处理之后新增的反馈
+        feedback_log = self.excel_handler.feedback_log
+        new_feedback, position = feedback_log.read_new()
         
-        if not feedback_list:
-            return
-        
-        # 获取最新的反馈（今天的）
-        today = datetime.now().strftime("%Y-%m-%d")
-        today_feedback = [fb for fb in feedback_list 
-                         if fb.get('timestamp', '').startswith(today)]
-        
-        if not today_feedback:
+        if not new_feedback:
             return
         
         print("\n" + "=" * 50)
@@ -578,7 +903,7 @@ class StudyDiary:
         # 先显示反馈内容
         print("\n以下是用户的反馈内容：")
         print("-" * 40)
-        for i, fb in enumerate(today_feedback, 1):
+        for i, fb in enumerate(new_feedback, 1):
             print(f"\n{i}. 问题：{fb['question']}")
             print(f"   原始答案：{fb['original_answer']}")
             print(f"   {fb['feedback']}")
@@ -590,6 +915,9 @@ class StudyDiary:
         
         choice = input("\n请选择: ").strip().upper()
         
+        # 这些反馈已经提示过，无论是否优化都不再重复提示（内容仍保存在反馈日志中）
+        feedback_log.commit(position)
+        
         if choice == 'Y':
             print("\n🤖 正在启动AI问卷优化服务...")
             print("\n⚠️  重要提醒：")
@@ -605,7 +933,7 @@ class StudyDiary:
                 print("=" * 50)
                 
                 # 调用问卷优化器
-                result = self.questionnaire_optimizer.optimize_questionnaire(today_feedback)
+                result = self.questionnaire_optimizer.optimize_questionnaire(new_feedback)
                 
                 print("\n" + "=" * 50)
                 if result['success']:
@@ -739,6 +1067,44 @@ class StudyDiary:
 
 def main():
     diary = StudyDiary()
+    # 无论从哪个分支退出，都结束常驻的PDF渲染进程
+    atexit.register(diary.report_generator.close)
+    
+    # 后台监听模式：python main.py --watch [目录] [--reports]
+    if len(sys.argv) > 1 and sys.argv[1] == '--watch':
+        args = [a for a in sys.argv[2:] if not a.startswith('--')]
+        try:
+            diary.watch_questionnaire_folder(
+                args[0] if args else None,
+                generate_reports='--reports' in sys.argv
+            )
+        except KeyboardInterrupt:
+            print("\n👋 已停止监听")
+        return
+    
+    # 多用户批量导出：python main.py --export-users users.json [--workers N]
+    if len(sys.argv) > 2 and sys.argv[1] == '--export-users':
+        workers = None
+        if '--workers' in sys.argv:
+            workers = int(sys.argv[sys.argv.index('--workers') + 1])
+        diary.batch_export_questionnaires(sys.argv[2], workers)
+        return
+    
+    # 搜索历史记录：python main.py --search 关键词
+    if len(sys.argv) > 2 and sys.argv[1] == '--search':
+        diary.search_history(' '.join(sys.argv[2:]))
+        return
+    
+    # 重建搜索索引（手动修改或删除报告后）：python main.py --search-rebuild
+    if len(sys.argv) > 1 and sys.argv[1] == '--search-rebuild':
+        count = diary.report_generator.search_index.rebuild()
+        print(f"🔍 搜索索引已重建，共{count}个文档")
+        return
+    
+    # Gemini调用状态：python main.py --llm-status
+    if len(sys.argv) > 1 and sys.argv[1] == '--llm-status':
+        diary.show_llm_status()
+        return
     
     # 显示欢迎信息
     print("\n" + "🌟" * 30)
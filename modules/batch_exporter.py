@@ -0,0 +1,106 @@
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Union
+
+from .excel_handler import ExcelHandler
+
+
+USER_ID_PATTERN = re.compile(r'^[\w.-]+$')
+
+
+def _export_user_file(task: Dict) -> Dict:
+    """在子进程中为一个用户生成问卷（复制模板并填入日期）"""
+    start = time.perf_counter()
+    try:
+        os.makedirs(os.path.dirname(task['filepath']), exist_ok=True)
+        ExcelHandler._fill_template(task['template_path'], task['filepath'], task['date'])
+        error = None
+    except Exception as e:
+        error = str(e)
+    return {
+        'user': task['user'],
+        'path': task['filepath'],
+        'seconds': time.perf_counter() - start,
+        'error': error
+    }
+
+
+class BatchExporter:
+    """多用户批量导出每日问卷：模板只渲染一次，各用户的文件由进程池并行生成"""
+    
+    def __init__(self, excel_handler: ExcelHandler,
+                 output_root: Optional[str] = None,
+                 max_workers: Optional[int] = None):
+        self.excel_handler = excel_handler
+        self.output_root = output_root or os.path.join(excel_handler.questionnaire_dir, "users")
+        self.max_workers = max_workers or os.cpu_count() or 1
+    
+    def user_dir(self, user_id: str) -> str:
+        """用户问卷所在目录：questionnaires/users/<用户ID>/"""
+        return os.path.join(self.output_root, user_id)
+    
+    def _normalize_users(self, users: List[Union[str, Dict]]) -> List[str]:
+        """用户可以是ID字符串或包含id字段的字典，ID会作为目录名使用"""
+        user_ids = []
+        for user in users:
+            user_id = str(user.get('id', '')) if isinstance(user, dict) else str(user)
+            user_id = user_id.strip()
+            if not USER_ID_PATTERN.match(user_id) or user_id in ('.', '..'):
+                raise ValueError(f"无效的用户ID: {user_id!r}（只能包含字母、数字、下划线、点和短横线）")
+            if user_id not in user_ids:
+                user_ids.append(user_id)
+        return user_ids
+    
+    def export(self, users: List[Union[str, Dict]], questions: List[Dict],
+               schema_version: str = "", date: Optional[str] = None,
+               progress: Optional[Callable[[str], None]] = None) -> Dict:
+        """
+        为每个用户导出当天的问卷
+        
+        Returns:
+            {'files': [{'user', 'path', 'seconds'}], 'failed': [{'user', 'path', 'error'}],
+             'total_seconds', 'files_per_second'}
+        """
+        progress = progress or print
+        user_ids = self._normalize_users(users)
+        date = date or datetime.now().strftime("%Y-%m-%d")
+        start = time.perf_counter()
+        
+        # 模板在主进程中准备好，子进程只做文件复制和日期替换
+        template_path = self.excel_handler.get_template(questions, schema_version)
+        tasks = [
+            {
+                'user': user_id,
+                'template_path': template_path,
+                'filepath': os.path.join(self.user_dir(user_id), f"daily_questionnaire_{date}.xlsx"),
+                'date': date
+            }
+            for user_id in user_ids
+        ]
+        
+        files = []
+        failed = []
+        if tasks:
+            workers = min(self.max_workers, len(tasks))
+            # 单个文件只需几毫秒，按块分发以减少进程间通信的开销
+            chunksize = max(1, len(tasks) // (workers * 4))
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for result in pool.map(_export_user_file, tasks, chunksize=chunksize):
+                    if result['error']:
+                        failed.append({'user': result['user'], 'path': result['path'], 'error': result['error']})
+                        progress(f"❌ {result['user']}: {result['error']}")
+                    else:
+                        del result['error']
+                        files.append(result)
+                        progress(f"📤 {result['user']}: {result['path']} ({result['seconds'] * 1000:.1f}ms)")
+        
+        total_seconds = time.perf_counter() - start
+        return {
+            'files': files,
+            'failed': failed,
+            'total_seconds': total_seconds,
+            'files_per_second': len(files) / total_seconds if total_seconds > 0 else 0.0
+        }
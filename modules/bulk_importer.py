@@ -0,0 +1,265 @@
+import os
+import json
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from .questionnaire import DailyQuestionnaire
+from .excel_handler import ExcelHandler, QUESTIONNAIRE_FILE_PATTERN
+
+# 子进程内复用的问卷处理器（每个进程初始化一次）
+_worker_handler = None
+_worker_questions = None
+
+
+def _init_worker():
+    global _worker_handler, _worker_questions
+    _worker_handler = ExcelHandler()
+    _worker_questions = DailyQuestionnaire().generate_questionnaire()
+
+
+def _classify_workbook(filepath: str, schema_version: str) -> Dict:
+    """在子进程中解析问卷并识别答案；没有通过验证（表头不对、没有填写答案）的问卷抛出ValueError"""
+    if _worker_handler is None:
+        _init_worker()
+    parsed = _worker_handler.open_questionnaire(filepath)
+    try:
+        # 与交互式导入相同的检查，空白问卷不能被当作一天的记录写入
+        error = _worker_handler.validation_error(parsed)
+        if error:
+            raise ValueError(error)
+        result = _worker_handler.parse_answers(filepath, _worker_questions, parsed,
+                                               schema_version=schema_version)
+    finally:
+        parsed.close()
+    result['filepath'] = filepath
+    return result
+
+
+class BulkImporter:
+    """批量补录历史问卷：多进程解析识别，按日期顺序写入，支持断点续传"""
+    
+    def __init__(self, data_manager, scoring, questionnaire, excel_handler,
+                 report_generator=None,
+                 checkpoint_file: str = os.path.join("data", "bulk_import_checkpoint.json"),
+                 max_workers: Optional[int] = None,
+                 report_workers: int = 2):
+        self.data_manager = data_manager
+        self.scoring = scoring
+        self.questionnaire = questionnaire
+        self.excel_handler = excel_handler
+        self.report_generator = report_generator
+        self.checkpoint_file = checkpoint_file
+        self.max_workers = max_workers
+        self.report_workers = report_workers
+        self._checkpoint_lock = threading.Lock()
+    
+    def find_workbooks(self, directory: str) -> List[str]:
+        """按日期顺序列出目录中的问卷文件（xlsx以及JSON/CSV提交）"""
+        if not os.path.isdir(directory):
+            return []
+        files = [f for f in os.listdir(directory) if QUESTIONNAIRE_FILE_PATTERN.match(f)]
+        return [os.path.join(directory, f) for f in sorted(files)]
+    
+    def load_checkpoint(self) -> Dict:
+        """读取补录进度（中断后可继续）"""
+        if os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {'committed': {}, 'pending_reports': []}
+    
+    def _save_checkpoint(self, checkpoint: Dict):
+        checkpoint['updated_at'] = datetime.now().isoformat()
+        tmp_path = self.checkpoint_file + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.checkpoint_file)
+    
+    def commit_result(self, result: Dict) -> Dict:
+        """把识别好的一份问卷写入数据：保存答案、计算积分、更新总分"""
+        processed_responses = self.questionnaire.process_responses(result['responses'])
+        self.data_manager.save_response(processed_responses)
+        
+        date = processed_responses['date']
+        historical_data = self.data_manager.get_recent_responses(30, end_date=date)
+        points, point_details = self.scoring.calculate_points(processed_responses, historical_data)
+        self.data_manager.update_points(date, points, point_details)
+        
+        return {
+            'date': date,
+            'points': points,
+            'point_details': point_details,
+            'responses': processed_responses
+        }
+    
+    @staticmethod
+    def _file_signature(filepath: str) -> Optional[List[int]]:
+        """文件大小和修改时间：同名问卷重新填写后不再被当作已导入"""
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+        return [stat.st_size, stat.st_mtime_ns]
+    
+    def _move_to_answered(self, filepath: str) -> str:
+        answered_dir = os.path.join(self.excel_handler.questionnaire_dir, "answered")
+        if os.path.abspath(os.path.dirname(filepath)) == os.path.abspath(answered_dir):
+            return filepath
+        os.makedirs(answered_dir, exist_ok=True)
+        answered_path = os.path.join(answered_dir, os.path.basename(filepath))
+        shutil.move(filepath, answered_path)
+        return answered_path
+    
+    def create_pool(self) -> ProcessPoolExecutor:
+        """创建解析问卷用的进程池（长期运行时可复用）"""
+        return ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker)
+    
+    def run(self, filepaths: List[str], generate_reports: bool = False,
+            move_files: bool = True,
+            progress: Optional[Callable[[str], None]] = None,
+            pool: Optional[ProcessPoolExecutor] = None) -> Dict:
+        """
+        批量导入问卷
+        
+        解析和答案识别在进程池中并行完成；写入数据严格按问卷日期顺序进行，
+        保证连续学习奖励的计算正确。每写入一份都会更新进度文件，
+        中断后再次运行会跳过已写入的问卷（文件名、大小和修改时间都相同才算同一份）。
+        传入pool时复用该进程池。
+        """
+        progress = progress or print
+        checkpoint = self.load_checkpoint()
+        committed = checkpoint.setdefault('committed', {})
+        pending_reports = checkpoint.setdefault('pending_reports', [])
+        checkpoint.setdefault('started_at', datetime.now().isoformat())
+        
+        signatures = {p: self._file_signature(p) for p in filepaths}
+        # 旧版进度文件只记录了日期，这些问卷重新导入一次（写入按日期覆盖，不会重复计分）
+        skipped_files = [p for p in filepaths
+                         if isinstance(committed.get(os.path.basename(p)), dict)
+                         and committed[os.path.basename(p)].get('signature') == signatures[p]]
+        todo = [p for p in filepaths if p not in skipped_files]
+        skipped = len(skipped_files)
+        if skipped:
+            progress(f"⏭️ 跳过已导入的问卷 {skipped} 份")
+        
+        # 1. 并行解析和识别
+        schema_version = self.questionnaire.get_schema_version()
+        results = []
+        failed = []
+        
+        if todo:
+            own_pool = pool is None
+            if own_pool:
+                pool = self.create_pool()
+            try:
+                futures = {pool.submit(_classify_workbook, p, schema_version): p for p in todo}
+                for done_count, future in enumerate(as_completed(futures), 1):
+                    filepath = futures[future]
+                    try:
+                        results.append(future.result())
+                        progress(f"🔍 已解析 {done_count}/{len(todo)}: {os.path.basename(filepath)}")
+                    except Exception as e:
+                        failed.append({'file': filepath, 'error': str(e)})
+                        progress(f"❌ 解析失败 {os.path.basename(filepath)}: {e}")
+            finally:
+                if own_pool:
+                    pool.shutdown()
+        
+        # 2. 按日期顺序写入
+        results.sort(key=lambda r: (r['date'], os.path.basename(r['filepath'])))
+        imported = []
+        
+        for result in results:
+            filepath = result['filepath']
+            try:
+                summary = self.commit_result(result)
+            except Exception as e:
+                failed.append({'file': filepath, 'error': str(e)})
+                progress(f"❌ 写入失败 {os.path.basename(filepath)}: {e}")
+                continue
+            
+            if result['feedback']:
+                self.excel_handler.save_user_feedback(result['feedback'])
+            
+            with self._checkpoint_lock:
+                committed[os.path.basename(filepath)] = {
+                    'date': summary['date'],
+                    'signature': signatures[filepath]
+                }
+                if summary['date'] not in pending_reports:
+                    pending_reports.append(summary['date'])
+                self._save_checkpoint(checkpoint)
+            
+            if move_files:
+                self._move_to_answered(filepath)
+            
+            imported.append({'date': summary['date'], 'points': summary['points']})
+            progress(f"✅ {summary['date']}: {summary['points']:+d}分")
+        
+        # 全部成功后清空已导入列表，只保留待生成的报告
+        if not failed:
+            with self._checkpoint_lock:
+                checkpoint['committed'] = {}
+                self._save_checkpoint(checkpoint)
+        
+        # 3. 报告：立即在独立的小线程池中生成，或留到之后再生成
+        reports = []
+        if generate_reports:
+            reports = self.generate_pending_reports(progress)
+        
+        return {
+            'imported': imported,
+            'failed': failed,
+            'skipped': skipped,
+            'skipped_files': skipped_files,
+            'reports': reports,
+            'pending_reports': list(self.load_checkpoint().get('pending_reports', []))
+        }
+    
+    def generate_pending_reports(self, progress: Optional[Callable[[str], None]] = None) -> List[str]:
+        """为已补录但还没有报告的日期生成报告（线程池大小有上限）"""
+        progress = progress or print
+        if self.report_generator is None:
+            return []
+        
+        checkpoint = self.load_checkpoint()
+        pending = sorted(checkpoint.get('pending_reports', []))
+        if not pending:
+            return []
+        
+        history = {r['date']: r for r in self.data_manager.get_points_history()}
+        report_paths = []
+        
+        def build_report(date: str) -> str:
+            response = self.data_manager.get_response_by_date(date)
+            record = history.get(date)
+            if not response or not record:
+                return None
+            total_points = record['total_points']
+            level_info = self.scoring.get_level_info(total_points)
+            return self.report_generator.generate_report(
+                response, record['details'], total_points, level_info
+            )
+        
+        with ThreadPoolExecutor(max_workers=self.report_workers) as pool:
+            futures = {pool.submit(build_report, date): date for date in pending}
+            for future in as_completed(futures):
+                date = futures[future]
+                try:
+                    report_path = future.result()
+                except Exception as e:
+                    progress(f"❌ {date} 报告生成失败: {e}")
+                    continue
+                
+                with self._checkpoint_lock:
+                    if date in checkpoint['pending_reports']:
+                        checkpoint['pending_reports'].remove(date)
+                    self._save_checkpoint(checkpoint)
+                
+                if report_path:
+                    report_paths.append(report_path)
+                    progress(f"📄 {date} 报告已生成: {report_path}")
+        
+        return report_paths
@@ -1,23 +1,31 @@
 import json
 import os
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 import matplotlib.pyplot as plt
 import matplotlib.font_manager as fm
 import pandas as pd
 
+from .points_ledger import PointsLedger
+from .search_index import SearchIndex
+
 
 class DataManager:
     def __init__(self, data_dir: str = "data"):
         self.data_dir = data_dir
         self.responses_file = os.path.join(data_dir, "responses.json")
         self.points_file = os.path.join(data_dir, "points.json")
+        self.rollups_file = os.path.join(data_dir, "rollups.json")
+        self.ledger = PointsLedger(os.path.join(data_dir, "points_ledger.jsonl"))
+        # 历史搜索索引：保存问卷、回档时同步更新（报告目录由ReportGenerator设置）
+        self.search_index = SearchIndex(self, index_file=os.path.join(data_dir, "search_index.json"))
         
         # 确保数据目录存在
         os.makedirs(data_dir, exist_ok=True)
         
         # 初始化数据文件
         self._init_data_files()
+        self._migrate_ledger()
         
         # 设置中文字体
         self._setup_chinese_font()
@@ -34,6 +42,36 @@ class DataManager:
                     "history": []
                 }, f, ensure_ascii=False)
     
+    def _migrate_ledger(self):
+        """
+        首次使用积分账本时，从points.json和旧的兑换历史建立账本
+        
+        旧版本兑换时会在points.json的历史里插入一条扣分记录，迁移后这些记录移到账本中，
+        从每日记录里删除，避免被当成某天的积分计入汇总。
+        """
+        if self.ledger.exists():
+            return
+        points_data = self._load_points()
+        history_file = os.path.join(self.data_dir, "redemption_history.json")
+        redemptions = []
+        if os.path.exists(history_file):
+            with open(history_file, 'r', encoding='utf-8') as f:
+                redemptions = json.load(f)
+        
+        if not self.ledger.migrate(points_data, redemptions):
+            return
+        
+        history = [r for r in points_data['history'] if not self.ledger.is_redemption_record(r)]
+        if len(history) != len(points_data['history']):
+            points_data['history'] = history
+            points_data['total_points'] = self.ledger.balance()
+            self._save_points(points_data)
+            if os.path.exists(self.rollups_file):
+                self.rebuild_rollups()
+        if redemptions:
+            # 兑换历史改为从账本读取，保留旧文件备查
+            os.replace(history_file, history_file + '.migrated')
+    
     def _setup_chinese_font(self):
         # 尝试找到系统中的中文字体
         try:
@@ -75,11 +113,18 @@ class DataManager:
         
         with open(self.responses_file, 'w', encoding='utf-8') as f:
             json.dump(responses, f, ensure_ascii=False, indent=2)
+        
+        self._update_rollups(date, response=response)
+        self.search_index.index_answers(response)
     
     def _load_responses(self) -> List[Dict]:
         with open(self.responses_file, 'r', encoding='utf-8') as f:
             return json.load(f)
     
+    def get_all_responses(self) -> List[Dict]:
+        """按日期排序的全部问卷记录"""
+        return self._load_responses()
+    
     def get_response_by_date(self, date: str) -> Optional[Dict]:
         responses = self._load_responses()
         for response in responses:
@@ -87,12 +132,13 @@ class DataManager:
                 return response
         return None
     
-    def get_recent_responses(self, days: int) -> List[Dict]:
+    def get_recent_responses(self, days: int, end_date: Optional[str] = None) -> List[Dict]:
         responses = self._load_responses()
         if not responses:
             return []
         
-        end_date = datetime.now()
+        # end_date用于补录历史问卷时，按问卷当天而不是今天计算时间窗口
+        end_date = datetime.strptime(end_date, '%Y-%m-%d') if end_date else datetime.now()
         start_date = end_date - timedelta(days=days-1)
         
         recent_responses = []
@@ -104,10 +150,11 @@ class DataManager:
         return recent_responses
     
     def update_points(self, date: str, daily_points: int, point_details: List[Dict]):
-        points_data = self._load_points()
+        # 先在账本中记账（同一天重新计分只记差额），总积分以账本为准
+        self.ledger.set_day_points(date, daily_points)
         
-        # 更新总积分
-        points_data['total_points'] += daily_points
+        points_data = self._load_points()
+        points_data['total_points'] = self.ledger.balance()
         
         # 更新历史记录
         history = points_data['history']
@@ -128,10 +175,6 @@ class DataManager:
         }
         
         if existing_index is not None:
-            # 如果已存在，先减去旧的分数
-            old_points = history[existing_index]['daily_points']
-            points_data['total_points'] = points_data['total_points'] - old_points + daily_points
-            new_record['total_points'] = points_data['total_points']
             history[existing_index] = new_record
         else:
             history.append(new_record)
@@ -139,16 +182,159 @@ class DataManager:
         # 按日期排序
         history.sort(key=lambda x: x['date'])
         
-        with open(self.points_file, 'w', encoding='utf-8') as f:
-            json.dump(points_data, f, ensure_ascii=False, indent=2)
+        self._save_points(points_data)
+        
+        self._update_rollups(date, points_record=new_record)
+    
+    # ---------- 周/月汇总 ----------
+    # rollups.json保存每天的贡献值和按ISO周、自然月累加的汇总。
+    # 某天的问卷或积分变化时，先从所在周/月减去旧贡献再加上新贡献，
+    # 周报、月报直接按键读取汇总，不再扫描全部答案。
+    
+    @staticmethod
+    def week_key(date: str) -> str:
+        """日期所在的ISO周，如 2025-W28"""
+        year, week, _ = datetime.strptime(date, '%Y-%m-%d').isocalendar()
+        return f"{year}-W{week:02d}"
+    
+    @staticmethod
+    def month_key(date: str) -> str:
+        return date[:7]
+    
+    @staticmethod
+    def _empty_rollup() -> Dict:
+        return {
+            'days_recorded': 0,
+            'study_days': 0,
+            'study_minutes': 0,
+            'problems': 0,
+            'points': 0,
+            'points_by_category': {}
+        }
+    
+    @staticmethod
+    def _answer_value(response: Dict, key: str) -> int:
+        answer = response.get(key)
+        if isinstance(answer, dict) and isinstance(answer.get('value'), (int, float)):
+            return answer['value']
+        return 0
+    
+    def _day_contribution(self, old: Optional[Dict], response: Optional[Dict] = None,
+                          points_record: Optional[Dict] = None) -> Dict:
+        """某一天对汇总的贡献：问卷部分和积分部分分别更新，未传入的部分沿用旧值"""
+        day = dict(old) if old else {
+            'has_response': False,
+            'study_minutes': 0,
+            'problems': 0,
+            'points': 0,
+            'points_by_category': {}
+        }
+        if response is not None:
+            day['has_response'] = True
+            day['study_minutes'] = self._answer_value(response, 'study_duration')
+            day['problems'] = self._answer_value(response, 'problems_completed')
+        if points_record is not None:
+            by_category = {}
+            for detail in points_record.get('details', []):
+                by_category[detail['category']] = by_category.get(detail['category'], 0) + detail['points']
+            day['points'] = points_record['daily_points']
+            day['points_by_category'] = by_category
+        return day
+    
+    @staticmethod
+    def _apply_day(rollup: Dict, day: Dict, sign: int):
+        rollup['days_recorded'] += sign
+        rollup['study_days'] += sign if day['study_minutes'] > 0 else 0
+        rollup['study_minutes'] += sign * day['study_minutes']
+        rollup['problems'] += sign * day['problems']
+        rollup['points'] += sign * day['points']
+        by_category = rollup['points_by_category']
+        for category, points in day['points_by_category'].items():
+            by_category[category] = by_category.get(category, 0) + sign * points
+            if sign < 0 and by_category[category] == 0:
+                del by_category[category]
+    
+    def _load_rollups(self) -> Dict:
+        if os.path.exists(self.rollups_file):
+            with open(self.rollups_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return self.rebuild_rollups()
+    
+    def _save_rollups(self, rollups: Dict):
+        tmp_path = self.rollups_file + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(rollups, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.rollups_file)
+    
+    def _set_rollup_day(self, rollups: Dict, date: str, day: Optional[Dict]):
+        """用新的贡献替换某天的旧贡献（day为None表示删除这一天）"""
+        keys = (('weeks', self.week_key(date)), ('months', self.month_key(date)))
+        old = rollups['days'].get(date)
+        for table, key in keys:
+            rollup = rollups[table].setdefault(key, self._empty_rollup())
+            if old:
+                self._apply_day(rollup, old, -1)
+            if day:
+                self._apply_day(rollup, day, 1)
+            if rollup['days_recorded'] == 0:
+                del rollups[table][key]
+        if day:
+            rollups['days'][date] = day
+        else:
+            rollups['days'].pop(date, None)
+    
+    def _update_rollups(self, date: str, response: Optional[Dict] = None,
+                        points_record: Optional[Dict] = None):
+        rollups = self._load_rollups()
+        day = self._day_contribution(rollups['days'].get(date), response, points_record)
+        self._set_rollup_day(rollups, date, day)
+        self._save_rollups(rollups)
+    
+    def _remove_rollup_day(self, date: str):
+        rollups = self._load_rollups()
+        self._set_rollup_day(rollups, date, None)
+        self._save_rollups(rollups)
+    
+    def rebuild_rollups(self) -> Dict:
+        """从全部答案和积分记录重新计算汇总（首次使用或汇总文件丢失时）"""
+        rollups = {'days': {}, 'weeks': {}, 'months': {}}
+        days = {}
+        for response in self._load_responses():
+            days[response['date']] = self._day_contribution(days.get(response['date']), response=response)
+        for record in self._load_points()['history']:
+            days[record['date']] = self._day_contribution(days.get(record['date']), points_record=record)
+        for date in sorted(days):
+            self._set_rollup_day(rollups, date, days[date])
+        self._save_rollups(rollups)
+        return rollups
+    
+    def get_week_rollup(self, week: str) -> Optional[Dict]:
+        """某个ISO周（如 2025-W28）的汇总，没有记录时返回None"""
+        return self._load_rollups()['weeks'].get(week)
+    
+    def get_month_rollup(self, month: str) -> Optional[Dict]:
+        """某个月（如 2025-07）的汇总，没有记录时返回None"""
+        return self._load_rollups()['months'].get(month)
+    
+    def get_day_rollups(self, before: str, limit: int) -> List[Tuple[str, Dict]]:
+        """某天之前最近limit天的每日贡献，按日期从新到旧"""
+        days = self._load_rollups()['days']
+        dates = sorted((d for d in days if d < before), reverse=True)[:limit]
+        return [(d, days[d]) for d in dates]
     
     def _load_points(self) -> Dict:
         with open(self.points_file, 'r', encoding='utf-8') as f:
             return json.load(f)
     
+    def _save_points(self, points_data: Dict):
+        tmp_path = self.points_file + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(points_data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.points_file)
+    
     def get_total_points(self) -> int:
-        points_data = self._load_points()
-        return points_data['total_points']
+        """当前可用积分（由积分账本累加得到）"""
+        return self.ledger.balance()
     
     def get_points_history(self, days: Optional[int] = None) -> List[Dict]:
         points_data = self._load_points()
@@ -255,6 +441,7 @@ class DataManager:
             export_data = {
                 'responses': self._load_responses(),
                 'points': self._load_points(),
+                'points_ledger': list(self.ledger.transactions()),
                 'export_time': datetime.now().isoformat()
             }
             
@@ -292,7 +479,7 @@ class DataManager:
         
         return {
             'total_days': len(responses),
-            'total_points': points_data['total_points'],
+            'total_points': self.get_total_points(),
             'avg_daily_points': round(avg_daily_points, 1),
             'total_study_time': total_study_time,
             'total_problems': total_problems,
@@ -342,24 +529,23 @@ class DataManager:
                 history_to_keep.append(record)
         
         if deleted_points:
-            # 重新计算总积分
+            # 在账本中冲销当天的积分，总积分以账本为准
+            self.ledger.reverse_day(date)
+            # 其余记录的total_points是写入当时的账本余额（已扣除兑换），保持不变；
+            # 不能再按daily_points累加重算，否则会把兑换花掉的积分加回去
             points_data['history'] = history_to_keep
-            
-            # 从头开始重新计算总积分
-            total = 0
-            for i, record in enumerate(history_to_keep):
-                total += record['daily_points']
-                record['total_points'] = total
-            
-            points_data['total_points'] = total
+            points_data['total_points'] = self.ledger.balance()
             
             # 保存更新后的积分数据
-            with open(self.points_file, 'w', encoding='utf-8') as f:
-                json.dump(points_data, f, ensure_ascii=False, indent=2)
+            self._save_points(points_data)
             
             result['deleted_points'] = deleted_points
             result['points_adjusted'] = deleted_points['daily_points']
         
+        if deleted_response or deleted_points:
+            self._remove_rollup_day(date)
+            self.search_index.remove_date(date)
+        
         # 3. 设置结果
         if deleted_response or deleted_points:
             result['success'] = True
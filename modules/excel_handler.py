@@ -1,85 +1,351 @@
-import pandas as pd
 import os
+import re
+import csv
 import json
+import zipfile
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, Iterator, List, Optional, Union
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.datavalidation import DataValidation
+from .feedback_log import FeedbackLog
 from .intelligent_answer_processor import IntelligentAnswerProcessor
+from .questionnaire import DailyQuestionnaire
+
+
+QUESTIONNAIRE_SHEET = '每日问卷'
+REQUIRED_COLUMNS = ['序号', '问题', '答案类型', '选项', '答案']
+# 隐藏列：问题ID用于导入时精确定位问题，问卷版本用于识别旧版问卷
+QUESTION_ID_COLUMN = '问题ID'
+SCHEMA_VERSION_COLUMN = '问卷版本'
+# 可选的备注列：对答案的补充说明，导入时作为用户反馈记录
+NOTES_COLUMN = '备注'
+
+# 问卷模板：每个问卷版本预先渲染一次，导出时只替换日期
+INSTRUCTIONS_SHEET = '填写说明'
+# 隐藏的选项表：每道选择题一列，作为答案单元格下拉列表的数据来源
+OPTIONS_SHEET = '选项'
+TEMPLATE_LAYOUT_VERSION = 2  # 修改模板样式或布局后递增，使旧模板失效
+DATE_PLACEHOLDER = '{{QUESTIONNAIRE_DATE}}'
+# 只写模式把字符串直接写在工作表XML里（inlineStr）
+TEMPLATE_SHEET_XML = 'xl/worksheets/sheet1.xml'
+
+# 轻量提交格式：按问题ID提交答案的JSON/CSV文件，不需要解析xlsx
+SUBMISSION_EXTENSIONS = ('.json', '.csv')
+QUESTIONNAIRE_EXTENSIONS = ('.xlsx',) + SUBMISSION_EXTENSIONS
+QUESTIONNAIRE_FILE_PATTERN = re.compile(r'^daily_questionnaire_(\d{4}-\d{2}-\d{2})\.(xlsx|json|csv)$')
+
+
+class ParsedQuestionnaire:
+    """
+    只解析一次的问卷工作表
+    
+    使用openpyxl只读模式流式读取，表头在打开时即校验，数据行按需读取并缓存，
+    验证和导入共用同一个对象，不会重复解析文件。
+    """
+    
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self._workbook = load_workbook(filepath, read_only=True, data_only=True)
+        
+        if QUESTIONNAIRE_SHEET not in self._workbook.sheetnames:
+            self._workbook.close()
+            raise ValueError(f"找不到工作表 '{QUESTIONNAIRE_SHEET}'")
+        
+        self._row_iter = self._workbook[QUESTIONNAIRE_SHEET].iter_rows(values_only=True)
+        header_row = next(self._row_iter, None) or ()
+        self.headers = [str(h).strip() if h is not None else '' for h in header_row]
+        self.missing_columns = [c for c in REQUIRED_COLUMNS if c not in self.headers]
+        
+        self._rows = []
+        self._exhausted = False
+    
+    def __iter__(self) -> Iterator[Dict]:
+        return self.iter_rows()
+    
+    def iter_rows(self) -> Iterator[Dict]:
+        """逐行返回 {列名: 值}，已读取的行会被缓存供再次遍历"""
+        index = 0
+        while True:
+            if index < len(self._rows):
+                yield self._rows[index]
+                index += 1
+                continue
+            
+            if self._exhausted:
+                return
+            
+            values = next(self._row_iter, None)
+            if values is None:
+                self._exhausted = True
+                self._workbook.close()
+                return
+            
+            # 跳过空行
+            if all(v is None for v in values):
+                continue
+            
+            self._rows.append(dict(zip(self.headers, values)))
+    
+    def close(self):
+        if not self._exhausted:
+            self._exhausted = True
+            self._workbook.close()
+
+
+class ParsedSubmission:
+    """
+    JSON/CSV格式的答案提交，与ParsedQuestionnaire提供相同的行接口
+    
+    JSON: {"date": "2025-07-08", "schema_version": "...", "answers": {"问题ID": 答案, ...},
+           "notes": {"问题ID": 备注, ...}}（也可以省略answers，直接把问题ID写在顶层）
+    CSV:  表头为 问题ID,答案[,备注]（或 question_id,answer[,note]），日期写在问题ID为date的行
+    """
+    
+    META_KEYS = ('date', 'schema_version', 'notes')
+    
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self.headers = [QUESTION_ID_COLUMN, '答案', NOTES_COLUMN]
+        self.missing_columns = []
+        
+        if filepath.lower().endswith('.json'):
+            answers, meta = self._read_json(filepath)
+        else:
+            answers, meta = self._read_csv(filepath)
+        
+        version = meta.get('schema_version')
+        notes = meta.get('notes') or {}
+        self._rows = []
+        # 日期按自动填充行的形式提供，和Excel问卷的日期行一致
+        if meta.get('date'):
+            self._rows.append({
+                '问题': '今天的日期',
+                '答案类型': '自动填充',
+                '答案': str(meta['date']).strip(),
+                SCHEMA_VERSION_COLUMN: version
+            })
+        for question_id, answer in answers.items():
+            self._rows.append({
+                QUESTION_ID_COLUMN: question_id,
+                '答案': answer,
+                NOTES_COLUMN: notes.get(question_id),
+                SCHEMA_VERSION_COLUMN: version
+            })
+    
+    @classmethod
+    def _read_json(cls, filepath: str):
+        with open(filepath, 'r', encoding='utf-8-sig') as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError("JSON答案文件的顶层必须是对象")
+        
+        meta = {k: data.get(k) for k in cls.META_KEYS}
+        answers = data.get('answers')
+        if answers is None:
+            answers = {k: v for k, v in data.items() if k not in cls.META_KEYS}
+        if not isinstance(answers, dict):
+            raise ValueError("answers 必须是 {问题ID: 答案} 形式的对象")
+        if meta['notes'] is not None and not isinstance(meta['notes'], dict):
+            raise ValueError("notes 必须是 {问题ID: 备注} 形式的对象")
+        return answers, meta
+    
+    @classmethod
+    def _read_csv(cls, filepath: str):
+        answers = {}
+        notes = {}
+        meta = {'notes': notes}
+        with open(filepath, 'r', encoding='utf-8-sig', newline='') as f:
+            reader = csv.reader(f)
+            header = [h.strip() for h in next(reader, [])]
+            id_col = next((header.index(h) for h in (QUESTION_ID_COLUMN, 'question_id', 'id') if h in header), None)
+            answer_col = next((header.index(h) for h in ('答案', 'answer') if h in header), None)
+            note_col = next((header.index(h) for h in (NOTES_COLUMN, 'note') if h in header), None)
+            if id_col is None or answer_col is None:
+                raise ValueError("CSV答案文件需要 问题ID 和 答案 两列")
+            
+            for values in reader:
+                if len(values) <= max(id_col, answer_col):
+                    continue
+                question_id = values[id_col].strip()
+                if not question_id:
+                    continue
+                if question_id in ('date', 'schema_version'):
+                    meta[question_id] = values[answer_col].strip()
+                    continue
+                answers[question_id] = values[answer_col]
+                if note_col is not None and note_col < len(values) and values[note_col].strip():
+                    notes[question_id] = values[note_col].strip()
+        return answers, meta
+    
+    def __iter__(self) -> Iterator[Dict]:
+        return self.iter_rows()
+    
+    def iter_rows(self) -> Iterator[Dict]:
+        return iter(self._rows)
+    
+    def close(self):
+        pass
 
 
 class ExcelHandler:
     def __init__(self):
         self.questionnaire_dir = "questionnaires"
+        self.template_dir = os.path.join(self.questionnaire_dir, "templates")
         os.makedirs(self.questionnaire_dir, exist_ok=True)
         self.intelligent_processor = IntelligentAnswerProcessor()
+        self.feedback_log = FeedbackLog(self.questionnaire_dir)
     
-    def export_questionnaire(self, questions: List[Dict]) -> str:
+    def export_questionnaire(self, questions: List[Dict], schema_version: str = "") -> str:
         """导出问卷到Excel文件"""
         today = datetime.now().strftime("%Y-%m-%d")
         filename = f"daily_questionnaire_{today}.xlsx"
         filepath = os.path.join(self.questionnaire_dir, filename)
         
-        # 准备导出数据
-        export_data = []
+        # 从预渲染的模板生成，只需填入日期
+        template_path = self.get_template(questions, schema_version)
+        self._fill_template(template_path, filepath, today)
+        
+        # 创建答题说明文件
+        instructions = self._create_instructions()
+        instructions_path = os.path.join(self.questionnaire_dir, f"填写说明_{today}.txt")
+        with open(instructions_path, 'w', encoding='utf-8') as f:
+            f.write(instructions)
+        
+        return filepath
+    
+    def get_template(self, questions: List[Dict], schema_version: str = "") -> str:
+        """获取当前问卷版本的模板文件，问卷结构变化时才重新生成"""
+        schema_version = schema_version or DailyQuestionnaire.compute_schema_version(questions)
+        template_path = os.path.join(
+            self.template_dir,
+            f"questionnaire_template_{schema_version}_v{TEMPLATE_LAYOUT_VERSION}.xlsx"
+        )
+        if not os.path.exists(template_path):
+            self._build_template(questions, schema_version, template_path)
+        return template_path
+    
+    def _build_template(self, questions: List[Dict], schema_version: str, template_path: str):
+        """用openpyxl只写模式渲染问卷模板（样式、列宽、说明页一次性写好）"""
+        os.makedirs(self.template_dir, exist_ok=True)
+        
+        workbook = Workbook(write_only=True)
+        worksheet = workbook.create_sheet(QUESTIONNAIRE_SHEET)
+        
+        # 设置列宽
+        worksheet.column_dimensions['A'].width = 8   # 序号
+        worksheet.column_dimensions['B'].width = 40  # 问题
+        worksheet.column_dimensions['C'].width = 12  # 答案类型
+        worksheet.column_dimensions['D'].width = 50  # 选项
+        worksheet.column_dimensions['E'].width = 30  # 答案
+        worksheet.column_dimensions['F'].width = 30  # 备注
+        
+        # 隐藏问题ID和问卷版本列
+        worksheet.column_dimensions['G'].hidden = True
+        worksheet.column_dimensions['H'].hidden = True
+        
+        thin = Side(style='thin')
+        header_font = Font(bold=True)
+        header_border = Border(left=thin, right=thin, top=thin, bottom=thin)
+        header_alignment = Alignment(horizontal='center', vertical='center')
+        wrap_alignment = Alignment(wrap_text=True, vertical='top')
+        
+        # 准备导出数据；选择题的选项另存一份，作为下拉列表的来源
+        rows = []
+        choice_lists = []  # (答案所在行, 选项列表)
         
         for i, question in enumerate(questions):
             if question["type"] == "auto":
-                # 自动填充的问题
-                export_data.append({
-                    "序号": i + 1,
-                    "问题": question["question"],
-                    "答案类型": "自动填充",
-                    "选项": "",
-                    "答案": question["value"]
-                })
+                # 自动填充的问题（日期在导出时填入）
+                value = DATE_PLACEHOLDER if question["id"] == "date" else question["value"]
+                rows.append([i + 1, question["question"], "自动填充", "", value])
             elif question["type"] == "choice":
                 # 选择题
                 options_str = "\n".join([f"{j}. {opt}" for j, opt in enumerate(question["options"])])
-                export_data.append({
-                    "序号": i + 1,
-                    "问题": question["question"],
-                    "答案类型": "选择题",
-                    "选项": options_str,
-                    "答案": ""  # 待填写
-                })
+                rows.append([i + 1, question["question"], "选择题", options_str, None])
+                choice_lists.append((len(rows) + 1, question["options"]))
             elif question["type"] == "text":
                 # 文本题
-                export_data.append({
-                    "序号": i + 1,
-                    "问题": question["question"],
-                    "答案类型": "文本",
-                    "选项": question.get("placeholder", ""),
-                    "答案": ""  # 待填写
-                })
+                rows.append([i + 1, question["question"], "文本", question.get("placeholder", ""), None])
+            else:
+                continue
+            rows[-1].extend([None, question["id"], schema_version])
         
-        # 创建DataFrame
-        df = pd.DataFrame(export_data)
+        # 设置行高（选项较多的行）
+        for row_index, row in enumerate(rows, start=2):
+            if "\n" in str(row[3]):
+                worksheet.row_dimensions[row_index].height = 100
         
-        # 导出到Excel，设置格式
-        with pd.ExcelWriter(filepath, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='每日问卷', index=False)
-            
-            # 获取工作表
-            worksheet = writer.sheets['每日问卷']
-            
-            # 设置列宽
-            worksheet.column_dimensions['A'].width = 8   # 序号
-            worksheet.column_dimensions['B'].width = 40  # 问题
-            worksheet.column_dimensions['C'].width = 12  # 答案类型
-            worksheet.column_dimensions['D'].width = 50  # 选项
-            worksheet.column_dimensions['E'].width = 30  # 答案
-            
-            # 设置行高（选项较多的行）
-            for row in range(2, len(export_data) + 2):
-                if "\n" in str(df.iloc[row-2]['选项']):
-                    worksheet.row_dimensions[row].height = 100
+        header = []
+        for title in REQUIRED_COLUMNS + [NOTES_COLUMN, QUESTION_ID_COLUMN, SCHEMA_VERSION_COLUMN]:
+            cell = WriteOnlyCell(worksheet, value=title)
+            cell.font = header_font
+            cell.border = header_border
+            cell.alignment = header_alignment
+            header.append(cell)
+        worksheet.append(header)
         
-        # 创建答题说明文件
-        instructions = self._create_instructions()
-        instructions_path = os.path.join(self.questionnaire_dir, f"填写说明_{today}.txt")
-        with open(instructions_path, 'w', encoding='utf-8') as f:
-            f.write(instructions)
+        for row in rows:
+            cells = []
+            for col_index, value in enumerate(row):
+                cell = WriteOnlyCell(worksheet, value=value)
+                if col_index in (1, 3, 5):  # 问题、选项、备注列自动换行
+                    cell.alignment = wrap_alignment
+                cells.append(cell)
+            worksheet.append(cells)
         
-        return filepath
+        # 填写说明页
+        instructions_sheet = workbook.create_sheet(INSTRUCTIONS_SHEET)
+        instructions_sheet.column_dimensions['A'].width = 80
+        for line in self._create_instructions().split("\n"):
+            instructions_sheet.append([line])
+        
+        # 答案单元格的下拉列表：选项原文可在导入时直接精确匹配，
+        # 不再需要自然语言识别；仍允许手动填写编号或文字（只给出提示）
+        if choice_lists:
+            options_sheet = workbook.create_sheet(OPTIONS_SHEET)
+            options_sheet.sheet_state = 'hidden'
+            max_options = max(len(options) for _, options in choice_lists)
+            for option_row in range(max_options):
+                options_sheet.append([
+                    options[option_row] if option_row < len(options) else None
+                    for _, options in choice_lists
+                ])
+            
+            for col_index, (answer_row, options) in enumerate(choice_lists, start=1):
+                column = get_column_letter(col_index)
+                validation = DataValidation(
+                    type='list',
+                    formula1=f"'{OPTIONS_SHEET}'!${column}$1:${column}${len(options)}",
+                    allow_blank=True,
+                    showInputMessage=True,
+                    promptTitle='请选择答案',
+                    prompt='点击右侧箭头从列表中选择，需要说明请写在备注列',
+                    showErrorMessage=True,
+                    errorStyle='warning',
+                    errorTitle='不在选项中',
+                    error='建议从下拉列表中选择；确定要保留当前内容吗？'
+                )
+                validation.add(f"E{answer_row}")
+                worksheet.data_validations.append(validation)
+        
+        # 先写临时文件再替换，避免并发导出读到不完整的模板
+        tmp_path = f"{template_path}.{os.getpid()}.tmp"
+        workbook.save(tmp_path)
+        os.replace(tmp_path, template_path)
+    
+    @staticmethod
+    def _fill_template(template_path: str, filepath: str, date: str):
+        """复制模板并填入日期（只改写问卷工作表的XML，其余部分原样复制）"""
+        with zipfile.ZipFile(template_path, 'r') as source, \
+                zipfile.ZipFile(filepath, 'w', zipfile.ZIP_DEFLATED) as target:
+            for item in source.infolist():
+                data = source.read(item.filename)
+                if item.filename == TEMPLATE_SHEET_XML:
+                    data = data.replace(DATE_PLACEHOLDER.encode('utf-8'), date.encode('utf-8'))
+                target.writestr(item, data)
     
     def _create_instructions(self) -> str:
         return """ZZW考公学习日记 - 每日问卷填写说明
@@ -87,8 +353,9 @@ class ExcelHandler:
 📝 填写说明：
 
 1. 选择题填写方式：
-   - 请在"答案"列填写选项编号（0, 1, 2等）
-   - 例如：如果选择"1. 📝 部分完成"，请填写数字 1
+   - 点击"答案"单元格，从下拉列表中选择对应的选项
+   - 也可以填写选项编号（0, 1, 2等），例如选择"1. 📝 部分完成"填写数字 1
+   - 需要补充说明时，写在"备注"列，不要写在答案里
 
 2. 文本题填写方式：
    - 直接在"答案"列填写文字内容
@@ -103,7 +370,7 @@ class ExcelHandler:
    0. 🚫 没有学习
    1. ⏱️ 30分钟以下
    2. ⏱️ 30-60分钟
-   答案：2  （表示选择了30-60分钟）
+   答案：从下拉列表选择"⏱️ 30-60分钟"，或填写 2
 
 5. 保存文件：
    - 填写完成后，请保存文件
@@ -112,40 +379,70 @@ class ExcelHandler:
 祝学习顺利！💪
 """
     
-    def import_answers(self, filepath: str, questions: List[Dict]) -> Dict:
-        """从Excel文件导入答案"""
+    def open_questionnaire(self, filepath: str) -> Union[ParsedQuestionnaire, ParsedSubmission]:
+        """打开问卷文件（只解析一次，供验证和导入共用），JSON/CSV按轻量提交格式读取"""
         if not os.path.exists(filepath):
             raise FileNotFoundError(f"找不到文件: {filepath}")
+        if filepath.lower().endswith(SUBMISSION_EXTENSIONS):
+            return ParsedSubmission(filepath)
+        return ParsedQuestionnaire(filepath)
         
-        # 读取Excel文件
-        df = pd.read_excel(filepath, sheet_name='每日问卷')
+    def parse_answers(self, filepath: str, questions: List[Dict],
+                      parsed: Optional[Union[ParsedQuestionnaire, ParsedSubmission]] = None,
+                      schema_version: str = "") -> Dict:
+        """
+        解析并智能识别问卷答案（不打印、不写文件，可在子进程中调用）
+        
+        Returns:
+            {'date', 'responses', 'warnings', 'feedback', 'tier_summary', 'file_version'}
+        """
+        if parsed is None:
+            parsed = self.open_questionnaire(filepath)
         
         # 提取问卷的原始日期（从文件名或Excel内容中）
-        questionnaire_date = self._extract_questionnaire_date(filepath, df)
-        print(f"📅 问卷原始日期: {questionnaire_date}")
+        questionnaire_date = self._extract_questionnaire_date(filepath, parsed)
+        
+        # 按问题ID建立索引；旧版问卷没有ID列时按问题文本查找
+        questions_by_id = {q['id']: q for q in questions}
+        questions_by_text = {q['question']: q for q in questions}
+        file_version = None
         
-        # 提取答案
+        # 提取答案和备注
         responses = {}
+        notes = []
         
-        for i, row in df.iterrows():
+        for row in parsed.iter_rows():
             # 跳过自动填充的问题
-            if row['答案类型'] == '自动填充':
+            if row.get('答案类型') == '自动填充':
                 # 对于日期问题，使用问卷的原始日期而不是当前日期
-                if row['问题'] == '今天的日期':
+                if row.get('问题') == '今天的日期':
                     responses['date'] = questionnaire_date
                 continue
             
             # 找到对应的问题
-            question = None
-            for q in questions:
-                if q['question'] == row['问题']:
-                    question = q
-                    break
+            question = questions_by_id.get(row.get(QUESTION_ID_COLUMN))
+            if question is None:
+                question = questions_by_text.get(row.get('问题'))
+            
+            if file_version is None and row.get(SCHEMA_VERSION_COLUMN):
+                file_version = str(row.get(SCHEMA_VERSION_COLUMN))
             
             if not question:
                 continue
             
-            answer = row['答案']
+            note = row.get(NOTES_COLUMN)
+            if note is not None and str(note).strip():
+                notes.append({
+                    'question': question['question'],
+                    'feedback': f"用户备注：{str(note).strip()}",
+                    'original_answer': row.get('答案')
+                })
+            
+            answer = row.get('答案')
+            
+            # 未填写的题目跳过
+            if answer is None or not str(answer).strip():
+                continue
             
             # 处理不同类型的答案
             if question['type'] == 'choice':
@@ -154,8 +451,7 @@ class ExcelHandler:
             
             elif question['type'] == 'text':
                 # 文本答案
-                if pd.notna(answer) and str(answer).strip():
-                    responses[question['id']] = str(answer).strip()
+                responses[question['id']] = str(answer).strip()
         
         # 确保日期字段被正确设置
         if 'date' not in responses:
@@ -166,16 +462,45 @@ class ExcelHandler:
             responses, questions
         )
         
+        # 取出本次的用户反馈，避免累积到下一份问卷
+        user_feedback = list(self.intelligent_processor.get_user_feedback()) + notes
+        self.intelligent_processor.clear_feedback()
+        
+        return {
+            'date': questionnaire_date,
+            'responses': processed_responses,
+            'warnings': warnings,
+            'feedback': user_feedback,
+            'tier_summary': self.intelligent_processor.format_tier_metrics(),
+            'file_version': file_version
+        }
+    
+    def import_answers(self, filepath: str, questions: List[Dict],
+                       parsed: Optional[Union[ParsedQuestionnaire, ParsedSubmission]] = None,
+                       schema_version: str = "") -> Dict:
+        """从Excel文件（或JSON/CSV提交）导入答案"""
+        result = self.parse_answers(filepath, questions, parsed, schema_version)
+        print(f"📅 问卷原始日期: {result['date']}")
+        
+        # 问卷结构变化后，旧问卷中的选项编号可能已对应不同选项
+        if schema_version and result['file_version'] and result['file_version'] != schema_version:
+            print(f"⚠️ 问卷版本({result['file_version']})与当前版本({schema_version})不一致，请核对识别结果")
+        
         # 打印警告信息
+        warnings = result['warnings']
         if warnings:
             print("\n📋 智能答案识别结果:")
             print("-" * 50)
             for warning in warnings:
                 print(f"  • {warning}")
             print("-" * 50)
-        
+
+        # 打印各识别层级的命中数和耗时
+        if result['tier_summary']:
+            print(f"\n⏱️ 识别层级统计: {result['tier_summary']}")
+
         # 检查是否有用户反馈
-        user_feedback = self.intelligent_processor.get_user_feedback()
+        user_feedback = result['feedback']
         if user_feedback:
             print("\n💡 用户反馈（问题修改建议）:")
             print("-" * 50)
@@ -184,53 +509,54 @@ class ExcelHandler:
                 print(f"     {feedback['feedback']}")
             print("-" * 50)
             
-            # 保存反馈到文件
-            feedback_file = os.path.join(self.questionnaire_dir, "user_feedback.json")
-            existing_feedback = []
-            if os.path.exists(feedback_file):
-                with open(feedback_file, 'r', encoding='utf-8') as f:
-                    existing_feedback = json.load(f)
-            
-            # 添加时间戳
-            for fb in user_feedback:
-                fb['timestamp'] = datetime.now().isoformat()
-            
-            existing_feedback.extend(user_feedback)
-            
-            with open(feedback_file, 'w', encoding='utf-8') as f:
-                json.dump(existing_feedback, f, ensure_ascii=False, indent=2)
+            self.save_user_feedback(user_feedback)
             
             print("\n是否要根据这些反馈修改问卷问题？")
-            print("（反馈已保存到 questionnaires/user_feedback.json）")
+            print("（反馈已追加到 questionnaires/user_feedback.*.jsonl）")
             
-            # 清空反馈
-            self.intelligent_processor.clear_feedback()
+        return result['responses']
         
-        return processed_responses
+    def save_user_feedback(self, user_feedback: List[Dict]):
+        """把反馈追加到反馈日志（只写新反馈，不读取已有内容）"""
+        self.feedback_log.append(user_feedback)
     
-    def validate_excel_file(self, filepath: str) -> bool:
-        """验证Excel文件格式是否正确"""
+    def validate_excel_file(self, source: Union[str, ParsedQuestionnaire, ParsedSubmission]) -> bool:
+        """验证Excel文件格式是否正确（可直接传入已解析的问卷，传入路径时用完即关闭）"""
+        error = self.validation_error(source)
+        if error:
+            print(error)
+            return False
+        return True
+    
+    def validation_error(self, source: Union[str, ParsedQuestionnaire, ParsedSubmission]) -> Optional[str]:
+        """
+        检查表头和是否至少填写了一个答案，通过时返回None，否则返回原因
+        
+        不打印，批量导入的子进程和后台监听用它跳过空白或未完成的问卷。
+        """
+        parsed = None
+        owned = not isinstance(source, (ParsedQuestionnaire, ParsedSubmission))
         try:
-            df = pd.read_excel(filepath, sheet_name='每日问卷')
-            required_columns = ['序号', '问题', '答案类型', '选项', '答案']
+            parsed = self.open_questionnaire(source) if owned else source
             
             # 检查必需的列
-            for col in required_columns:
-                if col not in df.columns:
-                    print(f"错误：缺少必需的列 '{col}'")
-                    return False
+            if parsed.missing_columns:
+                return f"错误：缺少必需的列 '{parsed.missing_columns[0]}'"
             
-            # 检查是否有答案
-            answered_count = df[df['答案类型'] != '自动填充']['答案'].notna().sum()
-            if answered_count == 0:
-                print("警告：没有找到任何已填写的答案")
-                return False
+            # 检查是否有答案（找到第一个已填写的答案即可停止读取）
+            for row in parsed.iter_rows():
+                answer = row.get('答案')
+                if row.get('答案类型') != '自动填充' and answer is not None and str(answer).strip():
+                    return None
             
-            return True
+            return "警告：没有找到任何已填写的答案"
             
         except Exception as e:
-            print(f"读取Excel文件时出错: {e}")
-            return False
+            return f"读取Excel文件时出错: {e}"
+        finally:
+            # 只读模式的工作簿在读完之前一直占用文件（Windows上会导致之后无法移动）
+            if owned and parsed is not None:
+                parsed.close()
     
     def get_latest_questionnaire(self) -> str:
         """获取最新的问卷文件路径"""
@@ -250,38 +576,38 @@ class ExcelHandler:
         if not os.path.exists(answered_dir):
             return []
         
-        files = [f for f in os.listdir(answered_dir) 
-                if f.startswith('daily_questionnaire_') and f.endswith('.xlsx')]
+        files = [f for f in os.listdir(answered_dir) if QUESTIONNAIRE_FILE_PATTERN.match(f)]
         
         return [os.path.join(answered_dir, f) for f in sorted(files, reverse=True)]
     
-    def _extract_questionnaire_date(self, filepath: str, df: pd.DataFrame) -> str:
+    def _extract_questionnaire_date(self, filepath: str,
+                                    parsed: Union[ParsedQuestionnaire, ParsedSubmission]) -> str:
         """提取问卷的原始日期"""
         # 方法1：从文件名提取日期
         filename = os.path.basename(filepath)
-        # 文件名格式：daily_questionnaire_YYYY-MM-DD.xlsx
-        import re
-        date_match = re.search(r'daily_questionnaire_(\d{4}-\d{2}-\d{2})\.xlsx', filename)
+        # 文件名格式：daily_questionnaire_YYYY-MM-DD.xlsx（或.json/.csv）
+        date_match = QUESTIONNAIRE_FILE_PATTERN.search(filename)
         if date_match:
             return date_match.group(1)
         
         # 方法2：从Excel内容中的日期字段提取
-        for i, row in df.iterrows():
-            if row['问题'] == '今天的日期' and row['答案类型'] == '自动填充':
-                date_value = row['答案']
-                if pd.notna(date_value):
+        for row in parsed.iter_rows():
+            if row.get('问题') == '今天的日期' and row.get('答案类型') == '自动填充':
+                date_value = row.get('答案')
+                if isinstance(date_value, datetime):
+                    return date_value.strftime("%Y-%m-%d")
+                if date_value is not None:
                     # 处理可能的日期格式
-                    date_str = str(date_value)
+                    date_str = str(date_value).strip()
                     # 如果是标准格式 YYYY-MM-DD，直接返回
                     if re.match(r'\d{4}-\d{2}-\d{2}', date_str):
-                        return date_str
+                        return date_str[:10]
                     # 如果是其他日期格式，尝试解析
-                    try:
-                        from datetime import datetime
-                        parsed_date = pd.to_datetime(date_str)
-                        return parsed_date.strftime("%Y-%m-%d")
-                    except:
-                        pass
+                    for fmt in ("%Y/%m/%d", "%Y.%m.%d", "%Y年%m月%d日"):
+                        try:
+                            return datetime.strptime(date_str, fmt).strftime("%Y-%m-%d")
+                        except ValueError:
+                            pass
         
         # 方法3：如果都失败了，使用当前日期（回退方案）
         return datetime.now().strftime("%Y-%m-%d")
\ No newline at end of file
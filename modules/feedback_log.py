@@ -0,0 +1,165 @@
+import os
+import re
+import json
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows：只在进程内加锁
+    fcntl = None
+
+
+FEEDBACK_MAX_BYTES = 256 * 1024
+FEEDBACK_KEEP_SEGMENTS = 5
+
+SEGMENT_PATTERN = re.compile(r'^user_feedback\.(\d{6})\.jsonl$')
+
+
+class FeedbackLog:
+    """
+    只追加的用户反馈日志（questionnaires/user_feedback.NNNNNN.jsonl）
+    
+    每次导入只把新反馈追加到当前分段，分段超过max_bytes后开启新分段。
+    user_feedback.cursor.json记录已经处理到的位置（分段编号和字节偏移），
+    read_new()只读取位置之后的反馈，处理完后用commit()前移。
+    处理过的旧分段只保留最近keep个。
+    """
+    
+    def __init__(self, log_dir: str = "questionnaires",
+                 max_bytes: int = FEEDBACK_MAX_BYTES,
+                 keep: int = FEEDBACK_KEEP_SEGMENTS):
+        self.log_dir = log_dir
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.cursor_file = os.path.join(log_dir, "user_feedback.cursor.json")
+        self.lock_file = os.path.join(log_dir, ".user_feedback.lock")
+        self.legacy_file = os.path.join(log_dir, "user_feedback.json")
+        self._thread_lock = threading.Lock()
+    
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.log_dir, exist_ok=True)
+        with self._thread_lock, open(self.lock_file, 'a') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._migrate_legacy()
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+    
+    # ---------- 分段 ----------
+    
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.log_dir, f"user_feedback.{number:06d}.jsonl")
+    
+    def _segments(self) -> List[int]:
+        if not os.path.isdir(self.log_dir):
+            return []
+        numbers = []
+        for name in os.listdir(self.log_dir):
+            match = SEGMENT_PATTERN.match(name)
+            if match:
+                numbers.append(int(match.group(1)))
+        return sorted(numbers)
+    
+    def _write(self, entries: List[Dict]):
+        """追加到当前分段，当前分段已满时开启新分段（调用方持有锁）"""
+        segments = self._segments()
+        number = segments[-1] if segments else 1
+        path = self._segment_path(number)
+        if os.path.exists(path) and os.path.getsize(path) >= self.max_bytes:
+            number += 1
+            path = self._segment_path(number)
+        data = ''.join(json.dumps(e, ensure_ascii=False) + '\n' for e in entries).encode('utf-8')
+        with open(path, 'ab+') as f:
+            # 上次写到一半退出时补上换行，不让新反馈接在半行后面
+            if f.tell():
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    data = b'\n' + data
+            f.write(data)
+    
+    # ---------- 游标 ----------
+    
+    def _load_cursor(self) -> Dict:
+        try:
+            with open(self.cursor_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'segment': 1, 'offset': 0}
+    
+    def _save_cursor(self, cursor: Dict):
+        tmp_path = self.cursor_file + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cursor, f)
+        os.replace(tmp_path, self.cursor_file)
+    
+    def _end_position(self) -> Dict:
+        segments = self._segments()
+        if not segments:
+            return {'segment': 1, 'offset': 0}
+        return {'segment': segments[-1], 'offset': os.path.getsize(self._segment_path(segments[-1]))}
+    
+    def _migrate_legacy(self):
+        """把旧的user_feedback.json迁入日志；旧反馈已经按原来的流程处理过，游标移到它们之后"""
+        if not os.path.exists(self.legacy_file):
+            return
+        with open(self.legacy_file, 'r', encoding='utf-8') as f:
+            try:
+                legacy = json.load(f)
+            except ValueError:
+                legacy = []
+        if legacy:
+            self._write(legacy)
+            self._save_cursor(self._end_position())
+        os.replace(self.legacy_file, self.legacy_file + '.migrated')
+    
+    # ---------- 接口 ----------
+    
+    def append(self, entries: List[Dict]):
+        """追加一批反馈（加上时间戳）"""
+        if not entries:
+            return
+        timestamp = datetime.now().isoformat()
+        for entry in entries:
+            entry['timestamp'] = timestamp
+        with self._locked():
+            self._write(entries)
+    
+    def read_new(self) -> Tuple[List[Dict], Dict]:
+        """游标之后的反馈和读到的位置；处理完后把位置传给commit()"""
+        with self._locked():
+            cursor = self._load_cursor()
+            entries = []
+            position = dict(cursor)
+            for number in self._segments():
+                if number < cursor['segment']:
+                    continue
+                offset = cursor['offset'] if number == cursor['segment'] else 0
+                with open(self._segment_path(number), 'rb') as f:
+                    f.seek(offset)
+                    data = f.read()
+                end = data.rfind(b'\n') + 1
+                for line in data[:end].splitlines():
+                    if not line.strip():
+                        continue
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # 中途退出留下的半行
+                        continue
+                position = {'segment': number, 'offset': offset + end}
+            return entries, position
+    
+    def commit(self, position: Dict):
+        """把游标前移到position，并清理已处理且超出保留数量的旧分段"""
+        with self._locked():
+            self._save_cursor(position)
+            processed = [n for n in self._segments() if n < position['segment']]
+            for number in processed[:max(0, len(processed) - (self.keep - 1))]:
+                os.remove(self._segment_path(number))
@@ -0,0 +1,188 @@
+import os
+import time
+import select
+import ctypes
+import ctypes.util
+import zipfile
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .excel_handler import QUESTIONNAIRE_FILE_PATTERN
+
+
+# inotify事件掩码（linux/inotify.h）
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0x00000800
+
+
+class _Inotify:
+    """通过libc使用Linux inotify，只用作"目录有变化"的唤醒信号"""
+    
+    def __init__(self, directory: str):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"无法监听目录: {directory}")
+    
+    def wait(self, timeout: float) -> bool:
+        """等待目录变化，返回是否有事件"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        # 读空事件缓冲区，具体事件内容不需要解析
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+    
+    def close(self):
+        os.close(self.fd)
+
+
+class QuestionnaireWatcher:
+    """
+    监听问卷目录，自动导入新提交或修改过的问卷
+    
+    有inotify时由文件系统事件唤醒，否则定时轮询目录。文件大小和修改时间
+    在settle_seconds内保持不变（xlsx还要求是完整的zip文件）后才导入，避免读到写了一半的文件。
+    刚导出的空白问卷和还没填写答案的文件（与交互式导入相同的验证）不会导入，文件变化后再检查。
+    JSON/CSV格式的答案提交同样会被识别导入。
+    导入复用BulkImporter：进程池并行解析，按日期顺序写入，完成后移到answered目录。
+    """
+    
+    def __init__(self, bulk_importer, directory: str,
+                 settle_seconds: float = 2.0,
+                 poll_interval: float = 1.0,
+                 generate_reports: bool = False,
+                 progress: Optional[Callable[[str], None]] = None):
+        self.bulk_importer = bulk_importer
+        self.directory = directory
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.generate_reports = generate_reports
+        self.progress = progress or print
+        self.stop_event = threading.Event()
+        
+        # 文件名 -> (大小, 修改时间, 最近一次变化的时间)
+        self._pending: Dict[str, Tuple[int, float, float]] = {}
+        # 导入失败或没有通过验证的文件在内容变化前不再重试
+        self._failed: Dict[str, Tuple[int, float]] = {}
+    
+    def _open_inotify(self) -> Optional[_Inotify]:
+        try:
+            return _Inotify(self.directory)
+        except (OSError, AttributeError, TypeError):
+            return None
+    
+    def _scan(self) -> List[str]:
+        """扫描目录，返回已经稳定、可以导入的文件"""
+        now = time.monotonic()
+        seen = set()
+        ready = []
+        
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file() or not QUESTIONNAIRE_FILE_PATTERN.match(entry.name):
+                    continue
+                stat = entry.stat()
+                signature = (stat.st_size, stat.st_mtime)
+                seen.add(entry.name)
+                
+                if self._failed.get(entry.name) == signature:
+                    continue
+                
+                previous = self._pending.get(entry.name)
+                if previous is None or previous[:2] != signature:
+                    self._pending[entry.name] = (stat.st_size, stat.st_mtime, now)
+                    continue
+                
+                if now - previous[2] < self.settle_seconds:
+                    continue
+                if entry.name.endswith('.xlsx') and not zipfile.is_zipfile(entry.path):
+                    continue
+                
+                # 空白问卷（菜单1刚导出的）或正在填写、只自动保存了一部分的文件：不导入、不移动
+                error = self.bulk_importer.excel_handler.validation_error(entry.path)
+                if error:
+                    del self._pending[entry.name]
+                    self._failed[entry.name] = signature
+                    self.progress(f"⏳ 暂不导入 {entry.name}（{error}），文件修改后再检查")
+                    continue
+                ready.append(entry.path)
+        
+        # 已经不存在的文件不再跟踪
+        for name in list(self._pending):
+            if name not in seen:
+                del self._pending[name]
+        for name in list(self._failed):
+            if name not in seen:
+                del self._failed[name]
+        
+        return ready
+    
+    def _import(self, filepaths: List[str], pool):
+        for path in filepaths:
+            self._pending.pop(os.path.basename(path), None)
+        
+        result = self.bulk_importer.run(
+            filepaths,
+            generate_reports=self.generate_reports,
+            move_files=True,
+            progress=self.progress,
+            pool=pool
+        )
+        
+        # 失败的文件和内容未变、已经导入过的文件都等到文件变化后再处理
+        for path in [item['file'] for item in result['failed']] + result['skipped_files']:
+            if os.path.exists(path):
+                stat = os.stat(path)
+                self._failed[os.path.basename(path)] = (stat.st_size, stat.st_mtime)
+        
+        return result
+    
+    def run_forever(self):
+        """持续监听，直到stop()被调用或收到Ctrl+C"""
+        os.makedirs(self.directory, exist_ok=True)
+        inotify = self._open_inotify()
+        mode = "inotify" if inotify else f"轮询（每{self.poll_interval}秒）"
+        self.progress(f"👀 正在监听 {self.directory}，模式: {mode}")
+        
+        pool = self.bulk_importer.create_pool()
+        try:
+            while not self.stop_event.is_set():
+                ready = self._scan()
+                if ready:
+                    self._import(ready, pool)
+                
+                # 还有等待稳定的文件时按debounce间隔复查；
+                # 使用inotify时空闲等待可以更长，有事件会被提前唤醒
+                if self._pending:
+                    timeout = min(self.poll_interval, self.settle_seconds / 2)
+                elif inotify:
+                    timeout = 5.0
+                else:
+                    timeout = self.poll_interval
+                
+                if inotify:
+                    inotify.wait(timeout)
+                else:
+                    self.stop_event.wait(timeout)
+        finally:
+            pool.shutdown()
+            if inotify:
+                inotify.close()
+    
+    def stop(self):
+        self.stop_event.set()
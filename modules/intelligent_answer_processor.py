@@ -1,16 +1,64 @@
 import subprocess
 import json
+import os
 import re
+import time
+import hashlib
+import threading
+from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 
+try:
+    import fcntl
+except ImportError:  # Windows：只在进程内加锁
+    fcntl = None
+
+from .llm_client import LLMError, LLMTimeout, LLMUnavailable, default_client
+
 
 class IntelligentAnswerProcessor:
     """使用gemini-cli智能处理自然语言答案"""
     
-    def __init__(self):
+    # 答案识别层级（按顺序执行，命中且置信度达标即短路）
+    TIER_ORDER = ['exact_index', 'option_number', 'quantity', 'keyword', 'llm_cache', 'llm']
+    
+    # 各层级命中时给出的置信度，部署时可按需覆盖
+    TIER_CONFIDENCE = {
+        'exact_index': 1.0,
+        'option_number': 0.9,
+        'llm_cache': 0.85,
+        'quantity': 0.8,
+        'llm': 0.75,
+        'keyword': 0.6,
+        'keyword_default': 0.3
+    }
+    
+    def __init__(self, confidence_threshold: float = 0.7,
+                 cache_file: str = os.path.join("data", "llm_answer_cache.json"),
+                 metrics_file: str = os.path.join("data", "answer_tier_metrics.jsonl"),
+                 llm_client=None):
+        self.llm_client = llm_client or default_client()
         self.gemini_available = self._check_gemini_available()
         self.user_feedback = []  # 收集用户反馈
         self.gemini_warnings = []  # 收集gemini相关的警告
+        
+        # 置信度低于阈值的结果不会短路，会继续尝试后续层级
+        self.confidence_threshold = confidence_threshold
+        self.cache_file = cache_file
+        self.metrics_file = metrics_file
+        self._llm_cache = None  # 延迟加载
+        self._cache_lock = threading.Lock()
+        self._option_index = {}  # 问题ID -> {选项文本: 索引}
+        
+        self.tiers = [
+            ('exact_index', self._tier_exact_index),
+            ('option_number', self._tier_option_number),
+            ('quantity', self._tier_quantity),
+            ('keyword', self._tier_keyword),
+            ('llm_cache', self._tier_llm_cache),
+            ('llm', self._tier_llm),
+        ]
+        self.tier_metrics = self._empty_tier_metrics()
     
     def _check_gemini_available(self) -> bool:
         """检查gemini-cli是否可用"""
@@ -99,6 +147,178 @@ class IntelligentAnswerProcessor:
         
         return None
     
+    def resolve_answer(self, answer, question: Dict) -> Tuple[Optional[int], float, Optional[str]]:
+        """
+        按层级流水线识别答案
+        
+        每个层级返回(选项索引, 置信度)，置信度达到阈值即短路；
+        所有层级都未达标时，采用置信度最高的候选结果。
+        
+        Returns:
+            (选项索引, 置信度, 命中层级)
+        """
+        options = question['options']
+        context = {
+            'raw': answer,
+            'answer': str(answer).strip(),
+            'question': question,
+            'options': options,
+            'quantity': None
+        }
+        context['quantity'] = self._extract_quantity_from_answer(context['answer'])
+        
+        best_index, best_confidence, best_tier = None, 0.0, None
+        
+        for name, tier in self.tiers:
+            start = time.perf_counter()
+            index, confidence = tier(context)
+            metrics = self.tier_metrics[name]
+            metrics['calls'] += 1
+            metrics['seconds'] += time.perf_counter() - start
+            
+            if index is None or not 0 <= index < len(options):
+                continue
+            
+            if confidence >= self.confidence_threshold:
+                metrics['hits'] += 1
+                return index, confidence, name
+            
+            if confidence > best_confidence:
+                best_index, best_confidence, best_tier = index, confidence, name
+        
+        if best_tier is not None:
+            self.tier_metrics[best_tier]['hits'] += 1
+        
+        return best_index, best_confidence, best_tier
+    
+    def _tier_exact_index(self, context: Dict) -> Tuple[Optional[int], float]:
+        """层级1：答案本身就是有效的选项编号或选项原文"""
+        raw = context['raw']
+        answer = context['answer']
+        confidence = self.TIER_CONFIDENCE['exact_index']
+        
+        if isinstance(raw, bool):
+            return None, 0.0
+        if isinstance(raw, int):
+            return raw, confidence
+        if isinstance(raw, float) and raw.is_integer():
+            return int(raw), confidence
+        if answer.isdigit():
+            return int(answer), confidence
+        
+        index = self._get_option_index(context['question']).get(answer)
+        if index is not None:
+            return index, confidence
+        
+        return None, 0.0
+    
+    def _get_option_index(self, question: Dict) -> Dict[str, int]:
+        """获取问题的 选项文本->索引 字典（同时收录去掉emoji前缀的文本）"""
+        key = (question['id'], tuple(question['options']))
+        index = self._option_index.get(key)
+        if index is None:
+            index = {}
+            for i, option in enumerate(question['options']):
+                index.setdefault(option.strip(), i)
+                parts = option.strip().split(' ', 1)
+                if len(parts) == 2:
+                    index.setdefault(parts[1].strip(), i)
+            self._option_index[key] = index
+        return index
+    
+    def _tier_option_number(self, context: Dict) -> Tuple[Optional[int], float]:
+        """层级2：从答案中提取选项编号（如"2 有时候..."、"选项3"）"""
+        option_num = self._extract_option_number(context['answer'])
+        if option_num is None:
+            return None, 0.0
+        return option_num, self.TIER_CONFIDENCE['option_number']
+    
+    def _tier_quantity(self, context: Dict) -> Tuple[Optional[int], float]:
+        """层级3：按提取到的数量匹配选项区间"""
+        quantity = context['quantity']
+        if quantity is None or quantity <= 0:
+            return None, 0.0
+        
+        index = self._match_quantity_interval(context['options'], quantity)
+        if index is None:
+            return None, 0.0
+        return index, self.TIER_CONFIDENCE['quantity']
+    
+    def _tier_keyword(self, context: Dict) -> Tuple[Optional[int], float]:
+        """层级4：关键词匹配"""
+        return self._match_keywords(context['answer'], context['options'], context['quantity'])
+    
+    def _tier_llm_cache(self, context: Dict) -> Tuple[Optional[int], float]:
+        """层级5：之前Gemini对相同问题和答案的识别结果"""
+        cache = self._load_llm_cache()
+        index = cache.get(self._llm_cache_key(context))
+        if index is None:
+            return None, 0.0
+        return index, self.TIER_CONFIDENCE['llm_cache']
+    
+    def _tier_llm(self, context: Dict) -> Tuple[Optional[int], float]:
+        """层级6：实时调用Gemini"""
+        if not self.gemini_available or not self.llm_client.is_available():
+            return None, 0.0
+        
+        index = self._call_gemini_for_option(
+            context['answer'], context['question']['question'], context['options']
+        )
+        if index is None:
+            return None, 0.0
+        
+        self._save_llm_cache_entry(self._llm_cache_key(context), index)
+        return index, self.TIER_CONFIDENCE['llm']
+    
+    def _llm_cache_key(self, context: Dict) -> str:
+        key_source = json.dumps(
+            [context['question']['question'], context['options'], context['answer']],
+            ensure_ascii=False
+        )
+        return hashlib.sha1(key_source.encode('utf-8')).hexdigest()
+    
+    def _read_llm_cache_file(self) -> Dict[str, int]:
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def _load_llm_cache(self) -> Dict[str, int]:
+        if self._llm_cache is None:
+            self._llm_cache = self._read_llm_cache_file() if self.cache_file else {}
+        return self._llm_cache
+    
+    def _save_llm_cache_entry(self, key: str, index: int):
+        """
+        写入一条缓存
+        
+        多个进程可能同时写缓存文件：持有文件锁时重新读取文件，合并其他进程新写入的条目后
+        写到临时文件再替换，不会互相覆盖，中途退出也不会留下写了一半的文件。
+        """
+        cache = self._load_llm_cache()
+        cache[key] = index
+        if not self.cache_file:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_file) or '.', exist_ok=True)
+            with self._cache_lock, open(self.cache_file + '.lock', 'a') as lock:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    merged = self._read_llm_cache_file()
+                    merged.update(cache)
+                    tmp_path = self.cache_file + '.tmp'
+                    with open(tmp_path, 'w', encoding='utf-8') as f:
+                        json.dump(merged, f, ensure_ascii=False)
+                    os.replace(tmp_path, self.cache_file)
+                    cache.update(merged)
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+        except OSError:
+            pass
+    
     def process_natural_language_answer(self, 
                                       answer: str, 
                                       question: str, 
@@ -109,32 +329,17 @@ class IntelligentAnswerProcessor:
         Returns:
             (选项索引, 用户反馈/理由)
         """
-        # 1. 优先检查是否直接包含选项编号
-        option_num = self._extract_option_number(answer)
-        
-        # 2. 检查是否有不需要的理由（即使有选项编号也要检查）
+        # 检查是否有不需要的理由（无论哪个层级命中都要检查）
         reason = self._check_user_reason(answer)
         
-        # 如果找到了选项编号且有效，直接返回（但带上理由）
-        if option_num is not None and 0 <= option_num < len(options):
-            return option_num, reason
-        
-        # 3. 提取数量信息进行匹配
-        quantity = self._extract_quantity_from_answer(answer)
-        
-        # 特殊检查：如果提取到了正数，确保不会返回"没有"选项
-        if quantity and quantity > 0:
-            # 检查第一个选项是否是"没有"相关
-            first_option_lower = options[0].lower() if options else ""
-            if any(neg in first_option_lower for neg in ['没有', '不', '🚫', '无']):
-                # 直接使用增强的回退处理，避免返回"没有"
-                return self._enhanced_fallback_processing(answer, options, quantity), reason
+        index, _, _ = self.resolve_answer(
+            answer, {'id': question, 'question': question, 'options': options}
+        )
+        return index, reason
         
-        # 4. 如果没有gemini，使用增强的回退处理
-        if not self.gemini_available:
-            return self._enhanced_fallback_processing(answer, options, quantity), reason
-        
-        # 5. 使用gemini进行智能处理
+    def _call_gemini_for_option(self, answer: str, question: str,
+                                options: List[str]) -> Optional[int]:
+        """调用gemini选择最合适的选项，失败或无法确定时返回None"""
         options_text = "\n".join([f"{i}. {opt}" for i, opt in enumerate(options)])
         
         prompt = f"""你是一个智能答案处理助手。请根据用户的回答，选择最合适的选项。
@@ -162,118 +367,112 @@ class IntelligentAnswerProcessor:
 """
         
         try:
-            result = subprocess.run(
-                ['gemini', '-p', prompt],
-                capture_output=True,
-                text=True,
-                timeout=30  # 放宽到30秒
+            response = self.llm_client.call(prompt, timeout=30, retries=1).strip()  # 放宽到30秒
+        except LLMTimeout:
+            self.gemini_warnings.append(
+                f"⚠️ Gemini处理超时（超过30秒），使用回退方案"
             )
-            
-            if result.returncode == 0:
-                response = result.stdout.strip()
-                # 尝试从响应中提取数字（可能在文本中）
-                numbers = re.findall(r'-?\d+', response)
-                if numbers:
-                    # 取第一个数字
-                    index = int(numbers[0])
-                    if 0 <= index < len(options):
-                        return index, reason
-                    elif index == -1:
-                        # gemini无法确定，使用回退方案
-                        fallback_result = self._enhanced_fallback_processing(answer, options, quantity)
-                        self.gemini_warnings.append(
-                            f"⚠️ Gemini无法确定答案'{answer}'的最佳选项，使用回退方案"
-                        )
-                        return fallback_result, reason
-                    else:
-                        # 数字超出范围
-                        self.gemini_warnings.append(
-                            f"⚠️ Gemini返回的选项编号{index}超出范围(0-{len(options)-1})"
-                        )
-                else:
-                    # gemini返回了非预期格式
-                    self.gemini_warnings.append(
-                        f"⚠️ Gemini返回了非预期格式：{response[:50]}..."
-                    )
+            return None
+        except LLMUnavailable as e:
+            # 熔断中：不再等待超时，直接使用回退方案
+            self.gemini_warnings.append(f"⚠️ {e}，使用回退方案")
+            return None
+        except LLMError as e:
+            # gemini命令执行失败
+            self.gemini_warnings.append(
+                f"⚠️ Gemini处理失败：{e}"
+            )
+            return None
+        
+        queue_wait = self.llm_client.last_queue_wait()
+        if queue_wait >= 5:
+            self.gemini_warnings.append(f"⏳ Gemini请求较多，识别'{answer}'时排队了{queue_wait:.0f}秒")
+        
+        # 尝试从响应中提取数字（可能在文本中）
+        numbers = re.findall(r'-?\d+', response)
+        if numbers:
+            # 取第一个数字
+            index = int(numbers[0])
+            if 0 <= index < len(options):
+                return index
+            elif index == -1:
+                # gemini无法确定，使用回退方案
+                self.gemini_warnings.append(
+                    f"⚠️ Gemini无法确定答案'{answer}'的最佳选项，使用回退方案"
+                )
             else:
-                # gemini命令执行失败
-                error_msg = result.stderr.strip() if result.stderr else "未知错误"
+                # 数字超出范围
                 self.gemini_warnings.append(
-                    f"⚠️ Gemini处理失败：{error_msg}"
+                    f"⚠️ Gemini返回的选项编号{index}超出范围(0-{len(options)-1})"
                 )
-            
-        except subprocess.TimeoutExpired:
-            self.gemini_warnings.append(
-                f"⚠️ Gemini处理超时（超过30秒），使用回退方案"
-            )
-        except Exception as e:
+        else:
+            # gemini返回了非预期格式
             self.gemini_warnings.append(
-                f"⚠️ Gemini处理出错：{str(e)}"
+                f"⚠️ Gemini返回了非预期格式：{response[:50]}..."
             )
         
-        # 如果AI处理失败，使用增强的回退方案
-        return self._enhanced_fallback_processing(answer, options, quantity), reason
+        return None
     
-    def _enhanced_fallback_processing(self, answer: str, options: List[str], 
-                                    quantity: Optional[int] = None) -> Optional[int]:
+    def _match_quantity_interval(self, options: List[str], quantity: int) -> Optional[int]:
         """
-        增强的回退处理方案
+        按数量匹配选项区间（精确数字、X-Y范围、X以上）
         """
-        answer_lower = answer.lower()
+        best_match = None
+        best_threshold = 0
         
-        # 如果有提取到的数量，优先使用数量匹配
-        if quantity is not None and quantity > 0:
-            # 先尝试找最接近的匹配
-            best_match = None
-            best_threshold = 0
+        for i, option in enumerate(options):
+            # 跳过"没有"选项
+            if i == 0 and ('没有' in option or '🚫' in option):
+                continue
             
-            for i, option in enumerate(options):
-                option_lower = option.lower()
-                
-                # 跳过"没有"选项
-                if i == 0 and ('没有' in option or '🚫' in option):
-                    continue
-                
-                # 检查精确数字
-                if str(quantity) in option:
-                    return i
-                
-                # 检查范围
-                range_patterns = [
-                    r'(\d+)-(\d+)',
-                    r'(\d+)～(\d+)',
-                    r'(\d+)~(\d+)',
-                    r'(\d+)到(\d+)',
-                    r'(\d+)至(\d+)'
-                ]
-                
-                for pattern in range_patterns:
-                    match = re.search(pattern, option)
-                    if match:
-                        start, end = int(match.group(1)), int(match.group(2))
-                        if start <= quantity <= end:
-                            return i
-                
-                # 检查"X以上"或"X+"的模式
-                above_patterns = [
-                    r'(\d+)\+',
-                    r'(\d+)[^0-9]*以上',  # 允许数字和"以上"之间有其他字符
-                    r'(\d+)[^0-9]*及以上',
-                    r'超过[^0-9]*(\d+)',
-                    r'大于[^0-9]*(\d+)'
-                ]
-                
-                for pattern in above_patterns:
-                    match = re.search(pattern, option)
-                    if match:
-                        threshold = int(match.group(1))
-                        if quantity >= threshold and threshold > best_threshold:
-                            best_match = i
-                            best_threshold = threshold
+            # 检查精确数字
+            if str(quantity) in option:
+                return i
             
-            # 如果找到了合适的匹配，返回最佳匹配
-            if best_match is not None:
-                return best_match
+            # 检查范围
+            range_patterns = [
+                r'(\d+)-(\d+)',
+                r'(\d+)～(\d+)',
+                r'(\d+)~(\d+)',
+                r'(\d+)到(\d+)',
+                r'(\d+)至(\d+)'
+            ]
+            
+            for pattern in range_patterns:
+                match = re.search(pattern, option)
+                if match:
+                    start, end = int(match.group(1)), int(match.group(2))
+                    if start <= quantity <= end:
+                        return i
+            
+            # 检查"X以上"或"X+"的模式
+            above_patterns = [
+                r'(\d+)\+',
+                r'(\d+)[^0-9]*以上',  # 允许数字和"以上"之间有其他字符
+                r'(\d+)[^0-9]*及以上',
+                r'超过[^0-9]*(\d+)',
+                r'大于[^0-9]*(\d+)'
+            ]
+            
+            for pattern in above_patterns:
+                match = re.search(pattern, option)
+                if match:
+                    threshold = int(match.group(1))
+                    if quantity >= threshold and threshold > best_threshold:
+                        best_match = i
+                        best_threshold = threshold
+        
+        # 如果找到了合适的匹配，返回最佳匹配
+        return best_match
+    
+    def _match_keywords(self, answer: str, options: List[str],
+                        quantity: Optional[int] = None) -> Tuple[Optional[int], float]:
+        """
+        关键词匹配，返回(选项索引, 置信度)
+        """
+        answer_lower = answer.lower()
+        keyword_confidence = self.TIER_CONFIDENCE['keyword']
+        default_confidence = self.TIER_CONFIDENCE['keyword_default']
         
         # 关键词匹配 - 根据上下文智能判断
         # 对于"没有"的判断要更谨慎
@@ -283,7 +482,7 @@ class IntelligentAnswerProcessor:
                 # 确实没有数字，可能真的是"没有"
                 for i, option in enumerate(options):
                     if '没有' in option or '不' in option or '🚫' in option:
-                        return i
+                        return i, keyword_confidence
         
         # 如果答案中有任何正数，绝不应该返回第一个选项（通常是"没有"）
         if any(char.isdigit() for char in answer) and quantity and quantity > 0:
@@ -295,6 +494,7 @@ class IntelligentAnswerProcessor:
         # 寻找最佳匹配
         best_score = 0
         best_match = None
+        answer_words = set(re.findall(r'\w+', answer_lower))
         
         for i, option in enumerate(options):
             # 如果有数字且start_index > 0，跳过第一个选项
@@ -305,7 +505,6 @@ class IntelligentAnswerProcessor:
             option_lower = option.lower()
             
             # 计算共同关键词
-            answer_words = set(re.findall(r'\w+', answer_lower))
             option_words = set(re.findall(r'\w+', option_lower))
             common_words = answer_words & option_words
             score += len(common_words) * 2
@@ -323,11 +522,14 @@ class IntelligentAnswerProcessor:
                 best_score = score
                 best_match = i
         
-        # 如果有数字但没找到匹配，返回第二个选项而不是第一个
-        if best_match is None and start_index > 0:
-            return start_index
+        if best_match is not None and best_score > 2:
+            return best_match, keyword_confidence
         
-        return best_match if best_score > 2 else start_index
+        # 没有可靠的匹配，给出低置信度的保守选项（有数字时不选"没有"）
+        return start_index, default_confidence
+    
+    def _empty_tier_metrics(self) -> Dict[str, Dict]:
+        return {name: {'hits': 0, 'calls': 0, 'seconds': 0.0} for name in self.TIER_ORDER}
     
     def batch_process_answers(self, 
                             responses: Dict,
@@ -337,6 +539,8 @@ class IntelligentAnswerProcessor:
         """
         processed_responses = responses.copy()
         warnings = []
+        self.tier_metrics = self._empty_tier_metrics()
+        run_start = time.perf_counter()
         
         for question in questions:
             if question['type'] != 'choice':
@@ -348,32 +552,18 @@ class IntelligentAnswerProcessor:
                 
             answer = responses[qid]
             
-            # 如果已经是有效的数字索引，跳过
-            if isinstance(answer, int) and 0 <= answer < len(question['options']):
-                continue
-            
-            # 尝试转换为整数（但仍需要检查是否有额外说明）
-            try:
-                # 如果答案是纯数字（没有其他文字），才直接使用
-                answer_str = str(answer).strip()
-                if answer_str.isdigit():
-                    answer_int = int(answer_str)
-                    if 0 <= answer_int < len(question['options']):
-                        processed_responses[qid] = answer_int
-                        continue
-            except (ValueError, TypeError):
-                pass
-            
-            # 使用智能处理
-            result, reason = self.process_natural_language_answer(
-                str(answer),
-                question['question'],
-                question['options']
-            )
+            # 按层级流水线识别
+            result, confidence, tier = self.resolve_answer(answer, question)
             
             if result is not None:
                 processed_responses[qid] = result
+                
+                # 直接给出有效选项的答案无需提示
+                if tier == 'exact_index':
+                    continue
+                
                 msg = f"已智能识别：问题'{question['question']}'的答案'{answer}' → 选项{result}: {question['options'][result]}"
+                reason = self._check_user_reason(str(answer))
                 if reason:
                     msg += f" ({reason})"
                     self.user_feedback.append({
@@ -393,8 +583,48 @@ class IntelligentAnswerProcessor:
         if self.gemini_warnings:
             warnings.extend(self.gemini_warnings)
         
+        self._record_tier_metrics(time.perf_counter() - run_start)
+        
         return processed_responses, warnings
     
+    def _record_tier_metrics(self, total_seconds: float):
+        """追加本次运行的各层级命中数和耗时"""
+        if not self.metrics_file:
+            return
+        record = {
+            'timestamp': datetime.now().isoformat(),
+            'total_seconds': round(total_seconds, 6),
+            'confidence_threshold': self.confidence_threshold,
+            'tiers': {
+                name: {
+                    'hits': m['hits'],
+                    'calls': m['calls'],
+                    'seconds': round(m['seconds'], 6)
+                }
+                for name, m in self.tier_metrics.items()
+            }
+        }
+        try:
+            os.makedirs(os.path.dirname(self.metrics_file) or '.', exist_ok=True)
+            with open(self.metrics_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except OSError:
+            pass
+    
+    def get_tier_metrics(self) -> Dict[str, Dict]:
+        """获取最近一次批量处理的各层级命中数和耗时"""
+        return self.tier_metrics
+    
+    def format_tier_metrics(self) -> str:
+        """格式化各层级命中情况，便于在导入时显示"""
+        parts = []
+        for name in self.TIER_ORDER:
+            m = self.tier_metrics[name]
+            if m['calls'] == 0:
+                continue
+            parts.append(f"{name}: {m['hits']}条/{m['seconds'] * 1000:.1f}ms")
+        return " | ".join(parts)
+    
     def get_user_feedback(self) -> List[Dict]:
         """获取收集到的用户反馈"""
         return self.user_feedback
@@ -0,0 +1,329 @@
+import os
+import json
+import time
+import queue
+import codecs
+import random
+import hashlib
+import subprocess
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence
+
+try:
+    import fcntl
+except ImportError:  # Windows：只在进程内加锁
+    fcntl = None
+
+from .rate_limiter import RateLimiter, RateLimitTimeout
+
+
+class LLMError(Exception):
+    """调用大模型失败"""
+
+
+class LLMUnavailable(LLMError):
+    """熔断中：最近连续失败，暂时不再调用"""
+
+
+class LLMTimeout(LLMError):
+    """调用超时"""
+
+
+class LLMCallFailed(LLMError):
+    """命令返回错误或没有输出"""
+    
+    def __init__(self, message: str, returncode: Optional[int] = None, stderr: str = ''):
+        super().__init__(message)
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+class LLMRateLimited(LLMError):
+    """限流排队超时（不计入熔断）"""
+
+
+class _Flight:
+    """一次正在进行的调用，相同prompt的其他调用方等待它的结果"""
+    
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Optional[str] = None
+        self.error: Optional[LLMError] = None
+
+
+class LLMClient:
+    """
+    gemini-cli的统一调用层
+    
+    - 重试：命令出错时按指数退避（带随机抖动）重试；超时不重试，避免成倍地等待
+    - 熔断：连续failure_threshold次调用失败（一次调用内的重试只算一次）后在cooldown秒内直接失败，
+      之后放行一次试探调用，成功即恢复。状态保存在data/llm_health.json，读改写都持有文件锁，
+      其他进程（导入子进程、下次启动的程序）读取后同样直接跳过，试探调用也只放行一个
+    - 合并：同一进程内相同prompt的并发调用只执行一次，其余调用方共享结果
+    - 限流：传入rate_limiter时，每次执行命令前先在跨进程的限流器中排队
+    """
+    
+    def __init__(self, command: Sequence[str] = ('gemini', '-p'),
+                 health_file: str = os.path.join("data", "llm_health.json"),
+                 failure_threshold: int = 3,
+                 cooldown: float = 300.0,
+                 max_retries: int = 2,
+                 backoff_base: float = 1.0,
+                 backoff_max: float = 8.0,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 max_queue_wait: float = 300.0):
+        self.command = list(command)
+        self.health_file = health_file
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        self._health_lock = threading.Lock()
+        self._inflight: Dict[str, _Flight] = {}
+        self.rate_limiter = rate_limiter
+        self.max_queue_wait = max_queue_wait
+        self._local = threading.local()
+    
+    # ---------- 健康状态 ----------
+    
+    def _load_health(self) -> Dict:
+        try:
+            with open(self.health_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'consecutive_failures': 0, 'open_until': 0}
+    
+    @contextmanager
+    def _locked_health(self):
+        """持有锁期间读出健康状态，有改动时在退出时写回"""
+        os.makedirs(os.path.dirname(self.health_file) or '.', exist_ok=True)
+        with self._health_lock, open(self.health_file + '.lock', 'a') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                health = self._load_health()
+                before = dict(health)
+                yield health
+                if health != before:
+                    tmp_path = self.health_file + '.tmp'
+                    with open(tmp_path, 'w', encoding='utf-8') as f:
+                        json.dump(health, f, ensure_ascii=False, indent=2)
+                    os.replace(tmp_path, self.health_file)
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+    
+    def _record_success(self):
+        with self._locked_health() as health:
+            health.update(consecutive_failures=0, open_until=0, last_success=time.time())
+    
+    def _record_failure(self, error: LLMError) -> bool:
+        """记录一次调用失败，返回熔断是否（重新）打开"""
+        with self._locked_health() as health:
+            health['consecutive_failures'] = health.get('consecutive_failures', 0) + 1
+            health['last_failure'] = time.time()
+            health['last_error'] = str(error)[:200]
+            opened = health['consecutive_failures'] >= self.failure_threshold
+            if opened:
+                health['open_until'] = time.time() + self.cooldown
+        return opened
+    
+    def is_available(self) -> bool:
+        """熔断未打开（或冷却时间已过，可以试探）时返回True"""
+        return time.time() >= self._load_health().get('open_until', 0)
+    
+    def health(self) -> Dict:
+        return self._load_health()
+    
+    def _enter(self, timeout: float) -> bool:
+        """检查熔断状态，返回本次调用是否为冷却后的试探调用"""
+        with self._locked_health() as health:
+            if health.get('consecutive_failures', 0) < self.failure_threshold:
+                return False
+            now = time.time()
+            if now < health.get('open_until', 0):
+                raise LLMUnavailable(f"Gemini连续失败{health['consecutive_failures']}次，暂停调用"
+                                     f"（{health.get('last_error', '')}）")
+            # 冷却结束后所有进程只放行一个试探调用，其余调用方继续直接失败；
+            # 试探进程中途退出时，租期过后可以再次试探
+            if now < health.get('probe_until', 0):
+                raise LLMUnavailable("Gemini正在恢复检测中，暂停调用")
+            health['probe_until'] = now + timeout + 30
+        return True
+    
+    def _end_probe(self):
+        with self._locked_health() as health:
+            health.pop('probe_until', None)
+    
+    # ---------- 调用 ----------
+    
+    def call(self, prompt: str, timeout: float = 120,
+             retries: Optional[int] = None,
+             on_chunk: Optional[Callable[[Optional[str]], None]] = None) -> str:
+        """
+        调用大模型并返回输出文本，失败时抛出LLMError
+        
+        传入on_chunk时流式读取输出：每次尝试开始时调用on_chunk(None)，
+        之后每收到一段文字调用一次。流式调用不与其他调用合并。
+        """
+        if on_chunk is not None:
+            return self._call_with_retry(prompt, timeout, retries, on_chunk)
+        
+        key = hashlib.sha1(prompt.encode('utf-8')).hexdigest()
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+        
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        
+        try:
+            flight.result = self._call_with_retry(prompt, timeout, retries, None)
+            return flight.result
+        except LLMError as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.event.set()
+    
+    def _call_with_retry(self, prompt: str, timeout: float, retries: Optional[int],
+                         on_chunk: Optional[Callable[[Optional[str]], None]]) -> str:
+        probing = self._enter(timeout)
+        # 试探调用只尝试一次
+        attempts = 1 if probing else (self.max_retries if retries is None else retries) + 1
+        try:
+            attempt = 0
+            while True:
+                slot = self._acquire_slot()
+                try:
+                    output = self._run(prompt, timeout, on_chunk)
+                except LLMError as e:
+                    attempt += 1
+                    # 整次调用最终失败时才计入熔断；其他调用已经让熔断打开时不再重试
+                    if isinstance(e, LLMTimeout) or attempt >= attempts or not self.is_available():
+                        self._record_failure(e)
+                        raise
+                    delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+                    time.sleep(delay * random.uniform(0.5, 1.0))
+                    continue
+                finally:
+                    if slot is not None:
+                        self.rate_limiter.release(slot)
+                self._record_success()
+                return output
+        finally:
+            if probing:
+                self._end_probe()
+    
+    def _acquire_slot(self) -> Optional[Dict]:
+        """在限流器中排队，排队时间不计入调用的超时"""
+        self._local.queue_wait = 0.0
+        if self.rate_limiter is None:
+            return None
+        try:
+            slot = self.rate_limiter.acquire(self.max_queue_wait)
+        except RateLimitTimeout as e:
+            raise LLMRateLimited(f"Gemini请求过多，{e}")
+        self._local.queue_wait = slot['wait']
+        return slot
+    
+    def last_queue_wait(self) -> float:
+        """当前线程最近一次调用在限流器中排队的秒数"""
+        return getattr(self._local, 'queue_wait', 0.0)
+    
+    def _run(self, prompt: str, timeout: float,
+             on_chunk: Optional[Callable[[Optional[str]], None]]) -> str:
+        command = self.command + [prompt]
+        try:
+            if on_chunk is None:
+                result = subprocess.run(command, capture_output=True, timeout=timeout)
+                returncode = result.returncode
+                stdout = result.stdout.decode('utf-8', errors='replace')
+                stderr = result.stderr.decode('utf-8', errors='replace')
+            else:
+                returncode, stdout, stderr = self._stream(command, timeout, on_chunk)
+        except subprocess.TimeoutExpired:
+            raise LLMTimeout(f"Gemini处理超时（超过{timeout:.0f}秒）")
+        except OSError as e:
+            raise LLMCallFailed(f"无法启动gemini-cli: {e}", stderr=str(e))
+        
+        if returncode != 0 or not stdout.strip():
+            message = stderr.strip() or ("返回了空内容" if returncode == 0 else f"返回错误代码{returncode}")
+            raise LLMCallFailed(message, returncode=returncode, stderr=stderr)
+        return stdout
+    
+    @staticmethod
+    def _stream(command: List[str], timeout: float,
+                on_chunk: Callable[[Optional[str]], None]):
+        """逐段读取命令输出；timeout为整次调用的总时长"""
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        deadline = time.monotonic() + timeout
+        chunks = queue.Queue()
+        stderr_parts = []
+        
+        def pump_stdout():
+            while True:
+                data = process.stdout.read1(4096)
+                if not data:
+                    break
+                chunks.put(data)
+            chunks.put(None)
+        
+        threading.Thread(target=pump_stdout, daemon=True).start()
+        stderr_reader = threading.Thread(target=lambda: stderr_parts.append(process.stderr.read()), daemon=True)
+        stderr_reader.start()
+        
+        # 按UTF-8增量解码，汉字被拆在两段之间时也能正确拼接
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        output = []
+        on_chunk(None)
+        while True:
+            try:
+                data = chunks.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                process.kill()
+                process.wait()
+                raise subprocess.TimeoutExpired(command, timeout)
+            if data is None:
+                break
+            text = decoder.decode(data)
+            if text:
+                output.append(text)
+                on_chunk(text)
+        
+        text = decoder.decode(b'', final=True)
+        if text:
+            output.append(text)
+            on_chunk(text)
+        
+        returncode = process.wait()
+        stderr_reader.join(1)
+        stderr = b''.join(stderr_parts).decode('utf-8', errors='replace')
+        return returncode, ''.join(output), stderr
+
+
+_default_client: Optional[LLMClient] = None
+_default_lock = threading.Lock()
+
+
+def default_client() -> LLMClient:
+    """进程内共享的调用层（相同prompt的合并只在同一个实例内生效）"""
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            # 限流参数可通过环境变量调整：每分钟请求数、同时进行的请求数
+            _default_client = LLMClient(rate_limiter=RateLimiter(
+                requests_per_minute=float(os.environ.get('LLM_RPM', 30)),
+                max_concurrent=int(os.environ.get('LLM_MAX_CONCURRENT', 2))
+            ))
+        return _default_client
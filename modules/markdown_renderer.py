@@ -0,0 +1,379 @@
+import os
+import re
+import html
+import queue
+import itertools
+import threading
+import importlib.util
+import multiprocessing
+from typing import Callable, Dict, List, Optional
+
+
+# 常见的中文字体路径（与DataManager绘图使用的字体一致）
+CJK_FONT_PATHS = [
+    '/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc',
+    '/System/Library/Fonts/PingFang.ttc',
+    'C:\\Windows\\Fonts\\msyh.ttc'
+]
+
+CJK_FONT_STACK = ('"ReportCJK", "Noto Sans CJK SC", "Source Han Sans SC", "PingFang SC", '
+                  '"Microsoft YaHei", "WenQuanYi Micro Hei", "Noto Color Emoji", sans-serif')
+
+REPORT_CSS = """
+@page { size: A4; margin: 18mm 16mm; }
+body { font-family: %(fonts)s; font-size: 11pt; line-height: 1.7; color: #2c3e50;
+       max-width: 820px; margin: 0 auto; padding: 24px; }
+h1 { font-size: 20pt; border-bottom: 3px solid #3498db; padding-bottom: 6px; }
+h2 { font-size: 15pt; color: #2980b9; margin-top: 1.4em; }
+h3 { font-size: 12.5pt; color: #16a085; }
+table { border-collapse: collapse; margin: 0.8em 0; }
+th, td { border: 1px solid #d0d7de; padding: 4px 12px; }
+th { background: #eef5fb; }
+blockquote { margin: 0.8em 0; padding: 0.4em 1em; border-left: 4px solid #f39c12;
+             background: #fdf6ec; color: #7f5a16; }
+code { font-family: "Noto Sans Mono CJK SC", monospace; background: #f4f4f4;
+       padding: 1px 4px; border-radius: 3px; }
+pre { background: #f4f4f4; padding: 10px; overflow-x: auto; }
+pre code { padding: 0; }
+hr { border: none; border-top: 1px dashed #bdc3c7; margin: 1.5em 0; }
+"""
+
+_HEADING = re.compile(r'^(#{1,6})\s+(.*?)\s*#*\s*$')
+_HR = re.compile(r'^\s{0,3}([-*_])(\s*\1){2,}\s*$')
+_LIST_ITEM = re.compile(r'^(\s*)([-*+]|\d+[.)])\s+(.*)$')
+_TABLE_SEPARATOR = re.compile(r'^\s*\|?\s*:?-{2,}:?\s*(\|\s*:?-{2,}:?\s*)*\|?\s*$')
+_FENCE = re.compile(r'^\s*(```|~~~)')
+
+_INLINE_CODE = re.compile(r'`([^`]+)`')
+_BOLD = re.compile(r'\*\*(.+?)\*\*|__(.+?)__')
+_ITALIC = re.compile(r'(?<![*\w])\*(?!\s)(.+?)(?<!\s)\*(?!\*)')
+_STRIKE = re.compile(r'~~(.+?)~~')
+_LINK = re.compile(r'\[([^\]]+)\]\(([^)\s]+)\)')
+
+
+def _find_cjk_font() -> Optional[str]:
+    for path in CJK_FONT_PATHS:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def render_inline(text: str) -> str:
+    """行内格式：代码、粗体、斜体、删除线、链接（先转义HTML）"""
+    codes = []
+    
+    def keep_code(match):
+        codes.append(match.group(1))
+        return f"\x00{len(codes) - 1}\x00"
+    
+    text = _INLINE_CODE.sub(keep_code, text)
+    text = html.escape(text, quote=False)
+    text = _BOLD.sub(lambda m: f"<strong>{m.group(1) or m.group(2)}</strong>", text)
+    text = _ITALIC.sub(r'<em>\1</em>', text)
+    text = _STRIKE.sub(r'<del>\1</del>', text)
+    text = _LINK.sub(lambda m: f'<a href="{html.escape(m.group(2))}">{m.group(1)}</a>', text)
+    return re.sub('\x00(\\d+)\x00', lambda m: f"<code>{html.escape(codes[int(m.group(1))])}</code>", text)
+
+
+class MarkdownRenderer:
+    """
+    进程内的Markdown转HTML渲染器
+    
+    只覆盖报告中用到的语法（标题、段落、列表、表格、引用、代码块、分隔线和常见行内格式），
+    不需要启动pandoc或LaTeX，单份报告的渲染耗时为毫秒级。
+    """
+    
+    def __init__(self, css: str = REPORT_CSS):
+        font_path = _find_cjk_font()
+        font_face = ''
+        if font_path:
+            font_url = 'file://' + font_path.replace('\\', '/')
+            font_face = ('@font-face { font-family: "ReportCJK"; '
+                         f'src: local("Noto Sans CJK SC"), url("{font_url}"); }}\n')
+        self.css = font_face + css % {'fonts': CJK_FONT_STACK}
+    
+    def to_html(self, markdown_text: str, title: str = '') -> str:
+        """渲染为带内嵌样式的完整HTML文档"""
+        body = self.render_body(markdown_text)
+        return (
+            '<!DOCTYPE html>\n<html lang="zh-CN">\n<head>\n<meta charset="utf-8">\n'
+            f'<title>{html.escape(title)}</title>\n<style>{self.css}</style>\n</head>\n'
+            f'<body>\n{body}</body>\n</html>\n'
+        )
+    
+    def render_body(self, markdown_text: str) -> str:
+        lines = markdown_text.replace('\r\n', '\n').split('\n')
+        out = []
+        i = 0
+        paragraph = []
+        
+        def flush_paragraph():
+            if paragraph:
+                out.append('<p>' + '<br>\n'.join(render_inline(p.strip()) for p in paragraph) + '</p>\n')
+                paragraph.clear()
+        
+        while i < len(lines):
+            line = lines[i]
+            
+            if not line.strip():
+                flush_paragraph()
+                i += 1
+                continue
+            
+            if _FENCE.match(line):
+                flush_paragraph()
+                fence = _FENCE.match(line).group(1)
+                code = []
+                i += 1
+                while i < len(lines) and not lines[i].strip().startswith(fence):
+                    code.append(lines[i])
+                    i += 1
+                out.append(f"<pre><code>{html.escape(chr(10).join(code))}</code></pre>\n")
+                i += 1
+                continue
+            
+            heading = _HEADING.match(line)
+            if heading:
+                flush_paragraph()
+                level = len(heading.group(1))
+                out.append(f"<h{level}>{render_inline(heading.group(2))}</h{level}>\n")
+                i += 1
+                continue
+            
+            if _HR.match(line):
+                flush_paragraph()
+                out.append('<hr>\n')
+                i += 1
+                continue
+            
+            if line.lstrip().startswith('>'):
+                flush_paragraph()
+                quoted = []
+                while i < len(lines) and lines[i].lstrip().startswith('>'):
+                    quoted.append(re.sub(r'^\s*>\s?', '', lines[i]))
+                    i += 1
+                out.append(f"<blockquote>\n{self.render_body(chr(10).join(quoted))}</blockquote>\n")
+                continue
+            
+            if '|' in line and i + 1 < len(lines) and _TABLE_SEPARATOR.match(lines[i + 1]):
+                flush_paragraph()
+                i = self._render_table(lines, i, out)
+                continue
+            
+            if _LIST_ITEM.match(line):
+                flush_paragraph()
+                i = self._render_list(lines, i, out)
+                continue
+            
+            paragraph.append(line)
+            i += 1
+        
+        flush_paragraph()
+        return ''.join(out)
+    
+    @staticmethod
+    def _split_row(line: str) -> List[str]:
+        cells = line.strip()
+        if cells.startswith('|'):
+            cells = cells[1:]
+        if cells.endswith('|'):
+            cells = cells[:-1]
+        return [c.strip() for c in cells.split('|')]
+    
+    def _render_table(self, lines: List[str], i: int, out: List[str]) -> int:
+        header = self._split_row(lines[i])
+        out.append('<table>\n<thead><tr>' +
+                   ''.join(f"<th>{render_inline(c)}</th>" for c in header) +
+                   '</tr></thead>\n<tbody>\n')
+        i += 2
+        while i < len(lines) and '|' in lines[i] and lines[i].strip():
+            cells = self._split_row(lines[i])
+            out.append('<tr>' + ''.join(f"<td>{render_inline(c)}</td>" for c in cells) + '</tr>\n')
+            i += 1
+        out.append('</tbody>\n</table>\n')
+        return i
+    
+    def _render_list(self, lines: List[str], i: int, out: List[str]) -> int:
+        """渲染（可嵌套的）列表，按缩进判断层级"""
+        items = []  # [缩进, 标签, [文本行]]
+        while i < len(lines):
+            match = _LIST_ITEM.match(lines[i])
+            if match:
+                tag = 'ol' if match.group(2)[0].isdigit() else 'ul'
+                items.append([len(match.group(1).expandtabs(4)), tag, [match.group(3)]])
+            elif lines[i].strip() and lines[i][:1] in ' \t' and items:
+                # 列表项的续行（有缩进的普通文本）
+                items[-1][2].append(lines[i].strip())
+            else:
+                break
+            i += 1
+        
+        out.append(self._emit_list(items, 0, len(items)))
+        return i
+    
+    def _emit_list(self, items: List, start: int, end: int) -> str:
+        indent, tag = items[start][0], items[start][1]
+        parts = [f"<{tag}>\n"]
+        j = start
+        while j < end:
+            # 同级的有序/无序列表切换时另起一个列表
+            if items[j][1] != tag:
+                parts.append(f"</{tag}>\n")
+                tag = items[j][1]
+                parts.append(f"<{tag}>\n")
+            # 缩进更深的后续项是当前项的子列表
+            k = j + 1
+            while k < end and items[k][0] > indent:
+                k += 1
+            text = '<br>\n'.join(render_inline(t) for t in items[j][2])
+            children = '\n' + self._emit_list(items, j + 1, k) if k > j + 1 else ''
+            parts.append(f"<li>{text}{children}</li>\n")
+            j = k
+        parts.append(f"</{tag}>\n")
+        return ''.join(parts)
+
+
+def _render_with_weasyprint(html_path: str, pdf_path: str):
+    from weasyprint import HTML
+    HTML(filename=html_path).write_pdf(pdf_path)
+
+
+def _pdf_worker_main(requests, results, render_func):
+    """常驻子进程：PDF库只导入一次，每次把队列中积压的文档作为一批处理"""
+    while True:
+        item = requests.get()
+        if item is None:
+            return
+        batch = [item]
+        stop = False
+        while True:
+            try:
+                extra = requests.get_nowait()
+            except queue.Empty:
+                break
+            if extra is None:
+                stop = True
+                break
+            batch.append(extra)
+        
+        for job_id, html_path, pdf_path in batch:
+            try:
+                render_func(html_path, pdf_path)
+                results.put((job_id, None))
+            except Exception as e:
+                results.put((job_id, str(e)))
+        if stop:
+            return
+
+
+class PdfRenderWorker:
+    """
+    常驻的PDF渲染进程
+    
+    第一次使用时启动，之后一直复用（字体和排版库只加载一次）；
+    并发提交的文档在子进程中成批渲染。单个文档超时后重启子进程。
+    
+    每次启动的子进程连同它的队列、等待者和收集线程是一"代"，等待者记住自己提交到哪一代；
+    超时只结束仍是当前代的进程，同时让这一代的其他等待者立即失败，不必各自等到超时。
+    """
+    
+    def __init__(self, render_func: Callable[[str, str], None] = _render_with_weasyprint,
+                 timeout: float = 60.0):
+        self.render_func = render_func
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._generation: Optional[Dict] = None
+        self._ids = itertools.count(1)
+    
+    @staticmethod
+    def is_available() -> bool:
+        return importlib.util.find_spec('weasyprint') is not None
+    
+    def _ensure_started(self) -> Dict:
+        """当前代的子进程（调用方持有锁）；进程已经退出时先让旧一代的等待者失败再重启"""
+        generation = self._generation
+        if generation is not None and generation['process'].is_alive():
+            return generation
+        if generation is not None:
+            self._retire(generation, "渲染进程意外退出")
+        
+        requests = multiprocessing.Queue()
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(
+            target=_pdf_worker_main,
+            args=(requests, results, self.render_func),
+            name="pdf-render",
+            daemon=True
+        )
+        process.start()
+        generation = {'process': process, 'requests': requests, 'results': results, 'waiting': {}}
+        self._generation = generation
+        threading.Thread(target=self._collect_results, args=(generation,), daemon=True).start()
+        return generation
+    
+    def _retire(self, generation: Dict, reason: str):
+        """结束一代子进程：未完成的等待者全部失败，收集线程随之退出（调用方持有锁）"""
+        if generation['process'].is_alive():
+            generation['process'].terminate()
+        # 子进程不会再写结果，放一个结束标记让收集线程退出
+        generation['results'].put(None)
+        for waiter in generation['waiting'].values():
+            waiter['error'] = reason
+            waiter['event'].set()
+        generation['waiting'].clear()
+        if self._generation is generation:
+            self._generation = None
+    
+    def _collect_results(self, generation: Dict):
+        results = generation['results']
+        while True:
+            try:
+                item = results.get()
+            except (EOFError, OSError):
+                return
+            if item is None:
+                return
+            job_id, error = item
+            with self._lock:
+                waiter = generation['waiting'].pop(job_id, None)
+            if waiter:
+                waiter['error'] = error
+                waiter['event'].set()
+    
+    def render(self, html_path: str, pdf_path: str,
+               warn: Callable[[str], None] = print) -> bool:
+        """渲染一个HTML文件为PDF，成功返回True；失败原因交给warn（默认直接打印）"""
+        waiter = {'event': threading.Event(), 'error': None}
+        with self._lock:
+            generation = self._ensure_started()
+            job_id = next(self._ids)
+            generation['waiting'][job_id] = waiter
+            generation['requests'].put((job_id, html_path, pdf_path))
+        
+        if not waiter['event'].wait(self.timeout):
+            with self._lock:
+                # 可能在等锁时结果刚好到达，或这一代已经被别的等待者结束
+                timed_out = not waiter['event'].is_set()
+                if timed_out:
+                    # 卡住的渲染进程直接结束，下次使用时重新启动
+                    generation['waiting'].pop(job_id, None)
+                    self._retire(generation, "同一渲染进程中的其他文档超时，进程已重启")
+            if timed_out:
+                warn(f"⚠️ PDF渲染超时（{self.timeout:.0f}秒）")
+                return False
+        
+        if waiter['error']:
+            warn(f"⚠️ PDF渲染失败: {waiter['error']}")
+            return False
+        return True
+    
+    def close(self):
+        with self._lock:
+            generation = self._generation
+            if generation is None:
+                return
+            if generation['process'].is_alive():
+                generation['requests'].put(None)
+                generation['process'].join(5)
+            self._retire(generation, "渲染进程已关闭")
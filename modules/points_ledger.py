@@ -0,0 +1,397 @@
+import os
+import json
+import uuid
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows：只在进程内加锁
+    fcntl = None
+
+
+# 账户：每笔交易的各分录金额之和为0（复式记账）
+ACCOUNT_USER = 'user'              # 用户的可用积分
+ACCOUNT_EARNED = 'earned'          # 学习获得（每日积分的来源）
+ACCOUNT_REWARDS = 'rewards'        # 兑换奖励的去向
+ACCOUNT_ADJUSTMENTS = 'adjustments'  # 迁移时的校正
+
+# 交易类型
+TXN_EARN = 'earn'          # 每日积分（同一天重新计分时只记差额）
+TXN_REDEEM = 'redeem'      # 兑换奖励
+TXN_ROLLBACK = 'rollback'  # 回档：冲销当天获得的积分
+TXN_ADJUST = 'adjust'      # 迁移校正
+
+
+class LedgerError(Exception):
+    """积分账本损坏或写入失败"""
+
+
+class InsufficientPoints(LedgerError):
+    """可用积分不足"""
+    
+    def __init__(self, needed: int, balance: int):
+        super().__init__(f"积分不足，需要{needed}分，当前只有{balance}分")
+        self.needed = needed
+        self.balance = balance
+
+
+class VersionConflict(LedgerError):
+    """提交时账本版本已经变化（有其他交易先写入）"""
+    
+    def __init__(self, expected: int, actual: int):
+        super().__init__(f"积分账本版本已变化：预期{expected}，实际{actual}")
+        self.expected = expected
+        self.actual = actual
+
+
+class PointsLedger:
+    """
+    只追加的积分账本（data/points_ledger.jsonl）
+    
+    每行是一笔交易：类型、幂等键、日期和若干分录，分录金额之和为0。
+    一笔交易只写一行，整行一次写入并fsync，所以一笔交易里的多条分录要么都在、要么都不在；
+    进程中途退出留下的半行会在下次加锁时被截掉。
+    余额由分录累加得到，不单独保存。进程内缓存已读到的文件位置和余额，
+    每次加锁后只读取其他进程新追加的行。
+    检查余额和写入在同一把文件锁内完成，多个进程同时兑换也不会透支；
+    相同幂等键的交易只记一次，重复提交返回第一次的结果。
+    """
+    
+    def __init__(self, ledger_file: str = os.path.join("data", "points_ledger.jsonl")):
+        self.ledger_file = ledger_file
+        self.lock_file = ledger_file + '.lock'
+        self._thread_lock = threading.RLock()
+        self._reset_cache()
+    
+    def _reset_cache(self):
+        self._offset = 0
+        self._seq = 0
+        self._balances: Dict[str, int] = {}
+        self._day_earned: Dict[str, int] = {}
+        self._by_key: Dict[str, Dict] = {}
+        self._redemptions = {
+            'count': 0,
+            'points': 0,
+            'by_reward': {},
+            'by_category': {},
+            'uncategorized': {},
+            'most_popular': None
+        }
+    
+    # ---------- 读取 ----------
+    
+    @contextmanager
+    def _locked(self):
+        """持有文件锁，并读入其他进程追加的交易"""
+        os.makedirs(os.path.dirname(self.ledger_file) or '.', exist_ok=True)
+        with self._thread_lock, open(self.lock_file, 'a') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._catch_up()
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+    
+    def _catch_up(self):
+        try:
+            size = os.path.getsize(self.ledger_file)
+        except OSError:
+            size = 0
+        if size < self._offset:
+            # 文件被替换或截短，重新读取
+            self._reset_cache()
+        if size == self._offset:
+            return
+        
+        with open(self.ledger_file, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                txn = json.loads(line)
+            except ValueError:
+                raise LedgerError(f"积分账本第{self._seq + 1}笔交易无法解析：{self.ledger_file}")
+            self._apply(txn)
+        self._offset += end
+        
+        if end < len(data):
+            # 没有换行结尾的半行来自中途退出的写入（持有锁时不会有其他写入方），截掉
+            with open(self.ledger_file, 'r+b') as f:
+                f.truncate(self._offset)
+    
+    def _apply(self, txn: Dict):
+        self._seq = txn['seq']
+        for entry in txn['entries']:
+            account = entry['account']
+            self._balances[account] = self._balances.get(account, 0) + entry['amount']
+        if txn['type'] in (TXN_EARN, TXN_ROLLBACK):
+            amount = self._user_amount(txn)
+            self._day_earned[txn['date']] = self._day_earned.get(txn['date'], 0) + amount
+        elif txn['type'] == TXN_REDEEM:
+            self._count_redemption(txn)
+        self._by_key[txn['key']] = txn
+    
+    def _count_redemption(self, txn: Dict):
+        """兑换计数随交易逐笔累加，统计时不用再遍历历史"""
+        stats = self._redemptions
+        meta = txn.get('meta', {})
+        reward_id = meta.get('reward_id')
+        stats['count'] += 1
+        stats['points'] -= self._user_amount(txn)
+        by_reward = stats['by_reward']
+        by_reward[reward_id] = by_reward.get(reward_id, 0) + 1
+        if stats['most_popular'] is None or by_reward[reward_id] > by_reward[stats['most_popular']]:
+            stats['most_popular'] = reward_id
+        # 旧版本迁移来的兑换没有记录类别，由调用方按奖励目录补上
+        table = stats['by_category'] if meta.get('category') else stats['uncategorized']
+        name = meta.get('category') or reward_id
+        table[name] = table.get(name, 0) + 1
+    
+    @staticmethod
+    def _user_amount(txn: Dict) -> int:
+        return sum(e['amount'] for e in txn['entries'] if e['account'] == ACCOUNT_USER)
+    
+    def exists(self) -> bool:
+        return os.path.exists(self.ledger_file) and os.path.getsize(self.ledger_file) > 0
+    
+    def balance(self, account: str = ACCOUNT_USER) -> int:
+        with self._locked():
+            return self._balances.get(account, 0)
+    
+    def snapshot(self) -> Tuple[int, int]:
+        """当前 (余额, 版本)；版本为最后一笔交易的序号，每写入一笔交易加1"""
+        with self._locked():
+            return self._balances.get(ACCOUNT_USER, 0), self._seq
+    
+    def day_earned(self, date: str) -> int:
+        """某天净获得的积分（每日积分减去回档冲销）"""
+        with self._locked():
+            return self._day_earned.get(date, 0)
+    
+    def get(self, key: str) -> Optional[Dict]:
+        """按幂等键查找交易"""
+        with self._locked():
+            return self._by_key.get(key)
+    
+    def redemption_stats(self) -> Dict:
+        """
+        兑换统计：{'count', 'points', 'by_reward', 'by_category', 'uncategorized', 'most_popular'}
+        
+        uncategorized为没有记录类别的兑换（奖励id -> 次数）。
+        """
+        with self._locked():
+            stats = self._redemptions
+            return {
+                **stats,
+                'by_reward': dict(stats['by_reward']),
+                'by_category': dict(stats['by_category']),
+                'uncategorized': dict(stats['uncategorized'])
+            }
+    
+    def transactions(self, txn_type: Optional[str] = None) -> Iterator[Dict]:
+        """按写入顺序遍历交易（用于审计和兑换历史）"""
+        if not os.path.exists(self.ledger_file):
+            return
+        with open(self.ledger_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    break
+                if not line.strip():
+                    continue
+                txn = json.loads(line)
+                if txn_type is None or txn['type'] == txn_type:
+                    yield txn
+    
+    def read_from(self, offset: int) -> Tuple[List[Dict], int]:
+        """
+        从字节位置offset开始读取完整的交易行，返回 (交易, 读到的位置)
+        
+        供按账本增量维护的派生数据（如兑换历史分区）使用：保存返回的位置，下次从这里继续。
+        """
+        try:
+            with open(self.ledger_file, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except OSError:
+            return [], offset
+        end = data.rfind(b'\n') + 1
+        txns = [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+        return txns, offset + end
+    
+    def size(self) -> int:
+        try:
+            return os.path.getsize(self.ledger_file)
+        except OSError:
+            return 0
+    
+    def audit(self) -> Dict:
+        """从头核对账本：每笔交易借贷平衡、序号连续、记录的余额与累加结果一致"""
+        problems = []
+        balance = 0
+        count = 0
+        for count, txn in enumerate(self.transactions(), 1):
+            if sum(e['amount'] for e in txn['entries']) != 0:
+                problems.append(f"第{txn['seq']}笔交易借贷不平衡")
+            if txn['seq'] != count:
+                problems.append(f"第{count}笔交易的序号为{txn['seq']}")
+            balance += self._user_amount(txn)
+            if txn.get('balance') != balance:
+                problems.append(f"第{txn['seq']}笔交易后余额应为{balance}，记录为{txn.get('balance')}")
+        return {'transactions': count, 'balance': balance, 'ok': not problems, 'problems': problems}
+    
+    # ---------- 写入 ----------
+    
+    def _build(self, txn_type: str, date: str, entries: List[Tuple[str, int]],
+               key: Optional[str], memo: str, meta: Optional[Dict]) -> Dict:
+        now = datetime.now()
+        txn = {
+            'seq': self._seq + 1,
+            'key': key or uuid.uuid4().hex,
+            'type': txn_type,
+            'date': date or now.strftime('%Y-%m-%d'),
+            'timestamp': now.isoformat(),
+            'entries': [{'account': account, 'amount': amount} for account, amount in entries],
+            'memo': memo
+        }
+        if meta:
+            txn['meta'] = meta
+        txn['balance'] = self._balances.get(ACCOUNT_USER, 0) + self._user_amount(txn)
+        return txn
+    
+    def _append(self, txns: List[Dict]):
+        """一次写入多笔交易（调用方持有锁）"""
+        data = ''.join(json.dumps(t, ensure_ascii=False) + '\n' for t in txns).encode('utf-8')
+        fd = os.open(self.ledger_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            view = memoryview(data)
+            while view:
+                written = os.write(fd, view)
+                view = view[written:]
+            os.fsync(fd)
+        except OSError as e:
+            raise LedgerError(f"写入积分账本失败：{e}")
+        finally:
+            os.close(fd)
+        for txn in txns:
+            self._apply(txn)
+        self._offset += len(data)
+    
+    def _post(self, txn_type: str, date: str, entries: List[Tuple[str, int]],
+              key: Optional[str] = None, memo: str = '', meta: Optional[Dict] = None) -> Dict:
+        txn = self._build(txn_type, date, entries, key, memo, meta)
+        self._append([txn])
+        return txn
+    
+    def set_day_points(self, date: str, daily_points: int, memo: str = '') -> Optional[Dict]:
+        """
+        把某天获得的积分设为daily_points：只记与已入账部分的差额
+        
+        重复提交同样的分数不会产生新交易（返回None）。
+        """
+        with self._locked():
+            delta = daily_points - self._day_earned.get(date, 0)
+            if delta == 0:
+                return None
+            return self._post(TXN_EARN, date, [(ACCOUNT_USER, delta), (ACCOUNT_EARNED, -delta)],
+                              memo=memo or f"{date}每日积分")
+    
+    def reverse_day(self, date: str) -> Optional[Dict]:
+        """回档：冲销某天获得的全部积分，没有可冲销的积分时返回None"""
+        with self._locked():
+            earned = self._day_earned.get(date, 0)
+            if earned == 0:
+                return None
+            return self._post(TXN_ROLLBACK, date, [(ACCOUNT_USER, -earned), (ACCOUNT_EARNED, earned)],
+                              memo=f"回档{date}")
+    
+    def redeem(self, points: int, key: str, memo: str = '',
+               meta: Optional[Dict] = None,
+               expected_version: Optional[int] = None) -> Tuple[Dict, bool]:
+        """
+        扣除积分兑换奖励，返回 (交易, 是否新记账)
+        
+        key相同的兑换只扣一次：重复提交时返回已有的交易和False。
+        给出expected_version时按比较并交换提交：账本版本不等于它就抛出VersionConflict，
+        调用方重新读取余额后再试。余额不足时抛出InsufficientPoints。
+        """
+        with self._locked():
+            existing = self._by_key.get(key)
+            if existing is not None:
+                return existing, False
+            if expected_version is not None and expected_version != self._seq:
+                raise VersionConflict(expected_version, self._seq)
+            balance = self._balances.get(ACCOUNT_USER, 0)
+            if balance < points:
+                raise InsufficientPoints(points, balance)
+            txn = self._post(TXN_REDEEM, None, [(ACCOUNT_USER, -points), (ACCOUNT_REWARDS, points)],
+                             key=key, memo=memo, meta=meta)
+            return txn, True
+    
+    def migrate(self, points_data: Dict, redemptions: List[Dict]) -> bool:
+        """
+        从旧的points.json和redemption_history.json建立账本（账本已存在时不做任何事）
+        
+        每日记录记为earn，兑换历史记为redeem（points.json里的兑换扣分记录不再单独记账），
+        最后用一笔adjust把余额校正到points.json里的总积分。
+        """
+        with self._locked():
+            if self._seq:
+                return False
+            
+            txns = []
+            
+            def add(txn_type, date, entries, key=None, memo='', meta=None):
+                txn = self._build(txn_type, date, entries, key, memo, meta)
+                txn['seq'] = self._seq + len(txns) + 1
+                # _build按已入账的余额计算，这里补上同一批次里前面的交易
+                txn['balance'] = (txns[-1]['balance'] if txns else 0) + self._user_amount(txn)
+                txns.append(txn)
+            
+            for record in points_data.get('history', []):
+                if self.is_redemption_record(record):
+                    continue
+                points = record['daily_points']
+                if points:
+                    add(TXN_EARN, record['date'], [(ACCOUNT_USER, points), (ACCOUNT_EARNED, -points)],
+                        memo=f"{record['date']}每日积分（迁移）")
+            
+            for redemption in sorted(redemptions, key=lambda h: h['timestamp']):
+                points = redemption['points_spent']
+                add(TXN_REDEEM, redemption['date'], [(ACCOUNT_USER, -points), (ACCOUNT_REWARDS, points)],
+                    key=f"migrated:{redemption['timestamp']}:{redemption['reward_id']}",
+                    memo=f"兑换：{redemption['reward_name']}（迁移）",
+                    meta={k: redemption[k] for k in ('reward_id', 'reward_name', 'points_spent', 'time')
+                          if k in redemption})
+                txns[-1]['timestamp'] = redemption['timestamp']
+            
+            balance = txns[-1]['balance'] if txns else 0
+            difference = points_data.get('total_points', 0) - balance
+            if difference:
+                add(TXN_ADJUST, None, [(ACCOUNT_USER, difference), (ACCOUNT_ADJUSTMENTS, -difference)],
+                    memo="迁移校正：与points.json中的总积分对齐")
+            
+            # 先写临时文件再替换：迁移中途退出不会留下只有一部分交易的账本
+            tmp_path = self.ledger_file + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for txn in txns:
+                    f.write(json.dumps(txn, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.ledger_file)
+            self._catch_up()
+            return True
+    
+    @staticmethod
+    def is_redemption_record(record: Dict) -> bool:
+        """旧版本兑换时写进points.json历史的扣分记录"""
+        details = record.get('details') or []
+        return bool(details) and all(d.get('category') == '兑换奖励' for d in details)
@@ -0,0 +1,100 @@
+import math
+import re
+from typing import Callable, Iterable, List, Optional, Sequence, Union
+
+
+_CJK = re.compile(r'[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef\U0001f000-\U0001faff]')
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数：中日韩字符和emoji按1个token，其余字符按4个字符1个token"""
+    cjk = len(_CJK.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+class _Section:
+    def __init__(self, name: str, priority: int, render: Callable[[int], Optional[str]]):
+        self.name = name
+        self.priority = priority
+        self.render = render
+        self.text: Optional[str] = None
+
+
+class PromptBuilder:
+    """
+    按优先级在预算内拼装prompt
+    
+    每一节都是延迟生成的：按优先级从高到低（数字越小越优先）依次生成，
+    生成时传入剩余预算，放不下的节不会被生成。输出时仍按添加顺序排列。
+    表格类的节逐行加入，预算不够时只保留前面的行。
+    """
+    
+    def __init__(self, budget_tokens: int):
+        self.budget_tokens = budget_tokens
+        self._sections: List[_Section] = []
+        self.used_tokens = 0
+        self.dropped: List[str] = []
+    
+    def add_text(self, name: str, priority: int, text: Union[str, Callable[[], str]],
+                 max_tokens: Optional[int] = None) -> 'PromptBuilder':
+        """
+        添加一段文字；text可以是生成函数
+        
+        给出max_tokens（生成结果的上限估计）时，剩余预算不足就直接跳过，不调用生成函数。
+        """
+        def render(remaining: int) -> Optional[str]:
+            if max_tokens is not None and max_tokens > remaining:
+                return None
+            return text() if callable(text) else text
+        
+        self._sections.append(_Section(name, priority, render))
+        return self
+    
+    def add_table(self, name: str, priority: int, title: str, columns: Sequence[str],
+                  rows: Union[Iterable[Sequence], Callable[[], Iterable[Sequence]]],
+                  min_rows: int = 1) -> 'PromptBuilder':
+        """
+        添加一张紧凑表格（竖线分隔，无对齐空格）
+        
+        rows可以是生成器，只会取到预算允许的行数为止；也可以是返回行的函数，
+        这时只有轮到这张表且放得下表头时才调用，取数据本身也省掉。
+        放不下min_rows行时整张表都不输出。
+        """
+        def render(remaining: int) -> Optional[str]:
+            lines = [title, '|'.join(columns)]
+            used = estimate_tokens('\n'.join(lines))
+            if used > remaining:
+                return None
+            count = 0
+            for row in (rows() if callable(rows) else rows):
+                line = '|'.join('' if value is None else str(value) for value in row)
+                cost = estimate_tokens(line) + 1
+                if used + cost > remaining:
+                    break
+                lines.append(line)
+                used += cost
+                count += 1
+            if count < min_rows:
+                return None
+            return '\n'.join(lines)
+        
+        self._sections.append(_Section(name, priority, render))
+        return self
+    
+    def build(self) -> str:
+        self.used_tokens = 0
+        self.dropped = []
+        for section in sorted(self._sections, key=lambda s: s.priority):
+            remaining = self.budget_tokens - self.used_tokens
+            text = section.render(remaining) if remaining > 0 else None
+            if text:
+                cost = estimate_tokens(text) + 2
+                if cost > remaining:
+                    text = None
+                else:
+                    self.used_tokens += cost
+            section.text = text
+            if not text:
+                self.dropped.append(section.name)
+        
+        return '\n\n'.join(s.text for s in self._sections if s.text)
@@ -1,5 +1,6 @@
 from datetime import datetime
 from typing import Dict, List, Tuple
+import hashlib
 import json
 
 
@@ -226,6 +227,23 @@ class DailyQuestionnaire:
     def generate_questionnaire(self) -> List[Dict]:
         return self.questions
     
+    def get_schema_version(self) -> str:
+        """
+        问卷结构版本号
+        根据问题ID、题型、选项和取值计算，问题或选项被修改后版本号随之改变
+        """
+        return self.compute_schema_version(self.questions)
+    
+    @staticmethod
+    def compute_schema_version(questions: List[Dict]) -> str:
+        schema = [
+            [q["id"], q["type"], q.get("question", ""), q.get("options", []),
+             q.get("values", []), q.get("placeholder", "")]
+            for q in questions
+        ]
+        schema_json = json.dumps(schema, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha1(schema_json.encode('utf-8')).hexdigest()[:12]
+    
     def validate_responses(self, responses: Dict) -> Tuple[bool, List[str]]:
         errors = []
         
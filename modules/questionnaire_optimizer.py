@@ -1,17 +1,19 @@
 import os
 import shutil
-import subprocess
 import tempfile
 from datetime import datetime
 from typing import Dict, List, Optional
 import json
 import re
 
+from .llm_client import LLMError, default_client
+
 
 class QuestionnaireOptimizer:
     """问卷优化器 - 根据用户反馈自动优化问卷问题"""
     
-    def __init__(self):
+    def __init__(self, llm_client=None):
+        self.llm_client = llm_client or default_client()
         self.questionnaire_file = "modules/questionnaire.py"
         self.backup_dir = "backups"
         self.suggestions_dir = "questionnaires"
@@ -102,20 +104,12 @@ class QuestionnaireOptimizer:
 
 用中文回复。"""
             
-            result = subprocess.run(
-                ['gemini', '-p', short_prompt],
-                capture_output=True,
-                text=True,
-                encoding='utf-8',
-                timeout=120
-            )
+            return self.llm_client.call(short_prompt, timeout=120).strip()
             
-            if result.returncode == 0 and result.stdout.strip():
-                return result.stdout.strip()
-            else:
-                # 如果AI分析失败，返回基本建议
-                return self._generate_basic_suggestions(feedback_list)
-                
+        except LLMError as e:
+            # 如果AI分析失败，返回基本建议
+            print(f"AI分析失败: {e}")
+            return self._generate_basic_suggestions(feedback_list)
         except Exception as e:
             print(f"AI分析失败: {e}")
             return self._generate_basic_suggestions(feedback_list)
@@ -233,19 +227,10 @@ class QuestionnaireOptimizer:
 
 用中文回复。"""
             
-            result = subprocess.run(
-                ['gemini', '-p', short_prompt],
-                capture_output=True,
-                text=True,
-                encoding='utf-8',
-                timeout=120
-            )
+            return self.llm_client.call(short_prompt, timeout=120).strip()
             
-            if result.returncode == 0 and result.stdout.strip():
-                return result.stdout.strip()
-            else:
-                return "AI代码生成失败，请手动根据建议修改代码。"
-                
+        except LLMError:
+            return "AI代码生成失败，请手动根据建议修改代码。"
         except Exception as e:
             return f"代码生成失败: {e}，请手动根据建议修改代码。"
     
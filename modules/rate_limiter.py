@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows：只在进程内限流
+    fcntl = None
+
+
+class RateLimitTimeout(Exception):
+    """排队超过最长等待时间"""
+
+
+class RateLimiter:
+    """
+    跨进程的令牌桶限流器
+    
+    同一台机器上的所有进程（主程序、批量导入的子进程等）共用一个状态文件，
+    通过文件锁互斥读写。限制每分钟请求数（令牌桶，允许burst次突发）和同时进行的请求数，
+    调用方按到达顺序排队（先来先得），拿到名额时返回排队等待的秒数。
+    排队和进行中的记录属于已退出的进程、或长时间没有更新时会被清理。
+    """
+    
+    def __init__(self, state_file: str = os.path.join("data", "llm_rate.json"),
+                 requests_per_minute: float = 30,
+                 max_concurrent: int = 2,
+                 burst: Optional[int] = None,
+                 lease_seconds: float = 600,
+                 poll_interval: float = 0.2):
+        self.state_file = state_file
+        self.lock_file = state_file + '.lock'
+        self.rate = requests_per_minute / 60.0
+        self.max_concurrent = max_concurrent
+        self.burst = burst or max_concurrent
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._thread_lock = threading.Lock()
+    
+    @contextmanager
+    def _locked_state(self):
+        """持有锁期间读出状态，退出时写回"""
+        os.makedirs(os.path.dirname(self.state_file) or '.', exist_ok=True)
+        with self._thread_lock, open(self.lock_file, 'a') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self.state_file, 'r', encoding='utf-8') as f:
+                        state = json.load(f)
+                except (OSError, ValueError):
+                    state = {}
+                state.setdefault('tokens', float(self.burst))
+                state.setdefault('updated_at', time.time())
+                state.setdefault('queue', [])
+                state.setdefault('active', [])
+                state.setdefault('stats', {'calls': 0, 'total_wait': 0.0, 'max_wait': 0.0, 'last_wait': 0.0})
+                yield state
+                tmp_path = self.state_file + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(state, f, ensure_ascii=False)
+                os.replace(tmp_path, self.state_file)
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+    
+    @staticmethod
+    def _alive(pid: int) -> bool:
+        if pid == os.getpid():
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except OSError:
+            pass
+        return True
+    
+    def _refresh(self, state: Dict, now: float):
+        """补充令牌并清理失效的排队和进行中记录"""
+        elapsed = max(0.0, now - state['updated_at'])
+        state['tokens'] = min(float(self.burst), state['tokens'] + elapsed * self.rate)
+        state['updated_at'] = now
+        # 排队的调用方每次轮询都会更新seen，长时间未更新说明已经放弃
+        stale = max(30.0, self.poll_interval * 20)
+        state['queue'] = [t for t in state['queue']
+                          if self._alive(t['pid']) and now - t['seen'] < stale]
+        state['active'] = [a for a in state['active']
+                           if self._alive(a['pid']) and now - a['started'] < self.lease_seconds]
+    
+    def acquire(self, max_wait: Optional[float] = None) -> Dict:
+        """
+        排队等待一个请求名额，返回 {'ticket', 'wait'}；用完后调用release()
+        
+        max_wait秒内没有轮到时抛出RateLimitTimeout。
+        """
+        ticket = uuid.uuid4().hex
+        enqueued = time.time()
+        with self._locked_state() as state:
+            state['queue'].append({'ticket': ticket, 'pid': os.getpid(), 'seen': enqueued})
+        
+        try:
+            while True:
+                now = time.time()
+                timed_out = None
+                with self._locked_state() as state:
+                    self._refresh(state, now)
+                    position = next((i for i, t in enumerate(state['queue']) if t['ticket'] == ticket), None)
+                    if position is None:
+                        # 记录被当作失效清理掉了，重新排到队尾
+                        state['queue'].append({'ticket': ticket, 'pid': os.getpid(), 'seen': now})
+                        position = len(state['queue']) - 1
+                    state['queue'][position]['seen'] = now
+                    
+                    if position == 0 and state['tokens'] >= 1 and len(state['active']) < self.max_concurrent:
+                        state['queue'].pop(0)
+                        state['tokens'] -= 1
+                        state['active'].append({'ticket': ticket, 'pid': os.getpid(), 'started': now})
+                        wait = now - enqueued
+                        stats = state['stats']
+                        stats['calls'] += 1
+                        stats['total_wait'] += wait
+                        stats['max_wait'] = max(stats['max_wait'], wait)
+                        stats['last_wait'] = wait
+                        return {'ticket': ticket, 'wait': wait}
+                    
+                    if max_wait is not None and now - enqueued >= max_wait:
+                        state['queue'].pop(position)
+                        timed_out = position
+                    
+                    # 只差令牌时按补充速度估算等待时间，否则按轮询间隔重试
+                    if position == 0 and state['tokens'] < 1:
+                        delay = (1 - state['tokens']) / self.rate
+                    else:
+                        delay = self.poll_interval
+                if timed_out is not None:
+                    raise RateLimitTimeout(f"排队超过{max_wait:g}秒（前面还有{timed_out}个请求）")
+                time.sleep(min(max(delay, 0.01), self.poll_interval * 5))
+        except BaseException:
+            # 等待中被中断（Ctrl+C、线程退出等）时立即让出队首，不让后面的调用方空等到记录失效
+            with self._locked_state() as state:
+                state['queue'] = [t for t in state['queue'] if t['ticket'] != ticket]
+                state['active'] = [a for a in state['active'] if a['ticket'] != ticket]
+            raise
+    
+    def release(self, slot: Dict):
+        with self._locked_state() as state:
+            state['active'] = [a for a in state['active'] if a['ticket'] != slot['ticket']]
+    
+    @contextmanager
+    def slot(self, max_wait: Optional[float] = None):
+        """with limiter.slot() as slot: ...   slot['wait']为排队秒数"""
+        slot = self.acquire(max_wait)
+        try:
+            yield slot
+        finally:
+            self.release(slot)
+    
+    def status(self) -> Dict:
+        """当前令牌数、排队和进行中的请求数以及累计排队时间"""
+        with self._locked_state() as state:
+            self._refresh(state, time.time())
+            stats = dict(state['stats'])
+            return {
+                'tokens': round(state['tokens'], 2),
+                'queued': len(state['queue']),
+                'active': len(state['active']),
+                'calls': stats['calls'],
+                'avg_wait': stats['total_wait'] / stats['calls'] if stats['calls'] else 0.0,
+                'max_wait': stats['max_wait'],
+                'last_wait': stats['last_wait'],
+            }
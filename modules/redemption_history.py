@@ -0,0 +1,226 @@
+import os
+import re
+import json
+import gzip
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows：只在进程内加锁
+    fcntl = None
+
+from .points_ledger import TXN_REDEEM
+
+
+# 最近几个自然月（含当月）的分区保持未压缩
+REDEMPTION_HOT_MONTHS = 3
+
+PARTITION_PATTERN = re.compile(r'^(\d{4}-\d{2})\.jsonl(\.gz)?$')
+
+
+class RedemptionHistory:
+    """
+    按月分区的兑换历史（data/redemptions/YYYY-MM.jsonl）
+    
+    兑换记录以积分账本为准，这里是它的派生视图：state.json记录已经读到的账本位置，
+    每次查询前只读取账本中新追加的兑换交易，按兑换日期追加到所在月份的分区。
+    最近REDEMPTION_HOT_MONTHS个月的分区是普通文本，更早的压缩为.jsonl.gz。
+    查询只打开与日期范围有交集的分区。
+    """
+    
+    def __init__(self, ledger, history_dir: str = os.path.join("data", "redemptions"),
+                 hot_months: int = REDEMPTION_HOT_MONTHS):
+        self.ledger = ledger
+        self.history_dir = history_dir
+        self.state_file = os.path.join(history_dir, "state.json")
+        self.lock_file = os.path.join(history_dir, ".lock")
+        self.hot_months = hot_months
+        self._thread_lock = threading.Lock()
+    
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.history_dir, exist_ok=True)
+        with self._thread_lock, open(self.lock_file, 'a') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+    
+    # ---------- 分区文件 ----------
+    
+    def _partition_path(self, month: str, compressed: bool) -> str:
+        return os.path.join(self.history_dir, f"{month}.jsonl" + ('.gz' if compressed else ''))
+    
+    def _partitions(self) -> Dict[str, str]:
+        """月份 -> 分区文件路径"""
+        partitions = {}
+        if os.path.isdir(self.history_dir):
+            for name in os.listdir(self.history_dir):
+                match = PARTITION_PATTERN.match(name)
+                if match:
+                    partitions[match.group(1)] = os.path.join(self.history_dir, name)
+        return partitions
+    
+    def _hot_cutoff(self) -> str:
+        """早于这个月份的分区需要压缩"""
+        now = datetime.now()
+        index = now.year * 12 + now.month - 1 - (self.hot_months - 1)
+        return f"{index // 12:04d}-{index % 12 + 1:02d}"
+    
+    def _append(self, month: str, records: List[Dict]):
+        data = ''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in records).encode('utf-8')
+        compressed = self._partition_path(month, True)
+        if os.path.exists(compressed):
+            # 补记到已压缩的旧月份：gzip允许追加一个新的成员；
+            # 同样检查解压后的最后一个字节，不让新记录接在压缩前留下的半行后面
+            if self._last_byte(compressed) not in (b'', b'\n'):
+                data = b'\n' + data
+            with gzip.open(compressed, 'ab') as f:
+                f.write(data)
+        else:
+            with open(self._partition_path(month, False), 'ab+') as f:
+                # 上次写到一半退出时补上换行，不让新记录接在半行后面
+                if f.tell():
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        data = b'\n' + data
+                f.write(data)
+    
+    @staticmethod
+    def _last_byte(path: str) -> bytes:
+        """压缩分区解压后的最后一个字节（只在补记旧月份时调用）"""
+        last = b''
+        with gzip.open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                last = chunk[-1:]
+        return last
+    
+    @staticmethod
+    def _read_partition(path: str) -> List[Dict]:
+        opener = gzip.open if path.endswith('.gz') else open
+        records = {}
+        with opener(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if not line.endswith('\n') or not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 写到一半的行（对应的记录会在下次同步时重新追加）
+                    continue
+                # 同步中途退出后重做时可能重复追加，按账本序号去重
+                records[record['seq']] = record
+        return list(records.values())
+    
+    def compact(self) -> int:
+        """把热窗口之外的未压缩分区压缩为.gz，返回压缩的分区数"""
+        cutoff = self._hot_cutoff()
+        compacted = 0
+        for month, path in sorted(self._partitions().items()):
+            if month >= cutoff or path.endswith('.gz'):
+                continue
+            tmp_path = self._partition_path(month, True) + '.tmp'
+            last = b''
+            with open(path, 'rb') as src, gzip.open(tmp_path, 'wb') as dst:
+                for chunk in iter(lambda: src.read(65536), b''):
+                    dst.write(chunk)
+                    last = chunk[-1:]
+                # 以半行结尾时补上换行，之后追加的成员从新的一行开始
+                if last not in (b'', b'\n'):
+                    dst.write(b'\n')
+            os.replace(tmp_path, self._partition_path(month, True))
+            os.remove(path)
+            compacted += 1
+        return compacted
+    
+    # ---------- 同步 ----------
+    
+    def _load_state(self) -> Dict:
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'ledger_offset': 0, 'seq': 0, 'compacted_for': None}
+    
+    def _save_state(self, state: Dict):
+        tmp_path = self.state_file + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_file)
+    
+    def _rebuild(self):
+        for path in self._partitions().values():
+            os.remove(path)
+    
+    def sync(self) -> int:
+        """把账本中新的兑换交易追加到分区，返回新增的记录数"""
+        with self._locked():
+            return self._sync()
+    
+    def _sync(self) -> int:
+        state = self._load_state()
+        if self.ledger.size() < state['ledger_offset']:
+            # 账本被替换（重新迁移等），从头重建
+            self._rebuild()
+            state = {'ledger_offset': 0, 'seq': 0, 'compacted_for': None}
+        
+        txns, offset = self.ledger.read_from(state['ledger_offset'])
+        by_month: Dict[str, List[Dict]] = {}
+        for txn in txns:
+            if txn['type'] != TXN_REDEEM or txn['seq'] <= state['seq']:
+                continue
+            meta = txn.get('meta', {})
+            by_month.setdefault(txn['date'][:7], []).append({
+                'seq': txn['seq'],
+                'date': txn['date'],
+                'time': meta.get('time', txn['timestamp'][11:19]),
+                'reward_id': meta.get('reward_id'),
+                'reward_name': meta.get('reward_name'),
+                'points_spent': meta.get('points_spent'),
+                'category': meta.get('category'),
+                'timestamp': txn['timestamp']
+            })
+        for month, records in by_month.items():
+            self._append(month, records)
+        
+        # 每个月第一次同步时压缩滑出热窗口的分区
+        cutoff = self._hot_cutoff()
+        changed = False
+        if state.get('compacted_for') != cutoff:
+            self.compact()
+            state['compacted_for'] = cutoff
+            changed = True
+        
+        if txns or not os.path.exists(self.state_file):
+            state['ledger_offset'] = offset
+            state['seq'] = txns[-1]['seq'] if txns else state['seq']
+            changed = True
+        if changed:
+            self._save_state(state)
+        return sum(len(records) for records in by_month.values())
+    
+    # ---------- 查询 ----------
+    
+    def query(self, start_date: Optional[str] = None, end_date: Optional[str] = None) -> List[Dict]:
+        """日期在 [start_date, end_date] 内的兑换记录，按时间从新到旧；只读取有交集的月份分区"""
+        start_month = start_date[:7] if start_date else None
+        end_month = end_date[:7] if end_date else None
+        
+        records = []
+        # 持锁读取，避免读到一半时分区被压缩替换
+        with self._locked():
+            self._sync()
+            for month, path in self._partitions().items():
+                if (start_month and month < start_month) or (end_month and month > end_month):
+                    continue
+                for record in self._read_partition(path):
+                    if (start_date and record['date'] < start_date) or (end_date and record['date'] > end_date):
+                        continue
+                    records.append(record)
+        return sorted(records, key=lambda r: r['timestamp'], reverse=True)
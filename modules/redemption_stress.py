@@ -0,0 +1,115 @@
+import time
+import shutil
+import tempfile
+import multiprocessing
+from typing import Dict
+
+from .data_manager import DataManager
+from .redemption_system import RedemptionSystem
+
+
+STRESS_REWARD = {
+    "id": "stress_test",
+    "name": "压测奖励",
+    "description": "并发兑换压测用",
+    "points": 7,
+    "category": "study",
+    "emoji": "🧪"
+}
+
+
+def _worker(data_dir: str, attempts: int, start, results):
+    """一个客户端进程：等所有进程就绪后连续兑换attempts次"""
+    data_manager = DataManager(data_dir)
+    redemption = RedemptionSystem(data_manager)
+    succeeded = rejected = busy = 0
+    start.wait()
+    began = time.perf_counter()
+    for _ in range(attempts):
+        success, message = redemption.redeem_reward(STRESS_REWARD['id'])
+        if success:
+            succeeded += 1
+        elif message.startswith("积分不足"):
+            rejected += 1
+        else:
+            busy += 1
+    results.put({
+        'succeeded': succeeded,
+        'rejected': rejected,
+        'busy': busy,
+        'conflicts': redemption.version_conflicts,
+        'seconds': time.perf_counter() - began
+    })
+
+
+def run_stress(workers: int = 8, attempts: int = 100, balance: int = 2000) -> Dict:
+    """
+    在临时目录里用workers个进程同时兑换，检查没有透支并统计每秒兑换数
+    
+    初始积分为balance，每次兑换STRESS_REWARD的积分。结束后核对账本：
+    余额不为负、成功次数×单价等于扣除的积分、账本审计通过。
+    """
+    data_dir = tempfile.mkdtemp(prefix="redeem_stress_")
+    try:
+        data_manager = DataManager(data_dir)
+        redemption = RedemptionSystem(data_manager)
+        redemption.add_reward(STRESS_REWARD)
+        data_manager.ledger.set_day_points('2000-01-01', balance, memo="压测初始积分")
+        
+        context = multiprocessing.get_context()
+        # 各进程完成导入和初始化后与主进程一起越过屏障，同时开始兑换
+        start = context.Barrier(workers + 1)
+        results = context.Queue()
+        processes = [context.Process(target=_worker, args=(data_dir, attempts, start, results))
+                     for _ in range(workers)]
+        for process in processes:
+            process.start()
+        start.wait()
+        began = time.perf_counter()
+        outcomes = [results.get() for _ in processes]
+        elapsed = time.perf_counter() - began
+        for process in processes:
+            process.join()
+        
+        succeeded = sum(o['succeeded'] for o in outcomes)
+        final_balance = data_manager.get_total_points()
+        audit = data_manager.ledger.audit()
+        spent = balance - final_balance
+        return {
+            'workers': workers,
+            'attempts': workers * attempts,
+            'succeeded': succeeded,
+            'rejected': sum(o['rejected'] for o in outcomes),
+            'busy': sum(o['busy'] for o in outcomes),
+            'conflicts': sum(o['conflicts'] for o in outcomes),
+            'seconds': elapsed,
+            'redemptions_per_second': succeeded / elapsed if elapsed else 0.0,
+            'final_balance': final_balance,
+            'ok': (final_balance >= 0 and spent == succeeded * STRESS_REWARD['points']
+                   and audit['ok'] and audit['balance'] == final_balance),
+            'problems': audit['problems']
+        }
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def format_stress_result(result: Dict) -> str:
+    lines = [
+        f"进程数: {result['workers']}，兑换请求: {result['attempts']}次",
+        f"成功: {result['succeeded']}次，积分不足: {result['rejected']}次，重试后仍冲突: {result['busy']}次",
+        f"版本冲突重试: {result['conflicts']}次",
+        f"耗时: {result['seconds']:.2f}秒，吞吐: {result['redemptions_per_second']:.0f}次兑换/秒",
+        f"剩余积分: {result['final_balance']}分",
+        "✅ 没有透支，账本核对一致" if result['ok'] else "❌ 账本核对失败"
+    ]
+    lines.extend(f"   - {problem}" for problem in result['problems'])
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import sys
+    
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    outcome = run_stress(workers=workers)
+    print(format_stress_result(outcome))
+    sys.exit(0 if outcome['ok'] else 1)
@@ -1,14 +1,43 @@
-import json
 import os
+import time
+import uuid
+import random
 from typing import Dict, List, Tuple
-from datetime import datetime
+from datetime import datetime, timedelta
+
+from .points_ledger import InsufficientPoints, VersionConflict
+from .redemption_history import RedemptionHistory
+from .reward_catalog import REWARDS_PAGE_SIZE, RewardCatalog
+
+
+# 版本冲突时的重试次数和退避时间（秒）
+REDEEM_MAX_RETRIES = 5
+REDEEM_BACKOFF_BASE = 0.005
+REDEEM_BACKOFF_MAX = 0.1
+
+# 类别中文名称
+CATEGORY_NAMES = {
+    'rest': '休息放松',
+    'health': '健康养生',
+    'food': '美食享受',
+    'entertainment': '娱乐活动',
+    'social': '社交活动',
+    'experience': '体验活动',
+    'shopping': '购物奖励',
+    'travel': '旅行度假',
+    'tech': '科技产品',
+    'study': '学习进步'
+}
 
 
 class RedemptionSystem:
     def __init__(self, data_manager):
         self.data_manager = data_manager
-        self.rewards_file = os.path.join("data", "rewards.json")
-        self.redemption_history_file = os.path.join("data", "redemption_history.json")
+        self.rewards_file = os.path.join(data_manager.data_dir, "rewards.json")
+        self.catalog = RewardCatalog(self.rewards_file)
+        self.history = RedemptionHistory(data_manager.ledger, os.path.join(data_manager.data_dir, "redemptions"))
+        # 本实例遇到的版本冲突次数（用于压测和排查）
+        self.version_conflicts = 0
         self._init_rewards()
     
     def _init_rewards(self):
@@ -73,28 +102,28 @@ class RedemptionSystem:
     
     def save_rewards(self, rewards: List[Dict]):
         """保存奖励列表"""
-        with open(self.rewards_file, 'w', encoding='utf-8') as f:
-            json.dump(rewards, f, ensure_ascii=False, indent=2)
+        self.catalog.save(rewards)
     
     def load_rewards(self) -> List[Dict]:
-        """加载奖励列表"""
-        with open(self.rewards_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        """加载奖励列表（文件没有变化时直接使用内存中的目录）"""
+        return self.catalog.all()
     
     def add_reward(self, reward: Dict) -> bool:
         """添加新奖励"""
-        rewards = self.load_rewards()
-        
         # 检查ID是否已存在
-        if any(r['id'] == reward['id'] for r in rewards):
+        if self.catalog.get(reward['id']) is not None:
             return False
         
+        rewards = self.load_rewards()
         rewards.append(reward)
         self.save_rewards(rewards)
         return True
     
     def update_reward(self, reward_id: str, updated_reward: Dict) -> bool:
         """更新奖励"""
+        if self.catalog.get(reward_id) is None:
+            return False
+        
         rewards = self.load_rewards()
         
         for i, r in enumerate(rewards):
@@ -113,142 +142,101 @@ class RedemptionSystem:
         return True
     
     def get_available_rewards(self, current_points: int) -> List[Dict]:
-        """获取当前积分可兑换的奖励"""
-        rewards = self.load_rewards()
-        available = [r for r in rewards if r['points'] <= current_points]
-        return sorted(available, key=lambda x: x['points'])
+        """获取当前积分可兑换的奖励（按积分排序的目录上二分查找）"""
+        return self.catalog.affordable(current_points)
     
     def get_rewards_by_category(self, category: str = None) -> List[Dict]:
         """按类别获取奖励"""
-        rewards = self.load_rewards()
-        if category:
-            rewards = [r for r in rewards if r['category'] == category]
-        return sorted(rewards, key=lambda x: x['points'])
+        return self.catalog.by_category(category)
     
-    def redeem_reward(self, reward_id: str) -> Tuple[bool, str]:
-        """兑换奖励"""
-        rewards = self.load_rewards()
-        reward = next((r for r in rewards if r['id'] == reward_id), None)
-        
-        if not reward:
-            return False, "奖励不存在"
-        
-        current_points = self.data_manager.get_total_points()
-        
-        if current_points < reward['points']:
-            return False, f"积分不足，需要{reward['points']}分，当前只有{current_points}分"
-        
-        # 扣除积分
-        self._deduct_points(reward['points'], reward)
-        
-        # 记录兑换历史
-        self._record_redemption(reward)
-        
-        return True, f"成功兑换：{reward['name']}！"
+    def search_rewards(self, query: str = '', category: str = None, max_points: int = None,
+                       page: int = 1, page_size: int = REWARDS_PAGE_SIZE) -> Dict:
+        """按关键词（名称、描述）、类别和积分上限搜索奖励，分页返回 {'items', 'total', 'page', 'pages'}"""
+        return self.catalog.search(query, category, max_points, page, page_size)
     
-    def _deduct_points(self, points: int, reward: Dict):
-        """扣除积分"""
-        points_data = self.data_manager._load_points()
-        points_data['total_points'] -= points
-        
-        # 添加扣除记录
-        deduction_record = {
-            'date': datetime.now().strftime('%Y-%m-%d'),
-            'daily_points': -points,
-            'total_points': points_data['total_points'],
-            'details': [{
-                'category': '兑换奖励',
-                'item': f"兑换：{reward['name']}",
-                'points': -points
-            }],
-            'timestamp': datetime.now().isoformat()
-        }
+    def get_categories(self) -> List[Tuple[str, str]]:
+        """目录中出现的类别：[(类别, 中文名称), ...]"""
+        return [(c, CATEGORY_NAMES.get(c, c)) for c in self.catalog.categories()]
+    
+    def redeem_reward(self, reward_id: str, request_id: str = None) -> Tuple[bool, str]:
+        """
+        兑换奖励
         
-        points_data['history'].append(deduction_record)
+        request_id是这次兑换的幂等键：同一个request_id重复提交只扣一次积分。
+        不传时每次调用都视为新的兑换。多个客户端同时兑换时按账本版本比较并交换提交，
+        不会透支。
+        """
+        reward = self.catalog.get(reward_id)
         
-        with open(self.data_manager.points_file, 'w', encoding='utf-8') as f:
-            json.dump(points_data, f, ensure_ascii=False, indent=2)
-    
-    def _record_redemption(self, reward: Dict):
-        """记录兑换历史"""
-        if not os.path.exists(self.redemption_history_file):
-            history = []
-        else:
-            with open(self.redemption_history_file, 'r', encoding='utf-8') as f:
-                history = json.load(f)
+        if not reward:
+            return False, "奖励不存在"
         
-        redemption = {
-            'date': datetime.now().strftime('%Y-%m-%d'),
-            'time': datetime.now().strftime('%H:%M:%S'),
+        ledger = self.data_manager.ledger
+        key = request_id or uuid.uuid4().hex
+        meta = {
             'reward_id': reward['id'],
             'reward_name': reward['name'],
             'points_spent': reward['points'],
-            'timestamp': datetime.now().isoformat()
+            'category': reward['category'],
+            'time': datetime.now().strftime('%H:%M:%S')
         }
         
-        history.append(redemption)
-        
-        with open(self.redemption_history_file, 'w', encoding='utf-8') as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
+        # 乐观并发：读取余额和版本，检查通过后按版本比较并交换提交；
+        # 期间有其他交易写入时重新读取，最多重试REDEEM_MAX_RETRIES次
+        for attempt in range(REDEEM_MAX_RETRIES + 1):
+            balance, version = ledger.snapshot()
+            txn = ledger.get(key)
+            if txn is None and balance < reward['points']:
+                return False, f"积分不足，需要{reward['points']}分，当前只有{balance}分"
+            try:
+                if txn is None:
+                    txn, created = ledger.redeem(reward['points'], key=key, memo=f"兑换：{reward['name']}",
+                                                 meta=meta, expected_version=version)
+                    if created:
+                        return True, f"成功兑换：{reward['name']}！"
+                return True, f"这次兑换已经处理过了：{txn['meta']['reward_name']}（没有重复扣分）"
+            except VersionConflict:
+                self.version_conflicts += 1
+                delay = min(REDEEM_BACKOFF_MAX, REDEEM_BACKOFF_BASE * 2 ** attempt)
+                time.sleep(random.uniform(0, delay))
+            except InsufficientPoints as e:
+                return False, str(e)
+        
+        return False, "兑换的人太多了，请稍后再试（积分未扣除）"
     
     def get_redemption_history(self, days: int = None) -> List[Dict]:
-        """获取兑换历史"""
-        if not os.path.exists(self.redemption_history_file):
-            return []
-        
-        with open(self.redemption_history_file, 'r', encoding='utf-8') as f:
-            history = json.load(f)
-        
-        if days:
-            cutoff_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
-            history = [h for h in history if h['date'] >= cutoff_date]
-        
-        return sorted(history, key=lambda x: x['timestamp'], reverse=True)
+        """获取兑换历史（按月分区存储，指定days时只读取最近几个月的分区）"""
+        cutoff_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d') if days else None
+        return self.history.query(start_date=cutoff_date)
     
     def get_redemption_stats(self) -> Dict:
-        """获取兑换统计"""
-        history = self.get_redemption_history()
-        
-        if not history:
-            return {
-                'total_redemptions': 0,
-                'total_points_spent': 0,
-                'most_popular': None,
-                'categories': {}
-            }
-        
-        # 统计信息
-        total_points = sum(h['points_spent'] for h in history)
-        
-        # 最受欢迎的奖励
-        reward_counts = {}
-        for h in history:
-            reward_id = h['reward_id']
-            reward_counts[reward_id] = reward_counts.get(reward_id, 0) + 1
-        
-        most_popular_id = max(reward_counts, key=reward_counts.get)
-        
-        # 分类统计
-        rewards = self.load_rewards()
-        category_stats = {}
+        """获取兑换统计（账本逐笔累加的计数，与历史长度无关）"""
+        stats = self.data_manager.ledger.redemption_stats()
         
-        for h in history:
-            reward = next((r for r in rewards if r['id'] == h['reward_id']), None)
+        # 旧版本迁移来的兑换没有记录类别，按目录中的奖励补上（目录中已删除的奖励不计入）
+        category_stats = stats['by_category']
+        for reward_id, count in stats['uncategorized'].items():
+            reward = self.catalog.get(reward_id)
             if reward:
-                category = reward['category']
-                category_stats[category] = category_stats.get(category, 0) + 1
+                category_stats[reward['category']] = category_stats.get(reward['category'], 0) + count
         
         return {
-            'total_redemptions': len(history),
-            'total_points_spent': total_points,
-            'most_popular': most_popular_id,
+            'total_redemptions': stats['count'],
+            'total_points_spent': stats['points'],
+            'most_popular': stats['most_popular'],
             'categories': category_stats
         }
     
-    def format_rewards_display(self, rewards: List[Dict] = None) -> str:
-        """格式化显示奖励列表"""
+    def format_rewards_display(self, rewards: List[Dict] = None, page: int = 1,
+                               page_size: int = REWARDS_PAGE_SIZE) -> str:
+        """
+        格式化显示奖励列表
+        
+        不传rewards时只渲染目录的第page页（按积分排序），目录再大也只处理当前页的条目。
+        """
         if rewards is None:
-            rewards = self.load_rewards()
+            result = self.search_rewards(page=page, page_size=page_size)
+            return self.format_rewards_page(result)
         
         if not rewards:
             return "暂无可用奖励"
@@ -256,31 +244,14 @@ class RedemptionSystem:
         # 按类别分组
         categories = {}
         for reward in rewards:
-            cat = reward['category']
-            if cat not in categories:
-                categories[cat] = []
-            categories[cat].append(reward)
-        
-        # 类别中文名称
-        category_names = {
-            'rest': '休息放松',
-            'health': '健康养生',
-            'food': '美食享受',
-            'entertainment': '娱乐活动',
-            'social': '社交活动',
-            'experience': '体验活动',
-            'shopping': '购物奖励',
-            'travel': '旅行度假',
-            'tech': '科技产品',
-            'study': '学习进步'
-        }
+            categories.setdefault(reward['category'], []).append(reward)
         
         output = []
         output.append("🎁 积分兑换商城")
         output.append("=" * 50)
         
         for cat, items in sorted(categories.items()):
-            cat_name = category_names.get(cat, cat)
+            cat_name = CATEGORY_NAMES.get(cat, cat)
             output.append(f"\n📂 {cat_name}")
             output.append("-" * 30)
             
@@ -289,4 +260,18 @@ class RedemptionSystem:
                 output.append(f"   {item['description']}")
                 output.append("")
         
+        return "\n".join(output)
+    
+    def format_rewards_page(self, result: Dict, numbered: bool = False) -> str:
+        """渲染search_rewards返回的一页结果；numbered为True时在每项前加本页编号"""
+        if not result['total']:
+            return "没有符合条件的奖励"
+        
+        output = [f"第{result['page']}/{result['pages']}页，共{result['total']}项"]
+        output.append("-" * 40)
+        for i, item in enumerate(result['items'], 1):
+            prefix = f"{i}. " if numbered else ""
+            category = CATEGORY_NAMES.get(item['category'], item['category'])
+            output.append(f"{prefix}{item['emoji']} {item['name']} - {item['points']}分  [{category}]")
+            output.append(f"   {item['description']}")
         return "\n".join(output)
\ No newline at end of file
@@ -1,447 +1,508 @@
 import os
 import json
+import time
+import calendar
+import hashlib
 import subprocess
-from typing import Dict, List
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
 from datetime import datetime
 import tempfile
+from .scoring import RULES_VERSION
+from .report_templates import TemplateReportEngine, TIERED_ITEMS
+from .prompt_builder import PromptBuilder
+from .llm_client import LLMError, LLMTimeout, LLMUnavailable, default_client
+from .markdown_renderer import MarkdownRenderer, PdfRenderWorker
+
+
+# 报告生成方式的版本：修改prompt或报告格式后递增，使缓存的报告失效
+REPORT_VERSION = 3
+
+# 报告模式
+REPORT_MODE_LLM = 'llm'                         # 调用Gemini生成，失败时使用模板报告
+REPORT_MODE_TEMPLATE = 'template'               # 只用模板引擎，毫秒级
+REPORT_MODE_TEMPLATE_FIRST = 'template_first'   # 先给出模板报告，再在后台用Gemini润色
+REPORT_MODES = (REPORT_MODE_LLM, REPORT_MODE_TEMPLATE, REPORT_MODE_TEMPLATE_FIRST)
+
+# PDF后端：HTML报告总是生成，PDF为可选
+PDF_BACKEND_AUTO = 'auto'               # 安装了weasyprint时使用，否则只生成HTML
+PDF_BACKEND_WEASYPRINT = 'weasyprint'   # 常驻进程渲染HTML为PDF
+PDF_BACKEND_PANDOC = 'pandoc'           # 旧方式：每份报告启动一次pandoc + xelatex
+PDF_BACKEND_NONE = 'none'
+PDF_BACKENDS = (PDF_BACKEND_AUTO, PDF_BACKEND_WEASYPRINT, PDF_BACKEND_PANDOC, PDF_BACKEND_NONE)
+
+# 每日报告prompt的token预算（估算值，中文按每字1个token）
+PROMPT_BUDGET_TOKENS = 1500
+
+# 写入prompt的答案：(答案字段, 名称)
+PROMPT_FIELDS = [
+    ('study_completed', '学习计划'),
+    ('study_duration', '学习时长(分钟)'),
+    ('problems_completed', '练习题(道)'),
+    ('accuracy_rate', '正确率(%)'),
+    ('focus_level', '专注程度'),
+    ('review_completed', '复习'),
+    ('notes_taken', '笔记'),
+    ('thesis_writing', '论文写作(字)'),
+    ('memorization_time', '背诵(分钟)'),
+    ('online_course_time', '网课(分钟)'),
+    ('emotional_state', '情绪'),
+    ('physical_condition', '身体'),
+    ('sleep_quality', '睡眠'),
+    ('diet_quality', '饮食'),
+    ('breaks_taken', '休息'),
+]
+
+PROMPT_REQUIREMENTS = """# 报告要求
+1. 用温暖友好的语气，像朋友一样亲切；即使表现不理想也要找出亮点
+2. 详细分析今日积分：解释每项积分的意义，指出贡献最多和还有提升空间的类别
+3. 对照离下一档的差距和扣分项，提出1-2个明天具体可行的小目标
+4. 结尾用充满正能量的鼓励话语
+格式：Markdown，多用emoji，包含"今日表现"、"积分分析"、"明日建议"、"温馨寄语"等部分。"""
+
+# 单份报告转换PDF的最长等待时间（秒）
+PDF_TIMEOUT = 60
+
+
+class _ReportStream:
+    """
+    把Gemini的输出边生成边写入临时文件（报告Markdown路径加.partial），并记录首字延迟（TTFT）
+    
+    生成过程中原有的报告保持不变，得到完整内容后才由_generate_pdf替换；
+    结束时调用discard()删除临时文件。
+    """
+    
+    def __init__(self, path: str, echo: Optional[Callable[[str], None]] = None):
+        self.path = path
+        self.echo = echo
+        self.ttft: Optional[float] = None
+        self._file = None
+        self._started = None
+    
+    def __call__(self, chunk: Optional[str]):
+        if chunk is None:
+            # 新的一次尝试：丢弃上次的部分输出
+            self.close()
+            self._file = open(self.path, 'w', encoding='utf-8')
+            self._started = time.monotonic()
+            self.ttft = None
+            return
+        if self.ttft is None:
+            self.ttft = round(time.monotonic() - self._started, 2)
+        self._file.write(chunk)
+        self._file.flush()
+        if self.echo:
+            self.echo(chunk)
+    
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+    
+    def discard(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
 
 
 class ReportGenerator:
-    def __init__(self, data_manager):
+    def __init__(self, data_manager, report_dir: str = "reports",
+                 mode: str = REPORT_MODE_LLM, scoring=None,
+                 pdf_backend: str = PDF_BACKEND_AUTO,
+                 prompt_budget: int = PROMPT_BUDGET_TOKENS,
+                 llm_client=None):
+        if mode not in REPORT_MODES:
+            raise ValueError(f"未知的报告模式: {mode}（可选: {', '.join(REPORT_MODES)}）")
+        if pdf_backend not in PDF_BACKENDS:
+            raise ValueError(f"未知的PDF后端: {pdf_backend}（可选: {', '.join(PDF_BACKENDS)}）")
+        if pdf_backend == PDF_BACKEND_AUTO:
+            pdf_backend = PDF_BACKEND_WEASYPRINT if PdfRenderWorker.is_available() else PDF_BACKEND_NONE
         self.data_manager = data_manager
+        self.report_dir = report_dir
+        self.mode = mode
+        self.template_engine = TemplateReportEngine(data_manager, scoring)
+        self.markdown_renderer = MarkdownRenderer()
+        self.prompt_budget = prompt_budget
+        self.llm_client = llm_client or default_client()
+        # 搜索索引由DataManager维护，报告目录以这里为准
+        self.search_index = data_manager.search_index
+        self.search_index.report_dir = report_dir
+        self._rules_text: Optional[str] = None
+        # 最近一次调用Gemini生成报告的耗时：日期 -> {'ttft', 'seconds', 'queue_wait', 'succeeded'}
+        self.report_metrics: Dict[str, Dict] = {}
+        self.pdf_backend = pdf_backend
+        self._pdf_worker: Optional[PdfRenderWorker] = None
+        self._pdf_worker_lock = threading.Lock()
+        # 后台任务线程中收集的警告（见collect_warnings）
+        self._local = threading.local()
+        
+    @contextmanager
+    def collect_warnings(self):
+        """
+        在当前线程中收集生成报告时的警告而不是打印
         
+        后台任务线程使用：直接打印会插进前台菜单正在等待的输入提示中间。
+        """
+        warnings: List[str] = []
+        self._local.warnings = warnings
+        try:
+            yield warnings
+        finally:
+            self._local.warnings = None
+    
+    def _warn(self, message: str):
+        warnings = getattr(self._local, 'warnings', None)
+        if warnings is None:
+            print(message)
+        else:
+            warnings.append(message)
+    
     def generate_report(self, responses: Dict, points_details: List[Dict], 
-                       total_points: int, level_info: Dict) -> str:
-        prompt = self._create_gemini_prompt(responses, points_details, total_points, level_info)
+                       total_points: int, level_info: Dict, force: bool = False,
+                       mode: Optional[str] = None,
+                       echo: Optional[Callable[[str], None]] = None) -> str:
+        """
+        生成每日报告
+        
+        mode默认使用构造时的报告模式；template_first在这里只生成模板报告，
+        Gemini润色由调用方另行提交（见ReportJobQueue）。
+        输入（答案、积分明细、总分、等级、规则版本）与上次生成时相同时，
+        直接返回已有的报告文件；force=True时忽略缓存重新生成。
+        Gemini的输出边生成边写入Markdown文件，传入echo时同时逐段回显（如打印到终端）。
+        """
+        mode = mode or self.mode
+        date = responses["date"]
+        self.report_metrics.pop(date, None)
+        inputs = (responses, points_details, total_points, level_info)
+        llm_hash = self._compute_input_hash(*inputs, source=REPORT_MODE_LLM)
+        template_hash = self._compute_input_hash(*inputs, source=REPORT_MODE_TEMPLATE)
         
-        # 使用gemini-cli生成报告内容
-        report_content = self._call_gemini(prompt)
+        if mode == REPORT_MODE_LLM:
+            if not force:
+                cached_path = self._get_cached_report(date, (llm_hash,))
+                if cached_path:
+                    return cached_path
+            
+            prompt = self._create_gemini_prompt(*inputs)
+            
+            def retry_prompt():
+                # 精简的prompt只在第一次调用失败后才拼装
+                return self._create_gemini_prompt(*inputs, budget_tokens=self.prompt_budget // 3)
+            
+            # 使用gemini-cli生成报告内容，输出实时写入临时文件，已有的报告在得到完整内容前不变
+            os.makedirs(self.report_dir, exist_ok=True)
+            stream = _ReportStream(self._report_base_path(date) + '.md.partial', echo)
+            started = time.monotonic()
+            try:
+                report_content = self._call_gemini(prompt, retry_prompt, on_chunk=stream)
+            finally:
+                stream.discard()
+            self.report_metrics[date] = {
+                'ttft': stream.ttft,
+                'seconds': round(time.monotonic() - started, 2),
+                'queue_wait': round(self.llm_client.last_queue_wait(), 2),
+                'succeeded': report_content is not None
+            }
+            if report_content is not None:
+                report_path = self._generate_pdf(report_content, date)
+                self._save_report_hash(date, llm_hash)
+                return report_path
+            
+            # Gemini不可用时使用模板报告，不写入缓存，Gemini恢复后会重新生成
+            report_path = self._generate_pdf(self.template_engine.render(*inputs), date)
+            self._clear_report_hash(date)
+            return report_path
         
-        # 生成PDF报告
-        report_path = self._generate_pdf(report_content, responses["date"])
+        # 模板报告：同样输入已有Gemini生成的报告时直接使用
+        if not force:
+            cached_path = self._get_cached_report(date, (llm_hash, template_hash))
+            if cached_path:
+                return cached_path
         
+        report_path = self._generate_pdf(self.template_engine.render(*inputs), date)
+        self._save_report_hash(date, template_hash)
         return report_path
     
-    def _create_gemini_prompt(self, responses: Dict, points_details: List[Dict], 
-                             total_points: int, level_info: Dict) -> str:
-        # 获取历史数据用于分析趋势
-        historical_data = self.data_manager.get_recent_responses(7)
-        
-        prompt = f"""你是ZZW的考公学习助手。请根据今天的学习情况生成一份鼓励性的每日总结报告。
-
-# 今日学习数据
-
-日期：{responses['date']}
-
-## 学习情况
-- 学习计划完成情况：{responses.get('study_completed', {}).get('display', '未知')}
-- 学习时长：{responses.get('study_duration', {}).get('display', '未知')} (实际值: {responses.get('study_duration', {}).get('value', 0)}分钟)
-- 完成练习题：{responses.get('problems_completed', {}).get('display', '未知')} (实际值: {responses.get('problems_completed', {}).get('value', 0)}道)
-- 做题正确率：{responses.get('accuracy_rate', '未知')}
-- 专注程度：{responses.get('focus_level', {}).get('display', '未知')}
-- 复习情况：{responses.get('review_completed', {}).get('display', '未知')}
-- 笔记情况：{responses.get('notes_taken', {}).get('display', '未知')}
-
-## 扩展学习项目
-- 论文写作：{responses.get('thesis_writing', {}).get('display', '未知')} (实际值: {responses.get('thesis_writing', {}).get('value', 0)}字)
-- 背诵时间：{responses.get('memorization_time', {}).get('display', '未知')} (实际值: {responses.get('memorization_time', {}).get('value', 0)}分钟)
-- 网课学习：{responses.get('online_course_time', {}).get('display', '未知')} (实际值: {responses.get('online_course_time', {}).get('value', 0)}分钟)
-
-## 身心状态
-- 情绪状态：{responses.get('emotional_state', {}).get('display', '未知')}
-- 身体状态：{responses.get('physical_condition', {}).get('display', '未知')}
-- 睡眠质量：{responses.get('sleep_quality', {}).get('display', '未知')}
-- 饮食情况：{responses.get('diet_quality', {}).get('display', '未知')}
-- 休息情况：{responses.get('breaks_taken', {}).get('display', '未知')}
-
-## 今日积分详情
-"""
-        
-        # 按类别组织积分明细
-        categories = {}
-        for detail in points_details:
-            category = detail['category']
-            if category not in categories:
-                categories[category] = []
-            categories[category].append(detail)
+    def _compute_input_hash(self, responses: Dict, points_details: List[Dict],
+                            total_points: int, level_info: Dict, source: str = REPORT_MODE_LLM) -> str:
+        """计算报告输入的哈希值（source区分Gemini报告和模板报告）"""
+        payload = json.dumps({
+            'responses': responses,
+            'points_details': points_details,
+            'total_points': total_points,
+            'level_info': level_info,
+            'rules_version': RULES_VERSION,
+            'report_version': REPORT_VERSION,
+            'source': source
+        }, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def _report_base_path(self, date: str) -> str:
+        return os.path.join(self.report_dir, f"daily_report_{date}")
+    
+    def _get_cached_report(self, date: str, accepted_hashes: tuple) -> Optional[str]:
+        """哈希一致且报告文件仍在时返回报告路径（优先PDF，其次HTML）"""
+        base_path = self._report_base_path(date)
+        try:
+            with open(base_path + '.hash', 'r', encoding='utf-8') as f:
+                if f.read().strip() not in accepted_hashes:
+                    return None
+        except OSError:
+            return None
         
-        # 按类别输出积分明细
-        for category, items in categories.items():
-            prompt += f"\n### {category}\n"
-            for item in items:
-                prompt += f"- {item['item']}: {'+' if item['points'] > 0 else ''}{item['points']}分\n"
+        for path in (base_path + '.pdf', base_path + '.html', base_path + '.md'):
+            if os.path.exists(path):
+                return path
+        return None
+    
+    def _save_report_hash(self, date: str, input_hash: str):
+        with open(self._report_base_path(date) + '.hash', 'w', encoding='utf-8') as f:
+            f.write(input_hash)
+    
+    def _clear_report_hash(self, date: str):
+        hash_path = self._report_base_path(date) + '.hash'
+        if os.path.exists(hash_path):
+            os.remove(hash_path)
+    
+    def _create_gemini_prompt(self, responses: Dict, points_details: List[Dict], 
+                             total_points: int, level_info: Dict,
+                             budget_tokens: Optional[int] = None) -> str:
+        """
+        在预算内拼装每日报告的prompt
         
+        各节按优先级取舍：生成要求和积分明细最优先，其次是今日答案、等级、
+        成就计划和档位差距，最后才是近期趋势和积分规则。
+        数据用竖线分隔的紧凑表格表示。
+        """
+        date = responses['date']
         daily_points = sum(d['points'] for d in points_details)
-        prompt += f"\n**今日得分：{daily_points}分**\n"
-        prompt += f"**总积分：{total_points}分**\n"
-        prompt += f"\n## 等级信息\n"
-        prompt += f"当前等级：{level_info['current']['emoji']} {level_info['current']['name']} ({level_info['current']['min_points']}分)\n"
+        builder = PromptBuilder(budget_tokens or self.prompt_budget)
+
+        builder.add_text('intro', 0, "你是ZZW的考公学习助手。请根据今天的学习情况生成一份鼓励性的每日总结报告。")
+
+        def answer_rows():
+            for key, label in PROMPT_FIELDS:
+                answer = responses.get(key)
+                if isinstance(answer, dict):
+                    yield label, answer.get('display', ''), answer.get('value', '')
+                elif answer not in (None, ''):
+                    yield label, answer, ''
+
+        builder.add_table('answers', 2, f"# 今日学习数据（{date}）", ('项目', '回答', '数值'), answer_rows())
+        builder.add_table(
+            'points', 1, f"# 今日积分：{daily_points:+d}分，总积分：{total_points}分",
+            ('类别', '项目', '得分'),
+            ((d['category'], d['item'], f"{d['points']:+d}") for d in points_details)
+        )
+
+        def level_text():
+            current = level_info['current']
+            text = f"# 等级\n当前：{current['emoji']} {current['name']}（{current['min_points']}分）"
+            if level_info['next']:
+                text += f"\n下一级：{level_info['next']['emoji']} {level_info['next']['name']}（还需{level_info['needed']}分）"
+            return text
+
+        builder.add_text('level', 3, level_text)
+
+        plans = []
+        if responses.get('special_achievement'):
+            plans.append(f"# 今日特别成就\n{responses['special_achievement']}")
+        if responses.get('tomorrow_plan'):
+            plans.append(f"# 明天计划\n{responses['tomorrow_plan']}")
+        if plans:
+            builder.add_text('plans', 4, '\n'.join(plans))
         
-        if level_info['next']:
-            prompt += f"下一等级：{level_info['next']['emoji']} {level_info['next']['name']} (还需{level_info['needed']}分)\n"
+        builder.add_table(
+            'tier_gaps', 4, "# 离下一档还差多少", ('项目', '今天', '下一档', '档位积分'),
+            lambda: ((g['label'], f"{g['current']}{g['unit']}", f"{g['threshold']}{g['unit']}",
+                      f"{g['current_points']:+d}→{g['next_points']:+d}")
+                     for g in self.template_engine.tier_gaps(responses))
+        )
+        builder.add_table(
+            'trend', 5, "# 近期趋势（从新到旧）", ('日期', '得分', '学习分钟', '题数'),
+            lambda: ((d, f"{day['points']:+d}", day['study_minutes'], day['problems'])
+                     for d, day in self.data_manager.get_day_rollups(date, 7))
+        )
+        builder.add_text('rules', 6, self._rules_summary)
+        builder.add_text('requirements', 0, PROMPT_REQUIREMENTS)
         
-        # 添加特别成就和明天计划
-        if responses.get('special_achievement'):
-            prompt += f"\n## 今日特别成就\n{responses['special_achievement']}\n"
+        return builder.build()
         
-        if responses.get('tomorrow_plan'):
-            prompt += f"\n## 明天计划\n{responses['tomorrow_plan']}\n"
-        
-        # 添加历史趋势分析
-        if historical_data:
-            prompt += "\n## 近期学习趋势\n"
-            recent_points = []
-            for record in historical_data[-7:]:
-                if 'daily_points' in record:
-                    recent_points.append(record['daily_points'])
-            
-            if recent_points:
-                avg_points = sum(recent_points) / len(recent_points)
-                prompt += f"- 最近{len(recent_points)}天平均得分：{avg_points:.1f}分\n"
-                prompt += f"- 趋势：{'上升' if daily_points > avg_points else '下降' if daily_points < avg_points else '持平'}\n"
+    def _rules_summary(self) -> str:
+        """积分规则的紧凑说明（由积分规则生成，只需整理一次）"""
+        if self._rules_text is None:
+            rules = self.template_engine.scoring.scoring_rules
+            lines = ["# 积分规则（达到门槛即得对应分数）"]
+            for _, rule_key, label, unit in TIERED_ITEMS:
+                tiers = sorted((int(k), v['points']) for k, v in rules[rule_key].items())
+                lines.append(f"{label}({unit})：" + ' '.join(f"{t}→{p:+d}" for t, p in tiers))
+            accuracy = sorted(((int(k), v['points']) for k, v in rules['accuracy_rate'].items()), reverse=True)
+            lines.append("正确率(%)：" + ' '.join(f"{t}→{p:+d}" for t, p in accuracy))
+            lines.append(f"签到{rules['daily_checkin']['points']:+d}；"
+                         f"全勤一周{rules['weekly_perfect']['points']:+d}，一月{rules['monthly_perfect']['points']:+d}")
+            lines.append("扣分：" + ' '.join(f"{v['name']}{v['points']}" for v in rules['penalties'].values()))
+            self._rules_text = '\n'.join(lines)
+        return self._rules_text
         
-        # 添加积分规则说明
-        prompt += """
-
-## 积分规则详解
-
-### 🎯 奖励积分规则
-1. **基础积分**：
-   - 每日签到：+2分（每天登录就能获得）
-   
-2. **学习时长积分**（累进制）：
-   - 30-59分钟：+2分
-   - 60-119分钟：+4分
-   - 120-179分钟：+6分
-   - 180-239分钟：+8分
-   - 240-359分钟：+10分
-   - 360-479分钟：+12分
-   - 480分钟以上：+15分
-   
-3. **练习题积分**（累进制）：
-   - 10-29道：+2分
-   - 30-49道：+4分
-   - 50-79道：+6分
-   - 80-119道：+8分
-   - 120-179道：+10分
-   - 180道以上：+12分
-   
-4. **做题正确率积分**（仅在完成练习题时计算）：
-   - 95%以上：+8分（优秀）
-   - 90-94%：+6分（很好）
-   - 85-89%：+5分（良好）
-   - 80-84%：+4分（不错）
-   - 75-79%：+3分（及格）
-   - 70-74%：+2分（需加强）
-   - 60-69%：+1分（警告）
-   - 50-59%：0分（较差）
-   
-5. **生活习惯积分**：
-   - 睡眠7-8小时：+1分
-   - 睡眠8小时以上：+2分
-   - 健康饮食：+1分
-   - 营养均衡：+2分
-   - 合理休息：+1分
-   - 劳逸结合：+2分
-   
-6. **学习质量积分**：
-   - 完成复习任务：+2分
-   - 超额完成复习：+4分
-   - 详细笔记：+2分
-   - 整理归纳笔记：+3分
-   
-7. **扩展项目积分**：
-   - 论文写作500-999字：+2分
-   - 论文写作1000-1999字：+4分
-   - 论文写作2000-2999字：+6分
-   - 论文写作3000-4999字：+8分
-   - 论文写作5000字以上：+10分
-   - 背诵15-29分钟：+1分
-   - 背诵30-59分钟：+2分
-   - 背诵60-89分钟：+4分
-   - 背诵90-119分钟：+5分
-   - 背诵120分钟以上：+6分
-   - 网课30-59分钟：+2分
-   - 网课60-89分钟：+3分
-   - 网课90-119分钟：+4分
-   - 网课120-179分钟：+5分
-   - 网课180分钟以上：+6分
-   
-8. **连续学习奖励**：
-   - 完美一周（7天全勤）：+10分
-   - 完美一月（30天全勤）：+50分
-
-### ⚠️ 惩罚积分规则（强化版）
-1. **学习相关**：
-   - 未学习：-6分
-   - 未签到：-3分
-   - 做题正确率40-49%：-2分
-   - 做题正确率30-39%：-3分
-   - 做题正确率低于30%：-5分
-   
-2. **生活习惯**：
-   - 睡眠不足6小时：-5分
-   - 不健康饮食：-3分
-   - 连续学习未休息：-5分
-   - 焦虑情绪：-3分
-   
-3. **扩展项目**：
-   - 未进行论文写作：-4分
-   - 未进行背诵：-3分
-   - 未学习网课：-3分
-
-"""
+    def _call_gemini(self, prompt: str, retry_prompt: Optional[Callable[[], str]] = None,
+                     on_chunk: Optional[Callable[[Optional[str]], None]] = None) -> Optional[str]:
+        """
+        调用gemini-cli生成内容，失败时返回None由调用方决定备用内容
         
-        prompt += """
-# 生成要求
-
-请生成一份富有情感价值的每日总结报告，要求：
-
-1. **整体基调**：积极向上、温暖鼓励
-2. **内容结构**：
-   - 开头：温暖的问候和今日总评
-   - 数据分析：用生动的语言分析今天的学习和生活状态
-   - **积分分析**：
-     * 详细解释今天获得的每一项积分，说明为什么能获得这些分数
-     * 分析哪些方面做得好（获得高分的项目）
-     * 温和地指出扣分项，并说明改进方法
-     * 对比积分规则，分析还有哪些提升空间
-   - 改进建议：基于积分分析，提出1-2个明天可以改进的具体小目标
-   - 结尾：充满正能量的鼓励话语
-
-3. **积分分析要求**：
-   - 不要只列出积分，要解释每项积分背后的意义
-   - 对于学习时长和做题数量，要分析是否达到了较高的积分档位
-   - 对于扣分项，要温和地分析原因并给出改进建议
-   - 总结今天的积分构成，哪个类别贡献最多，哪个类别还有提升空间
-
-4. **视觉元素**：
-   - 大量使用emoji让报告生动有趣
-   - 用Markdown格式让内容层次分明
-   - 可以加入一些励志名言或小贴士
-
-5. **特别注意**：
-   - 即使今天表现不理想，也要找出亮点给予肯定
-   - 建议要具体可行，不要给太大压力
-   - 语气要像朋友一样亲切自然
-   - 积分分析要详细但不枯燥，用生动的语言描述
-
-请用Markdown格式生成报告内容。"""
+        重试、熔断由LLMClient负责；retry_prompt是出错后才调用的函数，返回更精简的prompt
+        （同样在预算内拼装，而不是截断原prompt）。传入on_chunk时流式读取输出。
+        """
+        try:
+            return self.llm_client.call(prompt, timeout=150, retries=0, on_chunk=on_chunk)
+        except LLMUnavailable as e:
+            self._warn(f"⚠️ {e}")
+            return None
+        except LLMError as e:
+            if not retry_prompt or isinstance(e, LLMTimeout) or not self.llm_client.is_available():
+                self._warn(f"⚠️ {e}")
+                return None
         
-        return prompt
-    
-    def _call_gemini(self, prompt: str) -> str:
+        self._warn("⚠️ 第一次尝试失败，使用更精简的prompt...")
         try:
-            # 为了避免prompt太长，提取关键信息创建简短的prompt
-            # 提取今日学习数据部分
-            data_start = prompt.find('# 今日学习数据')
-            data_end = prompt.find('# 生成要求')
-            
-            if data_start != -1 and data_end != -1:
-                learning_data = prompt[data_start:data_end]
-            else:
-                learning_data = prompt[:1000]  # 如果找不到标记，取前1000字符
-            
-            # 创建精简的prompt，确保不会太长
-            short_prompt = f"""请为ZZW生成一份温暖鼓励的考公学习日报。
-
-{learning_data}
-
-报告要求：
-1. 用温暖友好的语气，像朋友一样亲切
-2. 详细分析今日积分（解释每项积分的意义）
-3. 找出学习亮点并给予肯定
-4. 提供1-2个具体可行的改进建议
-5. 结尾用充满正能量的鼓励话语
-
-格式要求：
-- 使用Markdown格式
-- 多用emoji让报告生动有趣
-- 包含"今日表现"、"积分分析"、"明日建议"、"温馨寄语"等部分
-
-请生成完整的学习总结报告。"""
-            
-            # 使用-p参数直接调用gemini-cli
-            result = subprocess.run(
-                ['gemini', '-p', short_prompt],
-                capture_output=True,
-                text=True,
-                encoding='utf-8',
-                timeout=150
-            )
-            
-            if result.returncode == 0 and result.stdout.strip():
-                return result.stdout
-            else:
-                # 如果失败了，再尝试一次更短的版本
-                print("⚠️ 第一次尝试失败，使用更精简的prompt...")
-                
-                mini_prompt = f"""为ZZW生成今日考公学习总结报告。
-
-今日数据：{learning_data[:500]}...
-
-要求：温暖鼓励、分析积分、提出建议、使用emoji和Markdown格式。"""
-                
-                result2 = subprocess.run(
-                    ['gemini', '-p', mini_prompt],
-                    capture_output=True,
-                    text=True,
-                    encoding='utf-8',
-                    timeout=60
-                )
-                
-                if result2.returncode == 0 and result2.stdout.strip():
-                    return result2.stdout
-                
-                # 两种方式都失败了
-                print(f"⚠️ Gemini-cli返回错误代码: {result.returncode}")
-                if result.stderr:
-                    print(f"错误信息: {result.stderr}")
-                return self._generate_fallback_report(prompt)
-                
-        except subprocess.TimeoutExpired:
-            print(f"⚠️ Gemini-cli处理超时")
-            return self._generate_fallback_report(prompt)
-        except Exception as e:
-            print(f"调用gemini-cli失败: {e}")
-            return self._generate_fallback_report(prompt)
-    
-    def _generate_fallback_report(self, prompt: str) -> str:
-        # 备用报告模板（增强版）
-        return """# 📚 每日学习总结报告
-
-## 🌟 今日表现
-
-亲爱的ZZW，今天又是充实的一天！让我们一起回顾今天的学习历程。
-
-### 📊 学习数据总览
-今天你坚持完成了学习任务，这本身就是一个值得庆祝的成就！每一天的积累都在为你的成功打下坚实基础。
-
-### 🎯 积分分析
-根据你今天的学习记录：
-
-**获得积分项目**：
-- ✅ 每日签到奖励：恭喜你保持了学习的连续性！
-- 📚 学习时长积分：坚持就是胜利，每一分钟的学习都有价值
-- ✏️ 练习题完成：实践是检验真理的唯一标准
-- 💤 生活习惯加分：良好的作息是高效学习的保障
-
-**需要关注的地方**：
-- 如果有扣分项，请记住这只是提醒你需要调整的信号
-- 每个人都有状态不佳的时候，重要的是及时调整
-
-### 💪 今日亮点
-1. **坚持的力量**：无论今天学习了多长时间，你都在坚持，这种毅力值得赞赏！
-2. **进步的轨迹**：每一道题、每一页笔记都是你进步的见证
-3. **自律的品质**：能够坚持学习计划，说明你具备了成功的关键品质
-
-### 🎯 明日优化建议
-基于今天的表现，明天可以考虑：
-1. **时间管理**：如果今天学习时间较短，明天可以尝试增加30分钟
-2. **练习强化**：适当增加练习题数量，巩固知识点
-3. **作息调整**：保证充足睡眠，让大脑得到充分休息
-4. **心态调节**：保持积极乐观，相信自己的能力
-
-### 📈 积分提升小贴士
-- 学习180分钟以上可获得更高积分奖励
-- 完成50道以上练习题有额外加分
-- 保持7天连续学习可获得完美周奖励
-- 注意劳逸结合，避免疲劳作战导致扣分
-
-## 💝 温馨寄语
-
-考公之路确实充满挑战，但请记住：
-- 你不是一个人在战斗，有系统陪伴你的每一天
-- 今天的努力，是明天成功的基石
-- 保持节奏，稳步前进，终将到达目标
-
-> "志之所趋，无远弗届；志之所向，无坚不摧。"
-
-相信自己，你一定能够实现梦想！明天继续加油！🌈
-
----
-*Generated with ❤️ for ZZW - 考公路上的忠实伙伴*"""
+            return self.llm_client.call(retry_prompt(), timeout=60, on_chunk=on_chunk)
+        except LLMError as e:
+            self._warn(f"⚠️ {e}")
+            return None
     
     def _generate_pdf(self, content: str, date: str) -> str:
+        """
+        保存报告：总是写出Markdown和HTML（内嵌样式和中文字体，浏览器直接打开），
+        有PDF后端时再生成PDF。返回最完整的一种文件路径。
+        """
         # 确保报告目录存在
-        report_dir = "reports"
-        os.makedirs(report_dir, exist_ok=True)
+        os.makedirs(self.report_dir, exist_ok=True)
         
-        # 生成文件名
-        filename = f"daily_report_{date}.md"
-        filepath = os.path.join(report_dir, filename)
+        base_path = self._report_base_path(date)
+        filepath = base_path + '.md'
+        html_path = base_path + '.html'
+        pdf_path = base_path + '.pdf'
         
-        # 保存Markdown文件
-        with open(filepath, 'w', encoding='utf-8') as f:
+        # 保存Markdown文件（写完整后再替换，中途退出不会留下半份报告）
+        tmp_path = filepath + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             f.write(content)
+        os.replace(tmp_path, filepath)
         
-        # 尝试使用pandoc转换为PDF（如果可用）
-        pdf_path = filepath.replace('.md', '.pdf')
-        try:
-            result = subprocess.run(
-                ['pandoc', filepath, '-o', pdf_path, '--pdf-engine=xelatex', 
-                 '-V', 'CJKmainfont=Noto Sans CJK SC'],
-                capture_output=True
-            )
-            if result.returncode == 0:
+        self.search_index.index_report(date)
+        
+        # 进程内转换为HTML，毫秒级
+        with open(html_path, 'w', encoding='utf-8') as f:
+            f.write(self.markdown_renderer.to_html(content, title=f"每日学习总结报告 {date}"))
+        
+        # 旧的PDF与新内容不一致，先删除
+        if os.path.exists(pdf_path):
+            os.remove(pdf_path)
+        
+        if self.pdf_backend == PDF_BACKEND_WEASYPRINT:
+            if self._get_pdf_worker().render(html_path, pdf_path, warn=self._warn) and os.path.exists(pdf_path):
                 return pdf_path
-        except Exception:
-            pass
+        elif self.pdf_backend == PDF_BACKEND_PANDOC:
+            try:
+                result = subprocess.run(
+                    ['pandoc', filepath, '-o', pdf_path, '--pdf-engine=xelatex',
+                     '-V', 'CJKmainfont=Noto Sans CJK SC'],
+                    capture_output=True,
+                    timeout=PDF_TIMEOUT
+                )
+                if result.returncode == 0:
+                    return pdf_path
+            except Exception:
+                pass
         
-        # 如果PDF生成失败，返回Markdown路径
-        return filepath
+        # 没有PDF时返回HTML路径
+        return html_path
+    
+    def _get_pdf_worker(self) -> PdfRenderWorker:
+        """PDF渲染进程在第一次需要时启动，之后所有报告共用"""
+        with self._pdf_worker_lock:
+            if self._pdf_worker is None:
+                self._pdf_worker = PdfRenderWorker(timeout=PDF_TIMEOUT)
+            return self._pdf_worker
+    
+    def close(self):
+        """结束常驻的PDF渲染进程"""
+        if self._pdf_worker is not None:
+            self._pdf_worker.close()
     
-    def generate_weekly_summary(self) -> str:
-        # 获取最近7天的数据
-        recent_data = self.data_manager.get_recent_responses(7)
+    def generate_weekly_summary(self, week: Optional[str] = None) -> str:
+        """生成某个ISO周（默认本周）的周报，数据直接取自周汇总"""
+        week = week or self.data_manager.week_key(datetime.now().strftime("%Y-%m-%d"))
+        rollup = self.data_manager.get_week_rollup(week)
         
-        if not recent_data:
+        if not rollup:
             return None
         
-        prompt = self._create_weekly_summary_prompt(recent_data)
-        content = self._call_gemini(prompt)
+        return self._write_summary(rollup, '周', week, 7, f"weekly_summary_{week}.md")
         
-        # 生成周报文件
-        date_str = datetime.now().strftime("%Y-%m-%d")
-        filename = f"weekly_summary_{date_str}.md"
-        filepath = os.path.join("reports", filename)
+    def generate_monthly_summary(self, month: Optional[str] = None) -> str:
+        """生成某个月（默认本月）的月报，数据直接取自月汇总"""
+        month = month or datetime.now().strftime("%Y-%m")
+        rollup = self.data_manager.get_month_rollup(month)
+        
+        if not rollup:
+            return None
+        
+        year, month_number = map(int, month.split('-'))
+        period_days = calendar.monthrange(year, month_number)[1]
+        return self._write_summary(rollup, '月', month, period_days, f"monthly_summary_{month}.md")
+    
+    def _write_summary(self, rollup: Dict, unit: str, period: str, period_days: int, filename: str) -> str:
+        data_text = self._summary_data_text(rollup, unit, period_days)
+        prompt = self._create_summary_prompt(data_text, unit, period)
+        # Gemini不可用时直接输出汇总数据
+        content = self._call_gemini(prompt) or (
+            f"# 📅 学习{unit}报 · {period}\n\n{data_text}\n"
+            f"每一天的坚持都算数，下{unit}继续加油！💪\n"
+        )
+        
+        os.makedirs(self.report_dir, exist_ok=True)
+        filepath = os.path.join(self.report_dir, filename)
         
         with open(filepath, 'w', encoding='utf-8') as f:
             f.write(content)
         
         return filepath
     
-    def _create_weekly_summary_prompt(self, recent_data: List[Dict]) -> str:
-        prompt = """请生成一份考公学习周报，包含：
+    @staticmethod
+    def _summary_data_text(rollup: Dict, unit: str, period_days: int) -> str:
+        days_recorded = rollup['days_recorded']
+        average = rollup['points'] / days_recorded if days_recorded else 0
+
+        text = f"""- 学习天数：{rollup['study_days']}/{period_days}天（记录{days_recorded}天）
+- 总学习时长：{rollup['study_minutes']}分钟
+- 完成题目数：{rollup['problems']}道
+- 本{unit}总积分：{rollup['points']}分
+- 平均每日积分：{average:.1f}分
+"""
+
+        by_category = sorted(rollup['points_by_category'].items(), key=lambda kv: kv[1], reverse=True)
+        if by_category:
+            text += "\n## 积分构成\n\n"
+            for category, points in by_category:
+                text += f"- {category}：{points:+d}分\n"
+        
+        return text
+    
+    def _create_summary_prompt(self, data_text: str, unit: str, period: str) -> str:
+        prompt = f"""请生成一份考公学习{unit}报（{period}），包含：
 
-# 本周学习数据
+# 本{unit}学习数据
 
 """
         
-        total_study_time = 0
-        total_problems = 0
-        total_points = 0
-        study_days = 0
-        
-        for record in recent_data:
-            if record.get('study_duration', {}).get('value', 0) > 0:
-                study_days += 1
-                total_study_time += record['study_duration']['value']
-            
-            total_problems += record.get('problems_completed', {}).get('value', 0)
-            total_points += record.get('daily_points', 0)
+        prompt += data_text
         
         prompt += f"""
-- 学习天数：{study_days}/7天
-- 总学习时长：{total_study_time}分钟
-- 完成题目数：{total_problems}道
-- 本周总积分：{total_points}分
-- 平均每日积分：{total_points/7:.1f}分
-
-请生成一份鼓励性的周报，包括：
-1. 本周亮点总结
+请生成一份鼓励性的{unit}报，包括：
+1. 本{unit}亮点总结
 2. 进步分析
-3. 下周建议
+3. 下{unit}建议
 4. 励志寄语
 
 使用温暖鼓励的语气，多用emoji。
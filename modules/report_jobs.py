@@ -0,0 +1,230 @@
+import os
+import json
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+
+# 任务状态
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+STATUS_DISPLAY = {
+    PENDING: '⏳ 等待中',
+    RUNNING: '🔄 生成中',
+    DONE: '✅ 已完成',
+    FAILED: '❌ 失败'
+}
+
+
+class ReportJobQueue:
+    """
+    持久化的报告生成任务队列
+    
+    任务记录在data/report_jobs.json中，由一个后台线程按提交顺序执行，
+    导入问卷时只需提交任务即可立即返回。程序中途退出时，未完成的任务
+    会在下次启动调用resume()后继续生成。任务只记录日期，执行时再从
+    数据文件读取当天的答案和积分，因此重新导入后生成的总是最新结果。
+    """
+    
+    def __init__(self, report_generator, data_manager, scoring,
+                 jobs_file: str = os.path.join("data", "report_jobs.json"),
+                 keep_finished: int = 50):
+        self.report_generator = report_generator
+        self.data_manager = data_manager
+        self.scoring = scoring
+        self.jobs_file = jobs_file
+        self.keep_finished = keep_finished
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        self._idle = threading.Event()
+        self._idle.set()
+    
+    def _load(self) -> Dict:
+        if os.path.exists(self.jobs_file):
+            with open(self.jobs_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {'next_id': 1, 'jobs': []}
+    
+    def _save(self, state: Dict):
+        # 只保留最近的已结束任务，未结束的任务全部保留
+        finished = [j for j in state['jobs'] if j['status'] in (DONE, FAILED)]
+        if len(finished) > self.keep_finished:
+            drop = {j['id'] for j in finished[:len(finished) - self.keep_finished] if j.get('notified')}
+            state['jobs'] = [j for j in state['jobs'] if j['id'] not in drop]
+        
+        os.makedirs(os.path.dirname(self.jobs_file) or '.', exist_ok=True)
+        tmp_path = self.jobs_file + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.jobs_file)
+    
+    def _update_job(self, job_id: int, **fields) -> Optional[Dict]:
+        with self._lock:
+            state = self._load()
+            for job in state['jobs']:
+                if job['id'] == job_id:
+                    job.update(fields)
+                    self._save(state)
+                    return dict(job)
+        return None
+    
+    def submit(self, date: str, force: bool = False, mode: Optional[str] = None) -> Dict:
+        """
+        提交某天的报告任务；同一天已有等待中的任务时直接返回该任务
+        
+        force=True时忽略报告缓存，即使输入没有变化也重新生成；
+        mode指定报告模式（如template_first的后台润色使用llm），默认使用生成器的模式。
+        """
+        with self._lock:
+            state = self._load()
+            for job in state['jobs']:
+                if job['date'] == date and job['status'] == PENDING:
+                    if (force and not job.get('force')) or job.get('mode') != mode:
+                        job['force'] = job.get('force') or force
+                        job['mode'] = mode
+                        self._save(state)
+                    existing = dict(job)
+                    break
+            else:
+                existing = None
+                job = {
+                    'id': state['next_id'],
+                    'date': date,
+                    'status': PENDING,
+                    'created_at': datetime.now().isoformat(),
+                    'started_at': None,
+                    'finished_at': None,
+                    'report_path': None,
+                    'error': None,
+                    'force': force,
+                    'mode': mode,
+                    'notified': False
+                }
+                state['next_id'] += 1
+                state['jobs'].append(job)
+                self._save(state)
+        
+        self.start()
+        return existing or dict(job)
+    
+    def resume(self) -> int:
+        """程序启动时调用：把上次中断的任务重新排队并开始执行，返回待执行的任务数"""
+        with self._lock:
+            state = self._load()
+            pending = 0
+            for job in state['jobs']:
+                if job['status'] == RUNNING:
+                    job['status'] = PENDING
+                    job['started_at'] = None
+                if job['status'] == PENDING:
+                    pending += 1
+            if pending:
+                self._save(state)
+        
+        if pending:
+            self.start()
+        return pending
+    
+    def start(self):
+        """有待执行的任务时启动后台线程（已在运行则不重复启动）"""
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._idle.clear()
+            self._worker = threading.Thread(target=self._run, name="report-jobs", daemon=True)
+            self._worker.start()
+    
+    def _next_job(self) -> Optional[Dict]:
+        with self._lock:
+            state = self._load()
+            for job in state['jobs']:
+                if job['status'] == PENDING:
+                    job['status'] = RUNNING
+                    job['started_at'] = datetime.now().isoformat()
+                    self._save(state)
+                    return dict(job)
+            # 没有任务了，在持有锁时标记空闲，避免和submit的启动判断冲突
+            self._idle.set()
+            self._worker = None
+        return None
+    
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            # 生成过程中的警告（Gemini重试、PDF渲染失败等）记在任务上，由前台在提醒和菜单13中显示
+            with self.report_generator.collect_warnings() as warnings:
+                try:
+                    report_path = self._build_report(job['date'], job.get('force', False), job.get('mode'))
+                except Exception as e:
+                    self._update_job(job['id'], status=FAILED, error=str(e), warnings=warnings,
+                                     finished_at=datetime.now().isoformat())
+                else:
+                    # 调用了Gemini时记录首字延迟和总耗时，便于观察生成速度
+                    metrics = self.report_generator.report_metrics.get(job['date']) or {}
+                    self._update_job(job['id'], status=DONE, report_path=report_path, warnings=warnings,
+                                     finished_at=datetime.now().isoformat(),
+                                     ttft=metrics.get('ttft'), llm_seconds=metrics.get('seconds'),
+                                     queue_wait=metrics.get('queue_wait'))
+    
+    def _build_report(self, date: str, force: bool = False, mode: Optional[str] = None) -> str:
+        """从数据文件读取当天的答案和积分记录，生成报告"""
+        response = self.data_manager.get_response_by_date(date)
+        if not response:
+            raise ValueError(f"找不到{date}的问卷记录")
+        
+        record = next((r for r in self.data_manager.get_points_history() if r['date'] == date), None)
+        if record is None:
+            raise ValueError(f"找不到{date}的积分记录")
+        
+        total_points = record['total_points']
+        level_info = self.scoring.get_level_info(total_points)
+        return self.report_generator.generate_report(
+            response, record['details'], total_points, level_info, force=force, mode=mode
+        )
+    
+    def get_jobs(self, limit: Optional[int] = None) -> List[Dict]:
+        """按提交时间倒序返回任务列表"""
+        with self._lock:
+            jobs = list(reversed(self._load()['jobs']))
+        return jobs[:limit] if limit else jobs
+    
+    def get_active_job(self, date: str) -> Optional[Dict]:
+        """返回某天尚未完成的任务"""
+        for job in self.get_jobs():
+            if job['date'] == date and job['status'] in (PENDING, RUNNING):
+                return job
+        return None
+    
+    def count_unfinished(self) -> int:
+        return sum(1 for job in self.get_jobs() if job['status'] in (PENDING, RUNNING))
+    
+    def pop_notifications(self) -> List[Dict]:
+        """取出已结束但还没有提醒过用户的任务"""
+        with self._lock:
+            state = self._load()
+            finished = [j for j in state['jobs']
+                        if j['status'] in (DONE, FAILED) and not j.get('notified')]
+            if finished:
+                for job in finished:
+                    job['notified'] = True
+                self._save(state)
+        return [dict(j) for j in finished]
+    
+    def retry_failed(self) -> int:
+        """重新提交失败的任务，返回重新排队的数量"""
+        latest = {}
+        for job in self.get_jobs():
+            latest.setdefault(job['date'], job)
+        failed = [job for _, job in sorted(latest.items()) if job['status'] == FAILED]
+        for job in failed:
+            self.submit(job['date'], force=job.get('force', False), mode=job.get('mode'))
+        return len(failed)
+    
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待所有任务执行完毕，返回是否已空闲"""
+        return self._idle.wait(timeout)
@@ -0,0 +1,283 @@
+from string import Formatter
+from typing import Dict, List, Optional
+
+from .scoring import ScoringSystem, RULES_VERSION
+
+
+class CompiledTemplate:
+    """
+    预编译的文本模板
+    
+    模板使用 {字段} 占位符（支持 {字段:格式}），构造时解析一次，
+    渲染时只做字段查找和拼接，不再重复解析模板文本。
+    """
+    
+    _formatter = Formatter()
+    
+    def __init__(self, text: str):
+        self.text = text
+        self._parts = []
+        for literal, field, spec, conversion in self._formatter.parse(text):
+            if conversion:
+                raise ValueError(f"模板不支持转换符: !{conversion}")
+            self._parts.append((literal, field, spec or ''))
+    
+    def render(self, context: Dict) -> str:
+        out = []
+        for literal, field, spec in self._parts:
+            out.append(literal)
+            if field is not None:
+                out.append(format(context[field], spec))
+        return ''.join(out)
+
+
+class Section:
+    """
+    报告中的一节
+    
+    when为上下文中的字段名：字段值为空（False、0、空列表等）时整节不输出。
+    each为列表字段名：对列表中的每一项（与上下文合并后）渲染item模板。
+    """
+    
+    def __init__(self, template: str = '', when: Optional[str] = None,
+                 each: Optional[str] = None, item: str = '', footer: str = ''):
+        self.when = when
+        self.each = each
+        self.template = CompiledTemplate(template)
+        self.item = CompiledTemplate(item)
+        self.footer = CompiledTemplate(footer)
+    
+    def render(self, context: Dict) -> str:
+        if self.when and not context.get(self.when):
+            return ''
+        lines = [self.template.render(context)]
+        if self.each:
+            for entry in context.get(self.each) or []:
+                lines.append(self.item.render({**context, **entry}))
+        if self.footer.text:
+            lines.append(self.footer.render(context))
+        return '\n'.join(line for line in lines if line) + '\n'
+
+
+# 每日报告的结构：按顺序渲染，条件不满足的节会被跳过
+DAILY_REPORT_SECTIONS = [
+    Section(
+        "# 📚 每日学习总结报告 · {date}\n\n"
+        "## 🌟 今日表现\n\n"
+        "亲爱的ZZW，{greeting}\n\n"
+        "- 今日得分：**{daily_points_signed}分**\n"
+        "- 总积分：**{total_points}分**\n"
+        "- 当前等级：{level_emoji} {level_name}"
+    ),
+    Section("- 距离 {next_level_emoji} {next_level_name} 还需 **{level_needed}分** {level_bar}",
+            when='has_next_level'),
+    Section(
+        "\n## 📊 学习数据\n\n"
+        "- ⏱️ 学习时长：{study_duration_display}\n"
+        "- ✏️ 练习题：{problems_display}（正确率 {accuracy_display}）\n"
+        "- 🎯 专注程度：{focus_display}\n"
+        "- 😊 情绪 / 身体 / 睡眠：{emotion_display} / {physical_display} / {sleep_display}"
+    ),
+    Section("\n## 🎯 积分构成\n\n| 类别 | 得分 |\n|---|---|",
+            when='category_rows', each='category_rows', item="| {category} | {points_signed} |",
+            footer="\n今天贡献最多的是 **{top_category}**。"),
+    Section("\n### 💪 今日亮点\n",
+            when='strengths', each='strengths', item="- ✅ {item}：+{points}分"),
+    Section("\n### ⚠️ 扣分项\n",
+            when='penalties', each='penalties', item="- {item}：{points}分 —— {advice}"),
+    Section("\n## 📈 离下一档还差多少\n",
+            when='tier_gaps', each='tier_gaps',
+            item="- {label}：今天{current}{unit}，再多{gap}{unit}即可达到{threshold}{unit}档"
+                 "（{current_points:+d}分 → {next_points:+d}分）"),
+    Section("\n## 📉 近{trend_days}天趋势\n\n| 日期 | 得分 | 总积分 |\n|---|---|---|",
+            when='trend', each='trend', item="| {trend_date} | {points_signed} | {trend_total} |",
+            footer="\n{trend_summary}"),
+    Section("\n## 🏅 今日特别成就\n\n{special_achievement}", when='special_achievement'),
+    Section("\n## 🗓️ 明天计划\n\n{tomorrow_plan}", when='tomorrow_plan'),
+    Section(
+        "\n## 💝 温馨寄语\n\n{encouragement}\n\n"
+        "---\n*模板报告 · 积分规则v{rules_version}*"
+    ),
+]
+
+# 扣分项的改进建议（按积分明细中的项目名称）
+PENALTY_ADVICE = {
+    "未学习": "哪怕只学30分钟，也能把扣分变成加分",
+    "未签到": "每天记得填写问卷，签到就有+2分",
+    "不健康饮食": "明天试着按时吃一顿清淡均衡的饭",
+    "睡眠不足6小时": "今晚早点休息，睡够7小时还能加分",
+    "连续学习未休息": "每学习50分钟起来活动5分钟",
+    "焦虑情绪": "试试散步或和朋友聊聊，状态会慢慢好起来",
+    "未进行论文写作": "明天先写500字，就能从-4分变成+2分",
+    "未进行背诵": "安排15分钟背诵，就能避免扣分",
+    "未学习网课": "看30分钟网课即可避免扣分并额外+2分",
+}
+DEFAULT_ADVICE = "找出原因，明天做一点小调整就好"
+
+# 分档计分的项目：(答案字段, 积分规则, 名称, 单位)
+TIERED_ITEMS = [
+    ('study_duration', 'study_duration', '学习时长', '分钟'),
+    ('problems_completed', 'problems_solved', '练习题', '道'),
+    ('thesis_writing', 'thesis_writing', '论文写作', '字'),
+    ('memorization_time', 'memorization', '背诵', '分钟'),
+    ('online_course_time', 'online_course', '网课', '分钟'),
+]
+
+
+class TemplateReportEngine:
+    """不依赖大模型的报告引擎：用当天的真实积分、等级和近7天趋势渲染报告，耗时为毫秒级"""
+    
+    def __init__(self, data_manager, scoring: Optional[ScoringSystem] = None,
+                 sections: Optional[List[Section]] = None,
+                 trend_days: int = 7):
+        self.data_manager = data_manager
+        self.scoring = scoring or ScoringSystem()
+        self.sections = sections or DAILY_REPORT_SECTIONS
+        self.trend_days = trend_days
+        # 分档表只需整理一次：[(门槛, 积分), ...] 从低到高
+        self._tiers = {
+            rule_key: sorted((int(k), v['points']) for k, v in self.scoring.scoring_rules[rule_key].items())
+            for _, rule_key, _, _ in TIERED_ITEMS
+        }
+    
+    def render(self, responses: Dict, points_details: List[Dict],
+               total_points: int, level_info: Dict) -> str:
+        context = self.build_context(responses, points_details, total_points, level_info)
+        return ''.join(section.render(context) for section in self.sections)
+    
+    def build_context(self, responses: Dict, points_details: List[Dict],
+                      total_points: int, level_info: Dict) -> Dict:
+        daily_points = sum(d['points'] for d in points_details)
+        
+        def display(key: str) -> str:
+            value = responses.get(key)
+            if isinstance(value, dict):
+                return value.get('display', '未知')
+            return '未知'
+        
+        accuracy = responses.get('accuracy_rate')
+        context = {
+            'date': responses['date'],
+            'greeting': self._greeting(daily_points),
+            'daily_points_signed': f"{daily_points:+d}",
+            'total_points': total_points,
+            'study_duration_display': display('study_duration'),
+            'problems_display': display('problems_completed'),
+            'accuracy_display': f"{accuracy}%" if accuracy not in (None, '') else '未填写',
+            'focus_display': display('focus_level'),
+            'emotion_display': display('emotional_state'),
+            'physical_display': display('physical_condition'),
+            'sleep_display': display('sleep_quality'),
+            'special_achievement': responses.get('special_achievement') or '',
+            'tomorrow_plan': responses.get('tomorrow_plan') or '',
+            'encouragement': self.scoring.get_encouragement_message(total_points, daily_points),
+            'rules_version': RULES_VERSION,
+        }
+        context.update(self._level_context(level_info))
+        context.update(self._points_context(points_details))
+        context['tier_gaps'] = self.tier_gaps(responses)
+        context.update(self._trend_context(responses['date'], daily_points))
+        return context
+    
+    @staticmethod
+    def _greeting(daily_points: int) -> str:
+        if daily_points >= 15:
+            return "今天表现非常出色，每一分都是汗水换来的！"
+        if daily_points >= 5:
+            return "今天过得很充实，稳稳地向目标又迈进了一步。"
+        if daily_points >= 0:
+            return "今天有收获也有不足，我们一起看看哪里还能更好。"
+        return "今天状态不太理想，没关系，找到原因明天就能扳回来。"
+    
+    @staticmethod
+    def _level_context(level_info: Dict) -> Dict:
+        current = level_info['current']
+        next_level = level_info.get('next')
+        context = {
+            'level_emoji': current['emoji'],
+            'level_name': current['name'],
+            'has_next_level': bool(next_level),
+        }
+        if next_level:
+            span = next_level['min_points'] - current['min_points']
+            filled = int(10 * level_info['progress'] / span) if span > 0 else 0
+            filled = max(0, min(10, filled))
+            context.update({
+                'next_level_emoji': next_level['emoji'],
+                'next_level_name': next_level['name'],
+                'level_needed': level_info['needed'],
+                'level_bar': '▓' * filled + '░' * (10 - filled),
+            })
+        return context
+    
+    @staticmethod
+    def _points_context(points_details: List[Dict]) -> Dict:
+        category_totals = {}
+        for detail in points_details:
+            category_totals[detail['category']] = category_totals.get(detail['category'], 0) + detail['points']
+        
+        rows = sorted(category_totals.items(), key=lambda kv: kv[1], reverse=True)
+        strengths = sorted((d for d in points_details if d['points'] > 0),
+                           key=lambda d: d['points'], reverse=True)[:5]
+        penalties = [
+            {**d, 'advice': PENALTY_ADVICE.get(d['item'], DEFAULT_ADVICE)}
+            for d in points_details if d['points'] < 0
+        ]
+        return {
+            'category_rows': [{'category': c, 'points_signed': f"{p:+d}"} for c, p in rows],
+            'top_category': rows[0][0] if rows and rows[0][1] > 0 else '',
+            'strengths': strengths,
+            'penalties': penalties,
+        }
+    
+    def tier_gaps(self, responses: Dict) -> List[Dict]:
+        """各分档项目距离下一档的差距，只列出还有更高档位的项目"""
+        gaps = []
+        for response_key, rule_key, label, unit in TIERED_ITEMS:
+            value = responses.get(response_key)
+            if not isinstance(value, dict) or not isinstance(value.get('value'), (int, float)):
+                continue
+            current = int(value['value'])
+            tiers = self._tiers[rule_key]
+            current_points = 0
+            for threshold, points in tiers:
+                if current < threshold:
+                    gaps.append({
+                        'label': label,
+                        'unit': unit,
+                        'current': current,
+                        'threshold': threshold,
+                        'gap': threshold - current,
+                        'current_points': current_points,
+                        'next_points': points,
+                    })
+                    break
+                current_points = points
+        # 差距（按比例）最小的排在前面，最容易够到
+        gaps.sort(key=lambda g: g['gap'] / g['threshold'])
+        return gaps[:3]
+    
+    def _trend_context(self, date: str, daily_points: int) -> Dict:
+        history = [r for r in self.data_manager.get_points_history() if r['date'] <= date]
+        recent = history[-self.trend_days:]
+        previous = [r['daily_points'] for r in recent if r['date'] != date]
+        
+        summary = ''
+        if previous:
+            avg = sum(previous) / len(previous)
+            if daily_points > avg:
+                word = '高于'
+            elif daily_points < avg:
+                word = '低于'
+            else:
+                word = '持平于'
+            summary = f"之前{len(previous)}天平均得分 {avg:.1f}分，今天{word}平均水平。"
+        
+        return {
+            'trend': [
+                {'trend_date': r['date'], 'points_signed': f"{r['daily_points']:+d}", 'trend_total': r['total_points']}
+                for r in recent
+            ] if len(recent) > 1 else [],
+            'trend_days': self.trend_days,
+            'trend_summary': summary,
+        }
@@ -0,0 +1,159 @@
+import os
+import json
+import math
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Set
+
+from .search_index import tokenize
+
+
+REWARDS_PAGE_SIZE = 10
+
+
+def _terms(text: str) -> Set[str]:
+    """索引词：中文相邻两字和单字、英文单词和数字（小写）"""
+    terms = set(tokenize(text))
+    terms.update(ch for ch in text if '\u3400' <= ch <= '\u9fff')
+    return terms
+
+
+class RewardCatalog:
+    """
+    内存中的奖励目录（data/rewards.json）
+    
+    按id、类别建立索引，另有一份按积分排序的列表，可兑换的奖励用二分查找得到。
+    名称和描述建立倒排索引，索引词排好序，关键词按前缀匹配（输入"week"能找到weekend）。
+    文件的大小或修改时间变化时（手动编辑、其他进程保存）自动重新加载，否则不再读文件。
+    """
+    
+    def __init__(self, rewards_file: str = os.path.join("data", "rewards.json")):
+        self.rewards_file = rewards_file
+        self._signature = None
+        self._rewards: List[Dict] = []
+        self._by_id: Dict[str, Dict] = {}
+        self._by_category: Dict[str, List[Dict]] = {}
+        self._by_points: List[Dict] = []
+        self._points: List[int] = []
+        self._category_points: Dict[str, List[int]] = {}
+        self._postings: Dict[str, Set[str]] = {}
+        self._sorted_terms: List[str] = []
+    
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.rewards_file)
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
+    
+    def _ensure_loaded(self):
+        signature = self._file_signature()
+        if signature == self._signature:
+            return
+        rewards = []
+        if signature is not None:
+            with open(self.rewards_file, 'r', encoding='utf-8') as f:
+                rewards = json.load(f)
+        self._build_index(rewards)
+        self._signature = signature
+    
+    def _build_index(self, rewards: List[Dict]):
+        self._rewards = rewards
+        self._by_id = {r['id']: r for r in rewards}
+        self._by_points = sorted(rewards, key=lambda r: r['points'])
+        self._points = [r['points'] for r in self._by_points]
+        self._by_category = {}
+        for reward in self._by_points:
+            self._by_category.setdefault(reward['category'], []).append(reward)
+        self._category_points = {c: [r['points'] for r in items] for c, items in self._by_category.items()}
+        
+        self._postings = {}
+        for reward in rewards:
+            text = f"{reward['id']} {reward['name']} {reward.get('description', '')}"
+            for term in _terms(text):
+                self._postings.setdefault(term, set()).add(reward['id'])
+        self._sorted_terms = sorted(self._postings)
+    
+    def save(self, rewards: List[Dict]):
+        tmp_path = self.rewards_file + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(rewards, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.rewards_file)
+        self._build_index(list(rewards))
+        self._signature = self._file_signature()
+    
+    def all(self) -> List[Dict]:
+        """全部奖励（文件中的顺序）"""
+        self._ensure_loaded()
+        return list(self._rewards)
+    
+    def get(self, reward_id: str) -> Optional[Dict]:
+        self._ensure_loaded()
+        return self._by_id.get(reward_id)
+    
+    def categories(self) -> List[str]:
+        self._ensure_loaded()
+        return sorted(self._by_category)
+    
+    def by_category(self, category: Optional[str] = None) -> List[Dict]:
+        """某个类别（不传时为全部）的奖励，按积分从低到高"""
+        self._ensure_loaded()
+        if category:
+            return list(self._by_category.get(category, []))
+        return list(self._by_points)
+    
+    def affordable(self, points: int) -> List[Dict]:
+        """积分不超过points的奖励，按积分从低到高"""
+        self._ensure_loaded()
+        return self._by_points[:bisect_right(self._points, points)]
+    
+    def _prefix_matches(self, token: str) -> Set[str]:
+        """以token开头的所有索引词对应的奖励id"""
+        matches = set()
+        start = bisect_left(self._sorted_terms, token)
+        for term in self._sorted_terms[start:]:
+            if not term.startswith(token):
+                break
+            matches |= self._postings[term]
+        return matches
+    
+    def search(self, query: str = '', category: Optional[str] = None,
+               max_points: Optional[int] = None, page: int = 1,
+               page_size: int = REWARDS_PAGE_SIZE) -> Dict:
+        """
+        按关键词、类别和积分上限筛选奖励，按积分从低到高分页返回
+        
+        返回 {'items', 'total', 'page', 'pages'}；查询中的每个词都必须匹配名称或描述。
+        没有关键词时按类别列表和积分数组二分截取，只取当前页的条目。
+        """
+        self._ensure_loaded()
+        if category:
+            candidates = self._by_category.get(category, [])
+            points = self._category_points.get(category, [])
+        else:
+            candidates = self._by_points
+            points = self._points
+        if max_points is not None:
+            candidates = candidates[:bisect_right(points, max_points)]
+        
+        tokens = list(dict.fromkeys(_terms(query.lower()) if query else ()))
+        if tokens:
+            # 多字的中文查询只用相邻两字的词，单字只在单独输入一个字时使用
+            bigrams = [t for t in tokens if len(t) > 1 or not ('\u3400' <= t <= '\u9fff')]
+            ids = None
+            for token in (bigrams or tokens):
+                matched = self._prefix_matches(token)
+                ids = matched if ids is None else ids & matched
+                if not ids:
+                    break
+            candidates = [r for r in candidates if r['id'] in ids]
+        
+        total = len(candidates)
+        pages = max(1, math.ceil(total / page_size))
+        page = min(max(1, page), pages)
+        start = (page - 1) * page_size
+        return {
+            'items': list(candidates[start:start + page_size]),
+            'total': total,
+            'page': page,
+            'pages': pages
+        }
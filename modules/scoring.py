@@ -3,6 +3,10 @@ from datetime import datetime, timedelta
 import re
 
 
+# 积分规则版本：修改积分规则后递增，已生成的报告会因此失效并重新生成
+RULES_VERSION = 1
+
+
 class ScoringSystem:
     def __init__(self):
         self.scoring_rules = self._init_scoring_rules()
@@ -0,0 +1,319 @@
+import os
+import re
+import json
+import math
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows：只在进程内加锁
+    fcntl = None
+
+
+# 参与检索的自由文本答案
+SEARCHABLE_ANSWER_FIELDS = ('special_achievement', 'tomorrow_plan')
+
+REPORT_FILE_PATTERN = re.compile(r'^daily_report_(\d{4}-\d{2}-\d{2})\.md$')
+
+_CJK_RUN = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]+')
+_WORD = re.compile(r'[a-z0-9]+')
+
+# BM25参数
+_K1 = 1.2
+_B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    """中文按相邻两字切分（单字的片段保留单字），英文和数字按整词，统一小写"""
+    text = text.lower()
+    tokens = []
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    tokens.extend(_WORD.findall(text))
+    return tokens
+
+
+class SearchIndex:
+    """
+    历史报告和文字答案的倒排索引
+    
+    每天最多两个文档：report（每日报告Markdown）和answers（特别成就、明天计划等文字答案）。
+    保存问卷、写入报告、回档时增量更新，查询只读索引，不再扫描全部历史；
+    索引文件不存在时第一次使用会完整建立一次，手动修改过报告后用rebuild()重建。
+    菜单、--watch等多个进程共用索引文件：读改写都持有文件锁，文件被其他进程改过时先重新读入。
+    结果按BM25得分汇总到日期，查询中的每个词都必须出现。
+    """
+    
+    def __init__(self, data_manager, report_dir: str = "reports",
+                 index_file: str = os.path.join("data", "search_index.json")):
+        self.data_manager = data_manager
+        self.report_dir = report_dir
+        self.index_file = index_file
+        self.lock_file = index_file + '.lock'
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._index: Optional[Dict] = None
+        self._signature = None
+    
+    # ---------- 存储 ----------
+    
+    @contextmanager
+    def _locked(self):
+        """持有文件锁（同一线程内可重入）"""
+        with self._lock:
+            if self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            os.makedirs(os.path.dirname(self.index_file) or '.', exist_ok=True)
+            with open(self.lock_file, 'a') as lock:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                self._lock_depth = 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth = 0
+                    if fcntl:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+    
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.index_file)
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
+    
+    def _load(self) -> Dict:
+        """当前索引（调用方持有锁）；其他进程写过索引文件后重新读入"""
+        signature = self._file_signature()
+        if self._index is None or signature != self._signature:
+            try:
+                with open(self.index_file, 'r', encoding='utf-8') as f:
+                    self._index = json.load(f)
+                self._signature = signature
+            except (OSError, ValueError):
+                # 还没有索引（或文件损坏）：先从全部报告和问卷建立，之后才做增量更新
+                self._index = {'docs': {}, 'postings': {}, 'total_length': 0}
+                self._sync(self._index)
+                self._save()
+        return self._index
+    
+    def _save(self):
+        os.makedirs(os.path.dirname(self.index_file) or '.', exist_ok=True)
+        tmp_path = self.index_file + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_file)
+        self._signature = self._file_signature()
+    
+    # ---------- 更新 ----------
+    
+    def _remove_doc(self, index: Dict, doc_id: str):
+        doc = index['docs'].pop(doc_id, None)
+        if not doc:
+            return
+        index['total_length'] -= doc['length']
+        for term in doc['terms']:
+            postings = index['postings'].get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del index['postings'][term]
+    
+    def _add_doc(self, index: Dict, doc_id: str, date: str, source: str,
+                 text: str, signature: str):
+        counts: Dict[str, int] = {}
+        for token in tokenize(text):
+            counts[token] = counts.get(token, 0) + 1
+        length = sum(counts.values())
+        index['docs'][doc_id] = {
+            'date': date,
+            'source': source,
+            'length': length,
+            'signature': signature,
+            'terms': list(counts)
+        }
+        index['total_length'] += length
+        for term, tf in counts.items():
+            index['postings'].setdefault(term, {})[doc_id] = tf
+    
+    def _update(self, index: Dict, date: str, source: str, text: str, signature: str) -> bool:
+        doc_id = f"{source}:{date}"
+        doc = index['docs'].get(doc_id)
+        if doc and doc['signature'] == signature:
+            return False
+        if not doc and not text.strip():
+            return False
+        self._remove_doc(index, doc_id)
+        if text.strip():
+            self._add_doc(index, doc_id, date, source, text, signature)
+        return True
+    
+    @staticmethod
+    def _answers_text(response: Dict) -> str:
+        return '\n'.join(str(response.get(key) or '') for key in SEARCHABLE_ANSWER_FIELDS)
+    
+    def _report_signature(self, date: str) -> Optional[str]:
+        try:
+            stat = os.stat(self._report_path(date))
+        except OSError:
+            return None
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+    
+    def _report_path(self, date: str) -> str:
+        return os.path.join(self.report_dir, f"daily_report_{date}.md")
+    
+    def index_report(self, date: str):
+        """报告写入后调用：重新索引当天的报告"""
+        signature = self._report_signature(date)
+        if signature is None:
+            return
+        with open(self._report_path(date), 'r', encoding='utf-8') as f:
+            text = f.read()
+        with self._locked():
+            if self._update(self._load(), date, 'report', text, signature):
+                self._save()
+    
+    def index_answers(self, response: Dict):
+        """问卷保存后调用：重新索引当天的文字答案"""
+        text = self._answers_text(response)
+        signature = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        with self._locked():
+            if self._update(self._load(), response['date'], 'answers', text, signature):
+                self._save()
+    
+    def remove_date(self, date: str):
+        """回档时删除当天的所有文档"""
+        with self._locked():
+            index = self._load()
+            for source in ('report', 'answers'):
+                self._remove_doc(index, f"{source}:{date}")
+            self._save()
+    
+    def rebuild(self) -> int:
+        """丢弃现有索引，从全部报告和问卷重新建立，返回文档数"""
+        with self._locked():
+            self._index = {'docs': {}, 'postings': {}, 'total_length': 0}
+            self._sync(self._index)
+            self._save()
+            return len(self._index['docs'])
+    
+    def sync(self) -> int:
+        """补上索引之外的改动（手动编辑或删除的报告），返回更新的文档数"""
+        with self._locked():
+            changed = self._sync(self._load())
+            if changed:
+                self._save()
+        return changed
+    
+    def _sync(self, index: Dict) -> int:
+        changed = 0
+        seen = set()
+        
+        if os.path.isdir(self.report_dir):
+            for name in os.listdir(self.report_dir):
+                match = REPORT_FILE_PATTERN.match(name)
+                if not match:
+                    continue
+                date = match.group(1)
+                seen.add(f"report:{date}")
+                signature = self._report_signature(date)
+                doc = index['docs'].get(f"report:{date}")
+                if signature and (not doc or doc['signature'] != signature):
+                    with open(self._report_path(date), 'r', encoding='utf-8') as f:
+                        changed += self._update(index, date, 'report', f.read(), signature)
+        
+        for response in self.data_manager.get_all_responses():
+            text = self._answers_text(response)
+            signature = hashlib.sha1(text.encode('utf-8')).hexdigest()
+            seen.add(f"answers:{response['date']}")
+            changed += self._update(index, response['date'], 'answers', text, signature)
+        
+        for doc_id in [d for d in index['docs'] if d not in seen]:
+            self._remove_doc(index, doc_id)
+            changed += 1
+        return changed
+    
+    # ---------- 检索 ----------
+    
+    def search(self, query: str, limit: int = 10, sync: bool = False) -> List[Dict]:
+        """
+        返回按相关度排序的日期：[{'date', 'score', 'sources', 'snippet'}, ...]
+        
+        sync=True时先完整同步一次（扫描全部报告和问卷）。
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        if sync:
+            self.sync()
+        
+        with self._locked():
+            index = self._load()
+            postings = [index['postings'].get(term) for term in terms]
+            if not all(postings):
+                return []
+            
+            docs = index['docs']
+            doc_count = len(docs)
+            avg_length = index['total_length'] / doc_count if doc_count else 0
+            
+            # 从最短的倒排表开始求交集
+            candidates = set(min(postings, key=len))
+            for posting in postings:
+                candidates.intersection_update(posting)
+            
+            by_date: Dict[str, Dict] = {}
+            for doc_id in candidates:
+                doc = docs[doc_id]
+                score = 0.0
+                for posting in postings:
+                    tf = posting[doc_id]
+                    idf = math.log(1 + (doc_count - len(posting) + 0.5) / (len(posting) + 0.5))
+                    norm = tf + _K1 * (1 - _B + _B * doc['length'] / (avg_length or 1))
+                    score += idf * tf * (_K1 + 1) / norm
+                entry = by_date.setdefault(doc['date'], {'date': doc['date'], 'score': 0.0, 'sources': []})
+                entry['score'] += score
+                entry['sources'].append(doc['source'])
+        
+        results = sorted(by_date.values(), key=lambda e: (-e['score'], e['date']))[:limit]
+        for entry in results:
+            entry['score'] = round(entry['score'], 3)
+            entry['sources'].sort()
+            entry['snippet'] = self._snippet(entry['date'], entry['sources'], query)
+        return results
+    
+    def _snippet(self, date: str, sources: Iterable[str], query: str, width: int = 30) -> str:
+        """取命中位置附近的一小段原文（只为返回的结果读取原文）"""
+        texts = []
+        if 'answers' in sources:
+            response = self.data_manager.get_response_by_date(date)
+            if response:
+                texts.append(self._answers_text(response))
+        if 'report' in sources:
+            try:
+                with open(self._report_path(date), 'r', encoding='utf-8') as f:
+                    texts.append(f.read())
+            except OSError:
+                pass
+        
+        needle = query.strip().lower()
+        for text in texts:
+            position = text.lower().find(needle)
+            if position < 0:
+                continue
+            start = max(0, position - width)
+            end = min(len(text), position + len(needle) + width)
+            snippet = ' '.join(text[start:end].split())
+            return ('…' if start else '') + snippet + ('…' if end < len(text) else '')
+        return ''